@@ -0,0 +1,124 @@
+"""
+Throughput benchmark of the extraction runners against the local mock Gemini server.
+Reports requests/s, p50/p95 latency per ad and the retry overhead of each runner configuration.
+
+Usage:
+    python3 ./script/benchmark_extraction.py --n 200 --configs sync async:4 async:16 \
+        --latency lognormal:-1,0.5 --errors 429=0.05,503=0.02 --max-tokens-rate 0.02
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from extract_property_attributes_gemini import (
+    configure_model,
+    extract_attributes_with_retry,
+)
+from helpers.helpers_retry import reset_breakers
+from helpers.helpers_telemetry import percentile
+from mock_gemini_server import get_parser, mock_from_args, start_server
+
+
+def _timed(model, text, stream=False):
+    start = time.perf_counter()
+    result = extract_attributes_with_retry(model, text, stream=stream)
+    return result, time.perf_counter() - start
+
+
+def run_sync(models, texts, stream=False):
+    """The sequential runner of `extract_property_attributes_gemini.py`."""
+    return [
+        _timed(models[i % len(models)], text, stream) for i, text in enumerate(texts)
+    ]
+
+
+def run_async(models, texts, workers, stream=False):
+    """The runner of `extract_property_attributes_gemini_async.py`, with `workers` threads."""
+
+    async def _run():
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tasks = [
+                loop.run_in_executor(
+                    executor, _timed, models[i % len(models)], text, stream
+                )
+                for i, text in enumerate(texts)
+            ]
+            return await asyncio.gather(*tasks)
+
+    return asyncio.run(_run())
+
+
+def benchmark(config, args, texts, num_keys=1):
+    """
+    Run one runner configuration, e.g. "sync" or "async:8", against a fresh mock server and
+    with fresh circuits: one tripped by the errors of an earlier run would still be open.
+    """
+    reset_breakers()
+    mock = mock_from_args(args)
+    server, endpoint = start_server(mock)
+    try:
+        models = [
+            configure_model(f"mock-key-{i}", transport="rest", api_endpoint=endpoint)
+            for i in range(num_keys)
+        ]
+        runner, _, workers = config.partition(":")
+        start = time.perf_counter()
+        if runner == "sync":
+            timed = run_sync(models, texts, args.stream)
+        elif runner == "async":
+            timed = run_async(models, texts, int(workers or 8), args.stream)
+        else:
+            raise ValueError(f"Unknown runner: {runner}")
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    latencies = [latency for _, latency in timed]
+    failed = sum(
+        1
+        for result, _ in timed
+        if result is None
+        or (isinstance(result.get("output"), dict) and "error" in result["output"])
+    )
+    requests = mock.stats.get("requests", 0)
+    return {
+        "config": config,
+        "ads": len(texts),
+        "failed": failed,
+        "elapsed_s": elapsed,
+        "requests_per_s": requests / elapsed,
+        "ads_per_s": len(texts) / elapsed,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "retry_overhead": requests / len(texts) - 1,
+    }
+
+
+def print_report(rows):
+    header = f"{'config':<12}{'ads':>6}{'failed':>8}{'req/s':>9}{'ads/s':>9}{'p50 s':>8}{'p95 s':>8}{'retries':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['config']:<12}{r['ads']:>6}{r['failed']:>8}{r['requests_per_s']:>9.2f}"
+            f"{r['ads_per_s']:>9.2f}{r['p50_s']:>8.3f}{r['p95_s']:>8.3f}{r['retry_overhead']:>9.1%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = get_parser()
+    parser.description = __doc__.split("\n\n")[0]
+    parser.add_argument("--n", type=int, default=100, help="Number of ads.")
+    parser.add_argument("--configs", nargs="+", default=["sync", "async:4", "async:16"])
+    parser.add_argument("--keys", type=int, default=1, help="Number of API keys.")
+    parser.add_argument(
+        "--stream", action="store_true", help="Stream and parse incrementally."
+    )
+    args = parser.parse_args()
+
+    texts = list(mock_from_args(args).recorded)[: args.n]
+    if not texts:
+        raise SystemExit("No recorded outputs found, see --recordings.")
+    print_report([benchmark(config, args, texts, args.keys) for config in args.configs])
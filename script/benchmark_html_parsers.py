@@ -0,0 +1,119 @@
+"""
+Benchmark of the HTML parser backends (see `helpers/helpers_parse.py`) on the saved loozap and
+Ethiopia Property Centre (EPC) ad pages: per page, the time to build the tree and the time of
+the scraper's parse function, and whether the records match those of the bs4 reference.
+
+Usage:
+    python3 -m script.benchmark_html_parsers --backends selectolax lxml bs4 --max-files 200
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import time
+
+from script.helpers.helpers_io import list_files
+from script.helpers.helpers_parse import available_backends, parse_html
+from script.scrapers.scrape_ethiopiapropertycentre_from_file import (
+    parse_product_details,
+)
+from script.scrapers.scrape_loozap_async import parse_details
+
+SITES = {
+    "loozap": (
+        "./data/housing/raw/loozap/html",
+        lambda html, path, backend: parse_details(
+            html, os.path.basename(path), backend
+        ),
+    ),
+    "epc": (
+        "./data/housing/raw/ethiopiapropertycentre/html",
+        lambda html, path, backend: parse_product_details(
+            html, os.path.basename(path), backend
+        ),
+    ),
+}
+
+
+def load_pages(html_dir, max_files=None):
+    files = sorted(list_files(html_dir, "*.html"))[:max_files]
+    pages = []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            pages.append((path, f.read()))
+    return pages
+
+
+def time_per_page(fn, pages, repeat):
+    """The best time over `repeat` runs of `fn(html, path)` on each page, and the results."""
+    times, results = [], []
+    for path, html in pages:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn(html, path)
+            best = min(best, time.perf_counter() - start)
+        times.append(best)
+        results.append(result)
+    return times, results
+
+
+def benchmark(parse, pages, backends, repeat=3):
+    """Per backend: the per-page tree and parse times, and the records that differ from bs4's."""
+    rows = {}
+    reference = None
+    # The scrapers log and print their parse errors, keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for backend in ["bs4"] + [b for b in backends if b != "bs4"]:
+            tree_times, _ = time_per_page(
+                lambda html, path: parse_html(html, backend), pages, repeat
+            )
+            parse_times, records = time_per_page(
+                lambda html, path: parse(html, path, backend), pages, repeat
+            )
+            if reference is None:
+                reference = records
+            rows[backend] = {
+                "tree_ms": statistics.median(tree_times) * 1e3,
+                "parse_ms": statistics.median(parse_times) * 1e3,
+                "p95_ms": sorted(parse_times)[int(0.95 * (len(parse_times) - 1))] * 1e3,
+                "pages_per_s": len(pages) / max(sum(parse_times), 1e-9),
+                "differ": sum(r != ref for r, ref in zip(records, reference)),
+            }
+    return {b: rows[b] for b in backends if b in rows}
+
+
+def print_table(site, n_pages, rows):
+    header = f"{site} ({n_pages} pages)"
+    header = f"{header:<28}{'tree ms':>9}{'parse ms':>10}{'p95 ms':>9}{'pages/s':>9}{'differ':>8}"
+    print(header)
+    print("-" * len(header))
+    base = rows.get("bs4", {}).get("parse_ms")
+    for backend, r in rows.items():
+        speedup = f"  x{base / r['parse_ms']:.1f}" if base else ""
+        print(
+            f"{backend:<28}{r['tree_ms']:>9.2f}{r['parse_ms']:>10.2f}{r['p95_ms']:>9.2f}"
+            f"{r['pages_per_s']:>9.0f}{r['differ']:>8}{speedup}"
+        )
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backends", nargs="*", default=available_backends())
+    parser.add_argument("--sites", nargs="*", default=list(SITES))
+    parser.add_argument("--max-files", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for site in args.sites:
+        html_dir, parse = SITES[site]
+        pages = load_pages(html_dir, args.max_files)
+        if not pages:
+            print(f"No saved pages for {site} in {html_dir}, skipped.\n")
+            continue
+        print_table(
+            site, len(pages), benchmark(parse, pages, args.backends, args.repeat)
+        )
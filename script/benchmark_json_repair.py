@@ -0,0 +1,117 @@
+"""
+Compare the single-pass JSON repair parser with the previous `parse_json` cascade on the outputs
+the extraction could not parse (the raw string outputs of the `*_extracted_property_attributes_gemini.json`
+files): share parsed, agreement, time per output, and the repairs applied.
+
+Usage:
+    python3 ./script/benchmark_json_repair.py --repeat 5
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import time
+from pathlib import Path
+
+from helpers.helpers_io import list_files, read_json
+from helpers.helpers_json import repair_json
+from tidy_extracted_property_attributes_gemini import parse_json_cascade
+
+
+def load_failure_corpus(paths):
+    """The raw (unparsed) outputs of past extractions."""
+    corpus = []
+    for path in paths:
+        for item in read_json(path):
+            output = item.get("output")
+            if isinstance(output, list) and len(output) == 1:
+                output = output[0]
+            if isinstance(output, str) and output.startswith("```json"):
+                corpus.append(output)
+    return corpus
+
+
+def _cascade(text):
+    try:
+        return parse_json_cascade(text)
+    except ValueError:
+        return None
+
+
+def _repair(text):
+    try:
+        return repair_json(text)[0]
+    except ValueError:
+        return None
+
+
+def _canonical(value):
+    # The cascade turns inner double quotes into single quotes, the repair parser keeps them
+    return json.dumps(value, sort_keys=True, ensure_ascii=False).replace('\\"', "'")
+
+
+def time_parser(parse, corpus, repeat):
+    """The results of `parse` on the corpus, and the best time per output over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [parse(text) for text in corpus]
+        best = min(best, time.perf_counter() - start)
+    return results, best / max(len(corpus), 1)
+
+
+def benchmark(corpus, repeat=5):
+    # The cascade prints on failure, keep it out of the report (and the timing)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cascade, cascade_time = time_parser(_cascade, corpus, repeat)
+    repaired, repair_time = time_parser(_repair, corpus, repeat)
+
+    repairs = {}
+    for text, value in zip(corpus, repaired):
+        if value is None:
+            continue
+        for name, count in repair_json(text)[1].items():
+            repairs[name] = repairs.get(name, 0) + count
+    both = [
+        (c, r) for c, r in zip(cascade, repaired) if c is not None and r is not None
+    ]
+    return {
+        "outputs": len(corpus),
+        "cascade_parsed": sum(c is not None for c in cascade),
+        "repair_parsed": sum(r is not None for r in repaired),
+        "agree": sum(_canonical(c) == _canonical(r) for c, r in both),
+        "both_parsed": len(both),
+        "cascade_us": cascade_time * 1e6,
+        "repair_us": repair_time * 1e6,
+        "repairs": repairs,
+    }
+
+
+def print_report(r):
+    n = max(r["outputs"], 1)
+    print(f"Failure corpus: {r['outputs']} outputs")
+    print(f"{'parser':<10}{'parsed':>10}{'share':>9}{'us/output':>12}")
+    for name in ("cascade", "repair"):
+        parsed = r[f"{name}_parsed"]
+        print(f"{name:<10}{parsed:>10}{parsed / n:>9.1%}{r[f'{name}_us']:>12.1f}")
+    print(f"Agreement where both parse: {r['agree']}/{r['both_parsed']}")
+    print("Repairs applied:")
+    for name, count in sorted(r["repairs"].items(), key=lambda x: -x[1]):
+        print(f"  {name:<20}{count:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", nargs="*", default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data_dir = Path("./data/housing/processed/structured")
+    files = args.files or list_files(
+        str(data_dir), "*_extracted_property_attributes_gemini.json"
+    )
+    corpus = load_failure_corpus(files)
+    if not corpus:
+        raise SystemExit("No unparsed outputs found, see --files.")
+    print_report(benchmark(corpus, args.repeat))
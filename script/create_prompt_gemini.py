@@ -1,6 +1,13 @@
+from functools import lru_cache
+
 from examples_gemin_pro import EXAMPLES
+from extract_property_attributes_rules import ad_tags
+from helpers.helpers_fewshot import ExampleIndex, split_examples
 from property_schema import PROPERTY_SCHEMA
 
+# Number of few-shot examples selected for each ad
+FEW_SHOT_K = 3
+
 role = """
 Role: Data Extraction Expert
 Objective: Extract, translate, and structure detailed real estate property information from Amharic or English advertisements into JSON format. Focus on capturing essential details such as price, size, address, and other typical real estate information accurately. Mark any missing/irrelevant information as 'null'.
@@ -58,4 +65,31 @@ examples = f"**Examples**:\n---\n{EXAMPLES}\n---"
 
 
 # Combine prompt parts
-PROMPT = f"{role}\n{instructions}\n{JSON_SCHEMA}\n{key_considerations}\n{examples}"
+PROMPT_BASE = f"{role}\n{instructions}\n{JSON_SCHEMA}\n{key_considerations}"
+PROMPT = f"{PROMPT_BASE}\n{examples}"  # with all the examples
+
+# The examples as an indexed bank, to include only the ones most similar to each ad
+EXAMPLES_BANK = split_examples(EXAMPLES)
+EXAMPLES_INDEX = ExampleIndex(EXAMPLES_BANK, tagger=ad_tags)
+
+
+def select_examples(text, k=FEW_SHOT_K):
+    """The indices of the `k` examples in `EXAMPLES_BANK` most similar to `text`."""
+    return EXAMPLES_INDEX.top_k(text, k)
+
+
+@lru_cache(maxsize=256)
+def _prompt_with_examples(example_ids):
+    # Ads with the same selected examples share the same prompt (prefix)
+    blocks = "\n\n".join(EXAMPLES_BANK[i].block for i in example_ids)
+    return f"{PROMPT_BASE}\n**Examples**:\n---\n{blocks}\n---"
+
+
+def build_prompt(text, k=FEW_SHOT_K):
+    """
+    The prompt for an ad, with only the `k` most similar few-shot examples.
+    Use `k=None` for all the examples (`PROMPT`).
+    """
+    if k is None or k >= len(EXAMPLES_BANK):
+        return PROMPT
+    return _prompt_with_examples(select_examples(text, k))
@@ -1,16 +1,38 @@
 import csv
+import hashlib
 import logging
 import os
 import platform
 import subprocess
+import threading
 import time
 import json
 from tqdm import tqdm
 import google.generativeai as genai
 
-from create_prompt_gemini import PROMPT
+from create_prompt_gemini import build_prompt
+from extract_property_attributes_rules import split_fast_path
+from helpers.helpers_dedup import apply_overrides, group_near_duplicates
 from helpers.helpers_io import setup_logger, write_json
-
+from helpers.helpers_json import (
+    IncompleteJSONError,
+    IncrementalJSONParser,
+    MalformedJSONError,
+    repair_json,
+)
+from helpers.helpers_preprocess import preprocess_ad_text
+from helpers.helpers_telemetry import emit, make_metrics, open_sink, set_sink
+from helpers.helpers_retry import (
+    AuthError,
+    CircuitOpenError,
+    LocationNotSupportedError,
+    MalformedResponseError,
+    MaxTokensError,
+    RateLimitError,
+    RetryPolicy,
+    ServerError,
+    get_breaker,
+)
 
 logger = logging.getLogger(__name__)
 setup_logger(__name__, "./logs/gemini.log")
@@ -43,9 +65,13 @@ def reconnect_vpn():
         return False
 
 
-def configure_model(api_key, temperature=0, top_p=0.9, **kwargs):
+def configure_model(
+    api_key, temperature=0, top_p=0.9, transport=None, api_endpoint=None, **kwargs
+):
     """
     Configures a Gemini Pro generative model with the given parameters.
+    `transport` and `api_endpoint` point the client at another server, e.g. the local
+    mock in `mock_gemini_server.py` with transport="rest".
     Returns:
         genai.GenerativeModel: The configured model.
     """
@@ -58,7 +84,8 @@ def configure_model(api_key, temperature=0, top_p=0.9, **kwargs):
 
     #     api_key = os.environ["GOOGLE_GEMINI_PRO_API_KEY"]
 
-    genai.configure(api_key=api_key)
+    client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+    genai.configure(api_key=api_key, transport=transport, client_options=client_options)
 
     # Set up the model
     generation_config = {
@@ -90,6 +117,8 @@ def configure_model(api_key, temperature=0, top_p=0.9, **kwargs):
         generation_config=generation_config,
         safety_settings=safety_settings,
     )
+    # Names the key's circuit (see `get_breakers`) without putting the key in the logs
+    model.key_id = hashlib.sha256(str(api_key).encode()).hexdigest()[:8]
 
     return model
 
@@ -133,22 +162,87 @@ def parse_response(response):
             )
             return response_text
 
+    finish_reason = get_finish_reason(response)
+    if finish_reason == "MAX_TOKENS":
+        # The output is truncated, if there is any
+        logger.error("Max tokens reached in `parse_response`.")
+        raise MaxTokensError("MAX_TOKENS")
     if not response.parts:
-        finish_reason = get_finish_reason(response)
-        if finish_reason == "MAX_TOKENS":
-            logger.error("Max tokens reached in `parse_response`.")
-            return error_output(text, "MAX_TOKENS")
-        else:
-            logger.error(
-                f"Empty response in `parse_response`. Finish Reason: {finish_reason}"
-            )
-            return error_output(
-                text, f"No parts in response. Finish Reason: {finish_reason}"
-            )
+        logger.error(
+            f"Empty response in `parse_response`. Finish Reason: {finish_reason}"
+        )
+        return {"error": f"No parts in response. Finish Reason: {finish_reason}"}
 
     return _parse_json(response.text)
 
 
+def parse_response_stream(response, on_record=None):
+    """
+    Parses a streamed response from the model incrementally, as the chunks arrive.
+    If the stream breaks the incremental parser, the rest of it is still received and the
+    whole text is parsed with `repair_json`.
+
+    Parameters:
+    response (object): The streamed response from the model (`stream=True`).
+    on_record (callable): Called with each record as soon as it is complete.
+
+    Returns:
+    list or dict: The parsed response.
+
+    Raises:
+    MalformedResponseError: If the JSON is truncated or can't be repaired, with the whole text received.
+    MaxTokensError: If the model stopped at `max_output_tokens`.
+    """
+    parser = IncrementalJSONParser()
+    received = []
+    passed = 0  # records passed on to `on_record`
+    error = None
+    for chunk in response:
+        if not chunk.parts:
+            continue
+        received.append(chunk.text)
+        if error is not None:
+            continue  # drain the stream, to repair the whole text
+        try:
+            records = parser.feed(chunk.text)
+        except MalformedJSONError as e:
+            logger.warning(f"Malformed JSON in `parse_response_stream`: {e}")
+            error = e
+            records = []
+        passed += len(records)
+        for record in records:
+            if on_record is not None:
+                on_record(record)
+
+    finish_reason = get_finish_reason(response)
+    if finish_reason == "MAX_TOKENS":
+        logger.error("Max tokens reached in `parse_response_stream`.")
+        raise MaxTokensError("MAX_TOKENS")
+    if not received:
+        logger.error(
+            f"Empty response in `parse_response_stream`. Finish Reason: {finish_reason}"
+        )
+        return {"error": f"No parts in response. Finish Reason: {finish_reason}"}
+    text = "".join(received)
+    if error is None:
+        try:
+            return parser.close()
+        except IncompleteJSONError as e:
+            logger.error(f"Incomplete JSON in `parse_response_stream`: {e}")
+            raise MalformedResponseError(str(e), text) from e
+    try:
+        output, repairs = repair_json(text)
+    except json.JSONDecodeError as e:
+        logger.error(f"Unrepairable JSON in `parse_response_stream`: {e}")
+        raise MalformedResponseError(str(e), text) from e
+    logger.info(f"Repaired JSON in `parse_response_stream`: {repairs}")
+    if on_record is not None and isinstance(output, list):
+        # The records after the ones already passed on
+        for record in output[passed:]:
+            on_record(record)
+    return output
+
+
 def error_output(text, error_message):
     """
     Helper function to generate error output.
@@ -162,69 +256,183 @@ def error_output(text, error_message):
     return {"input": text, "output": {"error": error_message}}
 
 
-def extract_attributes(model, text):
+def record_usage(response, usage):
+    """Add the token counts and finish reason of a response to `usage` (a dict), if any."""
+    metadata = getattr(response, "usage_metadata", None)
+    for field, key in (
+        ("prompt_token_count", "prompt_tokens"),
+        ("candidates_token_count", "response_tokens"),
+    ):
+        usage[key] = usage.get(key, 0) + (getattr(metadata, field, 0) or 0)
+    try:
+        usage["finish_reason"] = get_finish_reason(response)
+    except IndexError:
+        pass  # no candidates, e.g. a stream that failed before its first chunk
+
+
+def extract_attributes(model, text, stream=False, on_record=None, usage=None):
     """
     Extract attributes from the model's response.
 
     Parameters:
     model (object): The model.
     text (str): The input text.
+    stream (bool): Whether to stream the response and parse it as it arrives.
+    on_record (callable): With `stream`, called with each record as soon as it is complete.
+    usage (dict): If given, the token counts and finish reason of the response are added to it.
 
     Returns:
     dict: The input text and extracted attributes.
+
+    Raises:
+    MaxTokensError: If the model stopped at `max_output_tokens`.
+    MalformedResponseError: With `stream`, if the JSON is truncated or can't be repaired.
     """
-    text_clean = " ".join(text.split())
-    prompt_parts = f'{PROMPT}\n**Input**: "{text_clean}"\n**Output**: '
-    response = model.generate_content(prompt_parts)
-    output = parse_response(response)
-    if "error" in output and output["error"] == "MAX_TOKENS":
-        raise Exception(output["error"])
+    text_clean = preprocess_ad_text(text)
+    prompt = build_prompt(text_clean)
+    prompt_parts = f'{prompt}\n**Input**: "{text_clean}"\n**Output**: '
+    if stream:
+        response = model.generate_content(prompt_parts, stream=True)
+        try:
+            output = parse_response_stream(response, on_record)
+        finally:
+            if usage is not None:
+                record_usage(response, usage)
+    else:
+        response = model.generate_content(prompt_parts)
+        if usage is not None:
+            record_usage(response, usage)
+        output = parse_response(response)
     return {"input": text, "output": output}
 
 
-def extract_attributes_with_retry(model, text, max_retries=4):
+# Retries on 429/5xx with full-jitter backoff. MAX_TOKENS is not retried: at temperature 0
+# the same prompt stops at the same place.
+RETRY_POLICY = RetryPolicy(max_retries=4, base_delay=1.0, max_delay=60.0)
+# Times an ad waits for an open circuit before it is given up, about 5 min with the key's 30s
+MAX_CIRCUIT_RETRIES = 10
+
+
+def _reconnect_vpn_in_background(breaker):
+    # Runs once each time the region circuit opens, instead of in every worker's retry loop
+    threading.Thread(target=reconnect_vpn, daemon=True).start()
+
+
+def get_breakers(model):
+    """
+    The circuits guarding a model: one per API key for rate limits and server errors, shared
+    by the models configured with that key (e.g. with a longer output), and one shared by all
+    models for the region (400 location not supported).
     """
-    Extract attributes with retries on certain exceptions.
+    key = getattr(model, "key_id", None) or model.model_name
+    key_breaker = get_breaker(f"gemini:{key}", failure_threshold=5, reset_timeout=30)
+    region_breaker = get_breaker(
+        "gemini:region",
+        failure_threshold=1,
+        reset_timeout=60,
+        trip_on=(LocationNotSupportedError,),
+        on_open=_reconnect_vpn_in_background,
+    )
+    return [key_breaker, region_breaker]
+
+
+def extract_attributes_with_retry(
+    model, text, max_retries=4, policy=None, stream=False, labels=None
+):
+    """
+    Extract attributes with retries on transient errors (see `helpers_retry.RetryPolicy`).
+    With `stream`, a response that can't be repaired (see `parse_response_stream`) is retried.
+    An open circuit is waited out and the text retried (up to `MAX_CIRCUIT_RETRIES` times), and
+    so is a location error, after the region circuit reconnected the VPN.
+    The metrics of the request are sent to the telemetry sink (see `helpers_telemetry.set_sink`).
 
     Parameters:
     model (object): The model.
     text (str): The input text.
-    max_retries (int): The maximum number of retries.
+    max_retries (int): The maximum number of attempts, if `policy` is not given.
+    policy (RetryPolicy): The retry policy, defaults to `RETRY_POLICY`.
+    stream (bool): Whether to stream the responses, see `extract_attributes`.
+    labels (dict): Metrics fields of the request, e.g. {"source": ..., "key_index": ..., "ads": ...}.
 
     Returns:
-    dict: The input text and extracted attributes.
+    dict: The input text and extracted attributes, or the error as output.
     """
-    retry_delay = 1  # Start with 1 second
-    max_token_retry = 0
+    if policy is None:
+        policy = RETRY_POLICY
+        if max_retries != policy.max_retries:
+            policy = RetryPolicy(max_retries, policy.base_delay, policy.max_delay)
+    usage = {}
+    retries = []
+    start = time.perf_counter()
+    result = _extract_with_retry(model, text, policy, stream, usage, retries)
+    output = result["output"]
+    error = output.get("error") if isinstance(output, dict) else None
+    emit(
+        make_metrics(
+            model=model.model_name,
+            latency=time.perf_counter() - start,
+            attempts=len(retries) + 1,
+            parsed=isinstance(output, (dict, list)) and error is None,
+            error=error,
+            **usage,
+            **(labels or {}),
+        )
+    )
+    return result
 
-    for attempt in range(max_retries):
+
+def _extract_with_retry(model, text, policy, stream, usage, retries):
+    breakers = get_breakers(model)
+    region_breaker = breakers[-1]
+    location_retries = 0
+    circuit_retries = 0
+    while True:
         try:
-            return extract_attributes(model, text)
+            return policy.call(
+                extract_attributes,
+                model,
+                text,
+                stream,
+                usage=usage,
+                breakers=breakers,
+                on_retry=retries.append,
+            )
+        except MaxTokensError:
+            return error_output(text, "Max retries reached for exception: MAX_TOKENS")
+        except CircuitOpenError as e:
+            # Not a failure of the ad: wait until the circuit lets a call through and retry it,
+            # but not forever, e.g. if the key's quota is exhausted
+            circuit_retries += 1
+            if circuit_retries > MAX_CIRCUIT_RETRIES:
+                logger.error(f"Circuit still open, giving up: {e}")
+                return error_output(text, f"Circuit open: {e}")
+            delay = max(max(breaker.retry_in() for breaker in breakers), 1.0)
+            logger.warning(f"{e} Retrying in {delay:.0f}s.")
+            time.sleep(delay)
+        except MalformedResponseError as e:
+            logger.error(f"Max retries reached, keeping the raw output: {e}")
+            # Stored as the unparsed output, as `parse_response` does, for `parse_json` to repair
+            return {"input": text, "output": e.text or {"error": f"Malformed: {e}"}}
+        except (RateLimitError, ServerError) as e:
+            logger.error(f"Max retries reached: {e}")
+            return error_output(text, f"Server error: {e}")
+        except LocationNotSupportedError as e:
+            # The region circuit opened and reconnects the VPN: retry once it lets a call through
+            location_retries += 1
+            if location_retries >= policy.max_retries:
+                logger.error(f"FailedPrecondition: {e}.")
+                return error_output(text, f"FailedPrecondition: {e}")
+            logger.warning(
+                f"FailedPrecondition, retrying after the VPN reconnect: {e}."
+            )
+            retries.append(e)
+            time.sleep(max(region_breaker.retry_in(), 1.0))
+        except AuthError as e:
+            logger.error(f"Invalid or unauthorized API key: {e}")
+            return error_output(text, f"Auth error: {e}")
         except Exception as e:
-            err_str = str(e)
-            if "400" in err_str:
-                # FailedPrecondition: 400 User location is not supported for the API use.
-                logger.error(f"FailedPrecondition: {err_str}.")
-                reconnect_vpn()
-                time.sleep(retry_delay)
-            elif "429" in err_str:
-                logger.error(
-                    f"Rate limit exceeded: {err_str}. Retrying in {retry_delay}s."
-                )
-                time.sleep(retry_delay)
-                retry_delay *= 2  # exponential backoff
-            elif "MAX_TOKENS" in err_str:
-                max_token_retry += 1
-                if max_token_retry >= 1:  # retry only twice
-                    logger.error("Max retries reached for MAX_TOKENS error.")
-                    return error_output("Max retries reached for exception: MAX_TOKENS")
-            elif "500" in err_str or "503" in err_str:
-                logger.error(f"Service unavailable/Server error: {err_str}. Skipping.")
-                return error_output(text, f"Server error: {err_str}")
-            # Check if all retries are exhausted for any other errors
-            elif attempt == max_retries - 1:
-                logger.error("Max retries reached")
-                return error_output(text, "Max retries reached")
+            logger.exception(f"Failed to extract attributes: {e}")
+            return error_output(text, f"Unexpected error: {e}")
 
 
 def combine_text(row: dict[str, str]) -> str:
@@ -256,6 +464,30 @@ def load_property_texts(path: str) -> dict[str, list[str]]:
         return text_to_keys
 
 
+def map_group_results(extracted, group, text_to_keys):
+    """
+    Map the attributes extracted for a group's representative text to the keys of all its
+    near-duplicates, patching the fields that differ (see `helpers_dedup.field_overrides`).
+
+    Parameters:
+    extracted (dict): The input text and extracted attributes of the representative.
+    group (dict): {member text: field overrides}, as returned by `group_near_duplicates`.
+    text_to_keys (dict): {text: keys}, as returned by `load_property_texts`.
+
+    Returns:
+    list: One record per key.
+    """
+    results = []
+    for text, overrides in group.items():
+        output = apply_overrides(extracted["output"], overrides)
+        for key in text_to_keys[text]:
+            record = {"id": key, "input": text, "output": output}
+            if text != extracted["input"]:
+                record["near_duplicate_of"] = extracted["input"]
+            results.append(record)
+    return results
+
+
 if __name__ == "__main__":
     # Configure the model
     model = configure_model(os.environ.get("GOOGLE_GEMINI_PRO_API_KEY"))
@@ -268,15 +500,33 @@ if __name__ == "__main__":
         f"{data_dir}/structured/{base_name}_extracted_property_attributes_gemini.json"
     )
 
+    # Per-request metrics, see `report_extraction_metrics.py`
+    set_sink(open_sink("./logs/extraction_metrics.jsonl"))
+
     # Load the data
     text_to_keys = load_property_texts(path)
+    # Easy ads are extracted with rules, the rest is left for the model
+    n_texts = len(text_to_keys)
+    results, text_to_keys = split_fast_path(text_to_keys)
+    logger.info(
+        f"Rule-based fast path: {n_texts - len(text_to_keys)}/{n_texts} LLM calls avoided."
+    )
+    emit(make_metrics(source=base_name, parsed=True, cache_hit=True, ads=len(results)))
+    # Reposts of the same listing with minor edits are extracted only once
+    groups = group_near_duplicates(text_to_keys.keys())
+    logger.info(
+        f"Near-duplicate grouping: {len(text_to_keys)} unique texts -> {len(groups)} model calls."
+    )
 
-    results = []
-    # Extract attributes for each unique text and map the results to the keys
-    for i, text in enumerate(tqdm(text_to_keys.keys()), 1):
-        extracted = extract_attributes_with_retry(model, text)
-        for key in text_to_keys[text]:
-            results.append({"id": key, **extracted})
-        # Save the results, every 500 ads or at the end
-        if i % 500 == 0 or i == len(text_to_keys.keys()):
-            write_json(results, out_filename)
+    # Extract attributes for each representative text and map the results to the keys
+    for i, (text, group) in enumerate(tqdm(groups.items()), 1):
+        ads = sum(len(text_to_keys[member]) for member in group)
+        extracted = extract_attributes_with_retry(
+            model, text, labels={"source": base_name, "key_index": 0, "ads": ads}
+        )
+        results.extend(map_group_results(extracted, group, text_to_keys))
+        # Save the results every 500 ads
+        if i % 500 == 0:
+            write_json(results, out_filename, overwrite=True)
+    # and at the end, also when all the ads took the fast path
+    write_json(results, out_filename, overwrite=True)
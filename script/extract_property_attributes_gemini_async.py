@@ -2,13 +2,18 @@ import asyncio
 import logging
 from pathlib import Path
 
+from .extract_property_attributes_rules import split_fast_path
+from .helpers.helpers_dedup import group_near_duplicates
 from .helpers.helpers_io import read_json, write_json
+from .helpers.helpers_scheduling import LONG_MAX_OUTPUT_TOKENS, pack_batches, schedule
+from .helpers.helpers_telemetry import emit, make_metrics, open_sink, set_sink
 
 
 from .extract_property_attributes_gemini import (
     configure_model,
     extract_attributes_with_retry,
     load_property_texts,
+    map_group_results,
 )
 
 logging.basicConfig(
@@ -18,46 +23,86 @@ logging.basicConfig(
 )
 
 
-async def async_extract_attributes_with_retry(model, text, max_retries=4):
+async def async_extract_attributes_with_retry(
+    model, text, max_retries=4, stream=False, labels=None
+):
     loop = asyncio.get_running_loop()
     # Run the synchronous function in a ThreadPoolExecutor
     return await loop.run_in_executor(
-        None, extract_attributes_with_retry, model, text, max_retries
+        None,
+        extract_attributes_with_retry,
+        model,
+        text,
+        max_retries,
+        None,
+        stream,
+        labels,
     )
 
 
 async def process_texts(
-    texts, models, dump_interval=500, intermittent_prefix="intermittent_results"
+    texts,
+    models,
+    groups=None,
+    dump_interval=500,
+    intermittent_prefix="intermittent_results",
+    long_models=None,
+    max_batch_tokens=None,
+    stream=False,
+    source=None,
 ):
-    results = []
-    tasks = []
-    text_keys = list(texts.keys())  # Assuming texts is a dictionary
-
-    for i, text in enumerate(text_keys):
-        model = models[i % len(models)]
-        # Directly associate each task with its text
-        task = asyncio.create_task(async_extract_attributes_with_retry(model, text))
-        # Store the task and its corresponding text together
-        tasks.append((task, text))
-
-        if (i + 1) % dump_interval == 0 or i == len(text_keys) - 1:
-            # Wait for the current batch of tasks to complete
-            for task, associated_text in tasks:
-                completed_task = await task
-                # use associated_text to accurately index into results
-                if completed_task is not None:
-                    for key in texts[associated_text]:
-                        results.append({"id": key, **completed_task})
-                else:
-                    logging.error(f"Failed to extract attributes for {associated_text}")
-
-            # Dump the results to a JSON file
-            write_json(
-                results,
-                f"./data/housing/processed/structured/{intermittent_prefix}_{i // dump_interval}.json",
+    # `groups` maps representative texts to their near-duplicates, see `group_near_duplicates`
+    if groups is None:
+        groups = {text: {text: {}} for text in texts}
+    # Longest jobs first; the ones likely to hit MAX_TOKENS go to `long_models` up front
+    jobs = schedule(groups.keys())
+    n_long = sum(job.long_output for job in jobs)
+    if long_models is None:
+        long_models = models
+    elif n_long:
+        logging.info(f"{n_long}/{len(jobs)} texts sent to the long-output models.")
+    if max_batch_tokens:
+        batches = pack_batches(jobs, max_batch_tokens, dump_interval)
+    else:
+        batches = [
+            jobs[i : i + dump_interval] for i in range(0, len(jobs), dump_interval)
+        ]
+
+    for batch_index, batch in enumerate(batches):
+        tasks = []
+        for i, job in enumerate(batch):
+            pool = long_models if job.long_output else models
+            model = pool[i % len(pool)]
+            labels = {
+                "source": source,
+                "key_index": i % len(pool),
+                "ads": sum(len(texts[member]) for member in groups[job.text]),
+            }
+            # Directly associate each task with its text
+            task = asyncio.create_task(
+                async_extract_attributes_with_retry(
+                    model, job.text, stream=stream, labels=labels
+                )
             )
-            results = []  # Reset results after dumping
-            tasks = []  # Clear tasks for the next batch
+            tasks.append((task, job.text))
+
+        results = []
+        # Wait for the current batch of tasks to complete
+        for task, associated_text in tasks:
+            completed_task = await task
+            # use associated_text to accurately index into results
+            if completed_task is not None:
+                results.extend(
+                    map_group_results(completed_task, groups[associated_text], texts)
+                )
+            else:
+                logging.error(f"Failed to extract attributes for {associated_text}")
+
+        # Dump the results to a JSON file
+        write_json(
+            results,
+            f"./data/housing/processed/structured/{intermittent_prefix}_{batch_index}.json",
+        )
 
 
 def get_api_keys():
@@ -72,6 +117,13 @@ if __name__ == "__main__":
     # Prepare models each configured with a different API key
     api_keys = get_api_keys()
     models = [configure_model(api_key=key) for key in api_keys]
+    long_models = [
+        configure_model(api_key=key, max_output_tokens=LONG_MAX_OUTPUT_TOKENS)
+        for key in api_keys
+    ]
+
+    # Per-request metrics, see `report_extraction_metrics.py`
+    set_sink(open_sink("./logs/extraction_metrics.jsonl"))
 
     # Prepare texts
     data_dir = Path("./data/housing/processed")
@@ -88,4 +140,34 @@ if __name__ == "__main__":
     except FileNotFoundError:
         done = {}
     texts = {text: keys for text, keys in texts.items() if keys[0] not in done}
-    asyncio.run(process_texts(texts, models, intermittent_prefix=done_path.stem))
+    # Easy ads are extracted with rules, the rest is left for the model
+    n_texts = len(texts)
+    fast_results, texts = split_fast_path(texts)
+    logging.info(
+        f"Rule-based fast path: {n_texts - len(texts)}/{n_texts} LLM calls avoided."
+    )
+    emit(
+        make_metrics(
+            source=input_path.stem, parsed=True, cache_hit=True, ads=len(fast_results)
+        )
+    )
+    write_json(
+        fast_results,
+        data_dir / "structured" / f"{done_path.stem}_rules.json",
+        overwrite=True,
+    )
+    groups = group_near_duplicates(texts.keys())
+    logging.info(
+        f"Near-duplicate grouping: {len(texts)} unique texts -> {len(groups)} model calls."
+    )
+    asyncio.run(
+        process_texts(
+            texts,
+            models,
+            groups,
+            intermittent_prefix=done_path.stem,
+            long_models=long_models,
+            stream=True,
+            source=input_path.stem,
+        )
+    )
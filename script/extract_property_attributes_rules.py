@@ -0,0 +1,349 @@
+"""
+A rule-based fast path for the Gemini extraction: fills the `PROPERTY_SCHEMA` fields that ads state
+in predictable forms, with per-field confidence, so that only the remaining ads are sent to Gemini.
+"""
+
+import csv
+import re
+from pathlib import Path
+
+from helpers.helpers_cleaning import all_ascii, extract_phones, parse_price
+from helpers.helpers_io import read_json
+from helpers.regular_expressions import (
+    AM_UNICODE,
+    BATHROOM_AFTER_RE,
+    BATHROOM_RE,
+    BEDROOM_AFTER_RE,
+    BEDROOM_RE,
+    PER_MONTH_RE,
+    PER_SQM_RE,
+    PHONE_RE,
+    PRICE_RE,
+    SIZE_AFTER_UNIT_RE,
+    SIZE_RE,
+    STUDIO_RE,
+    USD_RE,
+)
+
+# Fields that must be filled with confidence for an ad to skip the model.
+# The address is not among them: for the scraped providers it comes from the listing itself,
+# and the extracted address is only used to fill missing ones (see tidy_datasets.R).
+REQUIRED_FIELDS = ("type", "listing", "price.amount", "size.floor_area")
+MIN_CONFIDENCE = 0.8
+# The types whose single stated size is the floor area (the land size for land, see
+# `PROPERTY_SCHEMA`); for a house or a commercial property it is often the plot area
+FLOOR_AREA_TYPES = ("condominium", "apartment", "land")
+# Larger room counts are most likely sizes or prices next to the keyword
+MAX_ROOMS = 20
+
+LISTING_KEYWORDS = {
+    "for sale": r"ለሽያጭ|ሽያጭ|የሚሸጥ|ይሸጣል|for\s*sale|\bsale\b|\bsell|yishetal|yemishet",
+    "for rent": r"ለኪራይ|ኪራይ|የሚከራይ|ይከራያል|for\s*rent|\brent|\blease|yikerayal|yemikeray",
+}
+# Ordered from specific to generic
+TYPE_KEYWORDS = {
+    "condominium": r"ኮንዶሚኒየም|ኮንዶ|\bcondo|\bkondo",
+    "apartment": r"አፓርታማ|አፓርትመንት|አፓርትማ|\bapartment|\bapt\b",
+    "commercial building": r"commercial\s*building|የንግድ\s*ህንፃ",
+    "warehouse": r"warehouse|መጋዘን",
+    "office": r"\boffice|ቢሮ",
+    "shop": r"\bshop\b|ሱቅ",
+    "land": r"\bland\b|\bplots?\b|ባዶ\s*ቦታ|መሬት",
+    "house": r"\bhouse|\bvilla|ቪላ|\bg\s*\+\s*\d|ጂ\s*\+\s*\d",
+}
+LISTING_RES = {k: re.compile(v, re.IGNORECASE) for k, v in LISTING_KEYWORDS.items()}
+TYPE_RES = {k: re.compile(v, re.IGNORECASE) for k, v in TYPE_KEYWORDS.items()}
+
+AMHARIC_CHAR_RE = re.compile(f"[{AM_UNICODE}]")
+# Transliterated Amharic written in latin script
+TRANSLITERATION_RE = re.compile(
+    r"\b(bet|yishetal|yikerayal|kare|mignta|megnta|sefer|akababi|bota|lay|new)\b",
+    re.IGNORECASE,
+)
+
+
+def detect_script(text):
+    """Classify an ad as written in 'amharic', 'transliterated' Amharic or 'english'."""
+    if AMHARIC_CHAR_RE.search(text):
+        return "amharic"
+    if all_ascii(text) and len(TRANSLITERATION_RE.findall(text)) >= 2:
+        return "transliterated"
+    return "english"
+
+
+def ad_tags(text):
+    """Coarse tags of an ad, e.g. ['script=amharic', 'type=land', 'listing=for rent']."""
+    tags = [f"script={detect_script(text)}"]
+    tags.extend(f"type={t}" for t in _match_keywords(text, TYPE_RES))
+    tags.extend(f"listing={t}" for t in _match_keywords(text, LISTING_RES))
+    return tags
+
+
+def _match_keywords(text, patterns):
+    """The keys of `patterns` that match `text`."""
+    return [key for key, pattern in patterns.items() if pattern.search(text)]
+
+
+def _match_numbers(text, regex, fallback_regex=None, upper=float("inf")):
+    """The distinct numbers <= `upper` captured by `regex` (or `fallback_regex` if there are none)."""
+
+    def _numbers(regex):
+        values = (float(m.group("n").replace(",", "")) for m in regex.finditer(text))
+        return [value for value in values if value <= upper]
+
+    values = _numbers(regex)
+    if not values and fallback_regex is not None:
+        values = _numbers(fallback_regex)
+    return list(dict.fromkeys(values))
+
+
+def _set(record, confidence, path, value, score):
+    *parents, leaf = path.split(".")
+    node = record
+    for part in parents:
+        node = node.setdefault(part, {})
+    node[leaf] = value
+    confidence[path] = score
+
+
+def extract_attributes_rules(text):
+    """
+    Extract the property attributes stated in predictable forms.
+
+    Parameters:
+    text (str): The input text.
+
+    Returns:
+    tuple: The extracted record (a subset of `PROPERTY_SCHEMA`) and the per-field confidence,
+    a dict of dotted field paths to scores in [0, 1]. A field matched more than once with
+    conflicting values (e.g. an ad listing several units) gets a low score.
+    """
+    record = {}
+    confidence = {}
+    text_no_phone = PHONE_RE.sub(" ", text)
+
+    listings = _match_keywords(text, LISTING_RES)
+    if listings:
+        _set(
+            record,
+            confidence,
+            "listing",
+            listings[0],
+            0.95 if len(listings) == 1 else 0.4,
+        )
+
+    types = _match_keywords(text, TYPE_RES)
+    if types:
+        _set(record, confidence, "type", types[0], 0.9 if len(types) == 1 else 0.5)
+
+    prices = []
+    for match in PRICE_RE.finditer(text_no_phone):
+        kw, mult, cur = match.group("kw", "mult", "cur")
+        if kw or mult or cur:
+            prices.append(
+                (parse_price(match.group()), bool(kw) + bool(mult) + bool(cur))
+            )
+    if prices:
+        amounts = list(dict.fromkeys(p for p, _ in prices))
+        score = 0.9 if prices[0][1] >= 2 else 0.75
+        _set(
+            record,
+            confidence,
+            "price.amount",
+            prices[0][0],
+            score if len(amounts) == 1 else 0.5,
+        )
+        currency = "USD" if USD_RE.search(text) else "ETB"
+        _set(record, confidence, "price.currency", currency, 0.9)
+        # As in the model's output: "total", "month" or "sqm"
+        if PER_SQM_RE.search(text_no_phone):
+            _set(record, confidence, "price.unit", "sqm", 0.9)
+        elif PER_MONTH_RE.search(text_no_phone):
+            _set(record, confidence, "price.unit", "month", 0.9)
+        elif record.get("listing") == "for rent":
+            _set(record, confidence, "price.unit", "month", 0.7)
+        elif record.get("listing") == "for sale":
+            _set(record, confidence, "price.unit", "total", 0.8)
+
+    sizes = _match_numbers(text_no_phone, SIZE_RE, SIZE_AFTER_UNIT_RE)
+    if sizes:
+        if len(sizes) > 1:
+            score = 0.5
+        elif record.get("type") in FLOOR_AREA_TYPES:
+            score = 0.9
+        else:
+            # Left to the model, to tell the floor area from the plot area
+            score = 0.6
+        _set(record, confidence, "size.floor_area", sizes[0], score)
+        _set(record, confidence, "size.unit", "sqm", 0.95)
+
+    if STUDIO_RE.search(text):
+        _set(record, confidence, "features.counts.bedrooms", 0, 0.9)
+    else:
+        bedrooms = _match_numbers(
+            text_no_phone, BEDROOM_RE, BEDROOM_AFTER_RE, MAX_ROOMS
+        )
+        if bedrooms:
+            n = int(bedrooms[0])
+            _set(
+                record,
+                confidence,
+                "features.counts.bedrooms",
+                n,
+                0.9 if len(bedrooms) == 1 else 0.5,
+            )
+    bathrooms = _match_numbers(text_no_phone, BATHROOM_RE, BATHROOM_AFTER_RE, MAX_ROOMS)
+    if bathrooms:
+        n = int(bathrooms[0])
+        _set(
+            record,
+            confidence,
+            "features.counts.bathrooms",
+            n,
+            0.85 if len(bathrooms) == 1 else 0.5,
+        )
+
+    phones = extract_phones(text)
+    if phones:
+        _set(record, confidence, "seller.contact.phone", phones[0], 0.95)
+
+    return record, confidence
+
+
+def needs_llm(confidence, required=REQUIRED_FIELDS, min_confidence=MIN_CONFIDENCE):
+    """Whether any of the `required` fields is missing or below `min_confidence`."""
+    return any(confidence.get(field, 0) < min_confidence for field in required)
+
+
+def split_fast_path(
+    text_to_keys, required=REQUIRED_FIELDS, min_confidence=MIN_CONFIDENCE
+):
+    """
+    Extract the easy ads with the rules, and leave the rest for the model.
+
+    Parameters:
+    text_to_keys (dict): {text: keys}, as returned by `load_property_texts`.
+
+    Returns:
+    tuple: The records of the ads extracted by the rules (in the same format as the Gemini
+    extraction, plus the extractor and per-field confidence), and {text: keys} of the ads
+    that still need the model.
+    """
+    results = []
+    remaining = {}
+    for text, keys in text_to_keys.items():
+        record, confidence = extract_attributes_rules(text)
+        if needs_llm(confidence, required, min_confidence):
+            remaining[text] = keys
+            continue
+        for key in keys:
+            results.append(
+                {
+                    "id": key,
+                    "input": text,
+                    "output": [record],
+                    "extractor": "rules",
+                    "confidence": confidence,
+                }
+            )
+    return results, remaining
+
+
+def _get_path(record, path):
+    for part in path.split("."):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(part)
+    return record
+
+
+def _agree(rule_value, gemini_value):
+    """Whether a rule-based value agrees with the Gemini one."""
+    if isinstance(rule_value, (int, float)):
+        try:
+            gemini_value = float(gemini_value)
+        except (TypeError, ValueError):
+            return False
+        return abs(rule_value - gemini_value) <= 0.01 * max(abs(gemini_value), 1)
+    rule_value, gemini_value = str(rule_value).lower(), str(gemini_value).lower()
+    return rule_value in gemini_value or gemini_value in rule_value
+
+
+def load_gemini_outputs(path):
+    """{input text: first extracted record} of a past Gemini extraction, for the parsed outputs."""
+    outputs = {}
+    for item in read_json(path):
+        output = item.get("output")
+        if isinstance(output, list) and output and isinstance(output[0], dict):
+            output = output[0]
+        if isinstance(output, dict) and "error" not in output:
+            outputs[item["input"]] = output
+    return outputs
+
+
+def report(
+    csv_path, gemini_path=None, required=REQUIRED_FIELDS, min_confidence=MIN_CONFIDENCE
+):
+    """
+    Print the share of ads that skip the model, by script, and the per-field agreement of the
+    confident rule-based fields with past Gemini outputs.
+    """
+    # Avoid a circular import, the Gemini extraction imports this module
+    from extract_property_attributes_gemini import load_property_texts
+
+    text_to_keys = load_property_texts(csv_path)
+    gemini = load_gemini_outputs(gemini_path) if gemini_path else {}
+
+    by_script = {}
+    agreement = {}
+    for text in text_to_keys:
+        record, confidence = extract_attributes_rules(text)
+        skipped = not needs_llm(confidence, required, min_confidence)
+        script = detect_script(text)
+        total, avoided = by_script.get(script, (0, 0))
+        by_script[script] = (total + 1, avoided + skipped)
+
+        if text not in gemini:
+            continue
+        for field, score in confidence.items():
+            if score < min_confidence:
+                continue
+            gemini_value = _get_path(gemini[text], field)
+            if gemini_value is None:
+                continue
+            n, agreed = agreement.get(field, (0, 0))
+            agreement[field] = (
+                n + 1,
+                agreed + _agree(_get_path(record, field), gemini_value),
+            )
+
+    n_texts = sum(total for total, _ in by_script.values())
+    n_avoided = sum(avoided for _, avoided in by_script.values())
+    print(
+        f"{Path(csv_path).name}: {n_avoided}/{n_texts} ({n_avoided / max(n_texts, 1):.1%}) LLM calls avoided."
+    )
+    for script, (total, avoided) in sorted(by_script.items()):
+        print(f"  {script:<15} {avoided}/{total} ({avoided / total:.1%})")
+    if agreement:
+        print("Agreement with past Gemini outputs (confident fields only):")
+        for field, (n, agreed) in sorted(agreement.items()):
+            print(f"  {field:<30} {agreed}/{n} ({agreed / n:.1%})")
+    return by_script, agreement
+
+
+if __name__ == "__main__":
+    csv.field_size_limit(1000_000)
+    data_dir = Path("./data/housing/processed")
+    for provider in [
+        "listings",
+        "loozap",
+        "ethiopianproperties",
+        "ethiopiapropertycentre",
+    ]:
+        csv_path = data_dir / f"{provider}_cleaned.csv"
+        gemini_path = (
+            data_dir
+            / "structured"
+            / f"{csv_path.stem}_extracted_property_attributes_gemini.json"
+        )
+        report(csv_path, gemini_path if gemini_path.exists() else None)
@@ -16,10 +16,53 @@ from helpers.helpers_geocoding import (
     tidy_address,
 )
 from helpers.helpers_io import read_json, setup_logger, write_json
+from helpers.helpers_retry import (
+    AuthError,
+    CircuitOpenError,
+    RateLimitError,
+    RetryableError,
+    RetryPolicy,
+    get_breaker,
+)
 
 setup_logger(__name__, "./logs/geocoding.log", console_level=50)
 logger = logging.getLogger(__name__)
 
+# Transient errors (429, 5xx, connection errors) are retried with jittered backoff.
+# One circuit per API key (and one for Nominatim), so a bad key fails fast for all addresses.
+RETRY_POLICY = RetryPolicy(max_retries=3, base_delay=0.5, max_delay=10.0)
+API_ERRORS = (
+    requests.exceptions.RequestException,
+    RetryableError,
+    AuthError,
+    CircuitOpenError,
+)
+
+
+def _get_json(endpoint, params):
+    response = requests.get(endpoint, params=params)
+    response.raise_for_status()
+    data = response.json()
+    # Google Maps reports quota and key problems in the body, with HTTP 200
+    status = data.get("status") if isinstance(data, dict) else None
+    if status == "OVER_QUERY_LIMIT":
+        raise RateLimitError(data.get("error_message", status))
+    if status == "REQUEST_DENIED":
+        raise AuthError(data.get("error_message", status))
+    return data
+
+
+def request_json(endpoint, params, circuit):
+    """GET `endpoint` with retries, guarded by the circuit breaker named `circuit`."""
+    return RETRY_POLICY.call(
+        _get_json, endpoint, params, breakers=[get_breaker(circuit)]
+    )
+
+
+def _circuit_name(api, api_key):
+    # Only a suffix of the key, the circuit name shows up in the logs
+    return f"{api}:...{api_key[-4:]}"
+
 
 @lru_cache(128 * 3)
 def geocode_gmaps(api_key, address):
@@ -34,13 +77,13 @@ def geocode_gmaps(api_key, address):
     }
 
     try:
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+        circuit = _circuit_name("gmaps-geocode", api_key)
+        data = request_json(endpoint, params, circuit)
+    except API_ERRORS as e:
         logger.exception("Failed to make geocode API call for address: {address}")
         raise GeocodeError(f"API Error: {e}")
     else:
-        return response.json()["results"]
+        return data["results"]
 
 
 @lru_cache(128 * 3)
@@ -57,13 +100,13 @@ def autocomplete_gmaps(api_key, address, types=None):
     }
 
     try:
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+        circuit = _circuit_name("gmaps-autocomplete", api_key)
+        data = request_json(endpoint, params, circuit)
+    except API_ERRORS as e:
         logger.exception("Failed to make autocomplete API call for address: {address}")
         raise GeocodeError(f"API Error: {e}")
     else:
-        return response.json()
+        return data
 
 
 @lru_cache(128 * 3)
@@ -79,13 +122,13 @@ def search_gmaps(api_key, address):
     }
 
     try:
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+        circuit = _circuit_name("gmaps-search", api_key)
+        data = request_json(endpoint, params, circuit)
+    except API_ERRORS as e:
         logger.exception("Failed to make gmaps search API call for address: {address}")
         raise GeocodeError(f"API Error: {e}")
     else:
-        return response.json()
+        return data
 
 
 @lru_cache
@@ -106,15 +149,14 @@ def geocode_nominatim(address, limit=5):
     }
 
     try:
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+        data = request_json(endpoint, params, "nominatim")
+    except API_ERRORS as e:
         logger.exception(
             f"Failed to make Nominatim geocode API call for address: '{address}'. Error: {e}"
         )
         raise GeocodeError(f"API error: {e}")
     else:
-        return response.json()
+        return data
 
 
 def extract_suggestion(result, key):
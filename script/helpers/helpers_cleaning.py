@@ -7,8 +7,23 @@ from .regular_expressions import (
     EMOJIES_RE,
     IRRELEVANT_RE,
     OTHER_SYMS_RE,
+    PHONE_RE,
+    PRICE_RE,
 )
 
+PRICE_MULTIPLIERS = {
+    "ሚሊዮን": 1e6,
+    "ሚሊየን": 1e6,
+    "ሚሊ": 1e6,
+    "million": 1e6,
+    "mil": 1e6,
+    "ሺህ": 1e3,
+    "ሺ": 1e3,
+    "ሽ": 1e3,
+    "thousand": 1e3,
+    "k": 1e3,
+}
+
 
 def check_instance(obj, type):
     """Check if `obj` is an instance of `type`."""
@@ -61,6 +76,31 @@ def clean_text2(text: str) -> str:
     return str_squish(text).strip()
 
 
+def extract_phones(text):
+    """Extract Ethiopian phone numbers from a string, in order of appearance."""
+    check_instance(text, str)
+    return [m.group() for m in PHONE_RE.finditer(text)]
+
+
+def parse_price(text):
+    """
+    Parse the first price-like amount in a string, e.g. "ዋጋ 140 ሽ", "5.5 million", "50,000ብር".
+    A bare number only counts as a price if it has a price keyword, a multiplier, or a currency next to it.
+    Returns the amount as a float, or None if no price is found.
+    """
+    check_instance(text, str)
+    text = PHONE_RE.sub(" ", text)
+    for match in PRICE_RE.finditer(text):
+        kw, mult, cur = match.group("kw", "mult", "cur")
+        if not (kw or mult or cur):
+            continue
+        amount = float(match.group("amount").replace(",", ""))
+        if mult:
+            amount *= PRICE_MULTIPLIERS[mult.lower()]
+        return amount
+    return None
+
+
 def contains_amharic(text):
     """Check if a string contains Amharic script based on the Unicode range."""
     check_instance(text, str)
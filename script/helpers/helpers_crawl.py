@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Iterable, NamedTuple, Optional, Union
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+from .helpers_retry import CircuitOpenError, RetryPolicy, get_breaker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+# Politeness defaults, per host
+CONCURRENCY = 4
+RATE = 2.0  # requests started per second
+TIMEOUT = 15
+
+
+class HostLimiter:
+    """At most `concurrency` requests in flight to a host, started at most `rate` per second."""
+
+    def __init__(self, concurrency=CONCURRENCY, rate=RATE):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._interval = 1 / rate if rate else 0.0
+        self._next_start = 0.0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        now = time.monotonic()
+        start = max(now, self._next_start)
+        self._next_start = start + self._interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+class Site(NamedTuple):
+    """
+    A site to crawl, "list pages -> detail pages -> records":
+    - `list_urls`: the list pages, or an async function `list_urls(crawler)` returning them
+      (e.g. after reading the number of pages off the first one).
+    - `parse_list(html, url)`: the links to the detail pages of a list page.
+    - `parse_detail(html, url)`: the record of a detail page, None to skip it.
+    - `next_page(url, page)`: if given, the url of page `page` of the listing `url`; the list
+      pages are then followed one after the other until one has no links (or is a 404).
+    - `concurrency`, `rate`: the per-host limits of the site, see `HostLimiter`.
+    """
+
+    name: str
+    list_urls: Union[Iterable[str], Callable]
+    parse_list: Callable
+    parse_detail: Callable
+    next_page: Optional[Callable] = None
+    concurrency: int = CONCURRENCY
+    rate: float = RATE
+
+
+class Crawler:
+    """
+    The HTTP client shared by the scrapers: one async connection pool (HTTP/2 where the server
+    supports it), per-host concurrency and rate limits, and retries with jittered backoff and a
+    circuit breaker per host (see `helpers_retry.RetryPolicy`). While a host's circuit is open,
+    its requests wait instead of failing.
+
+    With a `cache` (`helpers_httpcache.HTTPCache`), requests are conditional and a 304 is served
+    from the cache; `response.extensions["unchanged"]` tells whether the page is the same as
+    last time, by its validators or its body hash.
+
+    Use as `async with Crawler() as crawler: response = await crawler.get(url)`.
+    """
+
+    def __init__(
+        self,
+        concurrency=CONCURRENCY,
+        rate=RATE,
+        timeout=TIMEOUT,
+        headers=None,
+        http2=True,
+        policy=None,
+        max_connections=100,
+        cache=None,
+    ):
+        self.concurrency = concurrency
+        self.cache = cache
+        self.rate = rate
+        self.policy = policy or RetryPolicy(
+            max_retries=4, base_delay=1.0, max_delay=60.0
+        )
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            timeout=timeout,
+            headers=headers or DEFAULT_HEADERS,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections),
+        )
+        self._limiters = {}
+        self._default_limits = set()  # hosts with the crawler's default limits
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        if self.cache is not None:
+            self.cache.report()
+
+    def set_limits(self, host, concurrency=None, rate=None):
+        """Set the limits of a host (e.g. "et.loozap.com"), instead of the crawler's defaults."""
+        self._default_limits.discard(host)
+        self._limiters[host] = HostLimiter(
+            concurrency or self.concurrency, self.rate if rate is None else rate
+        )
+
+    def limiter(self, host):
+        if host not in self._limiters:
+            self.set_limits(host)
+            self._default_limits.add(host)
+        return self._limiters[host]
+
+    async def _get(self, url, **kwargs):
+        request = self.client.build_request("GET", url, **kwargs)
+        if self.cache is None:
+            async with self.limiter(urlsplit(url).netloc):
+                response = await self.client.send(request)
+            response.raise_for_status()
+            return response
+
+        key = str(request.url)
+        validators = self.cache.validators(key)
+        request.headers.update(validators)
+        async with self.limiter(urlsplit(url).netloc):
+            response = await self.client.send(request)
+        if response.status_code == 304 and validators:
+            body = self.cache.not_modified(key)
+            if body is not None:
+                return httpx.Response(
+                    200,
+                    content=body,
+                    request=request,
+                    extensions={"from_cache": True, "unchanged": True},
+                )
+            # The cached body is gone (e.g. evicted): get the page again, unconditionally
+            request = self.client.build_request("GET", url, **kwargs)
+            async with self.limiter(urlsplit(url).netloc):
+                response = await self.client.send(request)
+        response.raise_for_status()
+        if response.status_code == 200:
+            unchanged = self.cache.store(key, response.content, response.headers)
+            response.extensions = {**response.extensions, "unchanged": unchanged}
+        return response
+
+    async def get(self, url, **kwargs):
+        """
+        GET `url` with retries on 429, 5xx and connection errors.
+
+        Raises:
+        httpx.HTTPStatusError: On other error statuses, e.g. 404.
+        """
+        breaker = get_breaker(f"http:{urlsplit(url).netloc}")
+        for _ in range(self.policy.max_retries):
+            try:
+                return await self.policy.acall(
+                    self._get, url, breakers=[breaker], **kwargs
+                )
+            except CircuitOpenError:
+                await asyncio.sleep(max(breaker.retry_in(), 1.0))
+        raise CircuitOpenError(f"Circuit '{breaker.name}' still open, gave up {url}.")
+
+
+async def _fetch(crawler, url):
+    """The response of `url`, None (logged) if it fails or is a 404."""
+    try:
+        return await crawler.get(url)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 404:
+            logger.error(f"HTTP error for {url}: {e}")
+    except Exception as e:
+        logger.error(f"Request failed for {url}: {e!r}")
+    return None
+
+
+def _use_site_limits(crawler, site, urls):
+    for host in {urlsplit(url).netloc for url in urls}:
+        if host not in crawler._limiters or host in crawler._default_limits:
+            crawler.set_limits(host, site.concurrency, site.rate)
+
+
+async def crawl(site, crawler, detail_urls=None, on_record=None, early_stop=None):
+    """
+    Crawl a site: its list pages, then the detail pages of the links they return, each link once
+    and as soon as it is found. With `detail_urls`, only those detail pages are crawled.
+    `on_record(record)` is called with each record as soon as it is parsed. Pages that fail
+    (after the retries) or can't be parsed are logged and skipped.
+
+    With an `early_stop` (see `helpers_seen.EarlyStop`), the list pages are walked in order and
+    only the new listings are crawled: a listing (each of `list_urls` with `next_page`, all of
+    them otherwise) is abandoned once `early_stop.stop_after` known listings came in a row.
+
+    Returns:
+    list: The records.
+    """
+    records = []
+    seen = set()
+    tasks = []
+    stats = {"pages": 0, "failed": 0}
+    start = time.perf_counter()
+
+    async def detail(url):
+        response = await _fetch(crawler, url)
+        stats["pages"] += 1
+        if response is None:
+            stats["failed"] += 1
+            return
+        try:
+            record = site.parse_detail(response.text, url)
+        except Exception as e:
+            stats["failed"] += 1
+            logger.error(f"Failed to parse {url}: {e!r}")
+            return
+        if early_stop is not None:
+            early_stop.seen(url)
+        if record is not None:
+            records.append(record)
+            if on_record is not None:
+                on_record(record)
+
+    def schedule(urls):
+        for url in urls:
+            if url not in seen:
+                seen.add(url)
+                tasks.append(asyncio.create_task(detail(url)))
+
+    async def list_page(url):
+        response = await _fetch(crawler, url)
+        stats["pages"] += 1
+        if response is None:
+            return []
+        try:
+            links = site.parse_list(response.text, url)
+        except Exception as e:
+            logger.error(f"Failed to parse the list page {url}: {e!r}")
+            return []
+        links = [urljoin(url, link) for link in links]
+        schedule(links if early_stop is None else early_stop.filter(links))
+        return links
+
+    if detail_urls is not None:
+        detail_urls = list(detail_urls)
+        _use_site_limits(crawler, site, detail_urls)
+        schedule(detail_urls)
+    else:
+        list_urls = site.list_urls
+        if callable(list_urls):
+            list_urls = await list_urls(crawler)
+        list_urls = list(list_urls)
+        _use_site_limits(crawler, site, list_urls)
+        if site.next_page is not None:
+            for url in list_urls:
+                if early_stop is not None:
+                    early_stop.reset()
+                page, page_url = 1, url
+                while await list_page(page_url):
+                    if early_stop is not None and early_stop.stop:
+                        logger.info(
+                            f"{site.name}: stopped at known listings, {page_url}"
+                        )
+                        break
+                    page += 1
+                    page_url = site.next_page(url, page)
+        elif early_stop is not None:
+            early_stop.reset()
+            for url in list_urls:
+                await list_page(url)
+                if early_stop.stop:
+                    logger.info(f"{site.name}: stopped at known listings, {url}")
+                    break
+        else:
+            await asyncio.gather(*(list_page(url) for url in list_urls))
+    await asyncio.gather(*tasks)
+    if early_stop is not None and detail_urls is None:
+        early_stop.finish()
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"{site.name}: {len(records)} records from {stats['pages']} pages "
+        f"({stats['failed']} failed) in {elapsed:.1f}s, {stats['pages'] / max(elapsed, 1e-9):.1f} pages/s."
+    )
+    return records
+
+
+def _parse_detail(parse_detail, html, url):
+    try:
+        return parse_detail(html, url), None
+    except Exception as e:
+        return None, e
+
+
+async def pipeline(
+    site,
+    crawler,
+    urls,
+    on_record,
+    workers=None,
+    executor=None,
+    parsers=1,
+    queue_size=None,
+    log_every=500,
+):
+    """
+    Crawl the detail pages `urls` (any iterable, consumed lazily) in bounded memory: `workers`
+    fetch tasks (`site.concurrency` by default) take the urls one at a time and put the pages on
+    a queue of `queue_size`, from which `parsers` tasks parse them (on `executor`, e.g. a process
+    pool of that many workers with a picklable `site.parse_detail`, in the event loop without
+    one) and each record is passed to `on_record` (e.g. `helpers_io.JSONLWriter.write`). A full
+    queue holds the fetch tasks back, so at most `workers + queue_size` pages are in memory,
+    however many urls there are; the pace is the site's continuous rate limit (see
+    `HostLimiter`). Pages that fail are logged and skipped.
+
+    Returns:
+    dict: The number of pages fetched, failed and records.
+    """
+    workers = workers or site.concurrency
+    n_parsers = parsers if executor is not None else 1
+    queue_size = queue_size or 2 * max(workers, n_parsers)
+    url_queue = asyncio.Queue(maxsize=workers)
+    page_queue = asyncio.Queue(maxsize=queue_size)
+    stats = {"pages": 0, "failed": 0, "records": 0}
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+
+    def progress():
+        elapsed = time.perf_counter() - start
+        return (
+            f"{site.name}: {stats['records']} records from {stats['pages']} pages "
+            f"({stats['failed']} failed) in {elapsed:.1f}s, {stats['pages'] / max(elapsed, 1e-9):.1f} pages/s."
+        )
+
+    async def fetch():
+        while (url := await url_queue.get()) is not None:
+            _use_site_limits(crawler, site, [url])
+            response = await _fetch(crawler, url)
+            stats["pages"] += 1
+            if response is None:
+                stats["failed"] += 1
+            else:
+                await page_queue.put((url, response.text))
+            if log_every and stats["pages"] % log_every == 0:
+                logger.info(progress())
+
+    async def parse():
+        while (page := await page_queue.get()) is not None:
+            url, html = page
+            if executor is None:
+                record, error = _parse_detail(site.parse_detail, html, url)
+            else:
+                record, error = await loop.run_in_executor(
+                    executor, _parse_detail, site.parse_detail, html, url
+                )
+            if error is not None:
+                stats["failed"] += 1
+                logger.error(f"Failed to parse {url}: {error!r}")
+            elif record is not None:
+                stats["records"] += 1
+                on_record(record)
+
+    # A failing stage (e.g. `on_record`) cancels the others instead of leaving them blocked
+    async with asyncio.TaskGroup() as group:
+        parsers = [group.create_task(parse()) for _ in range(n_parsers)]
+        fetchers = [group.create_task(fetch()) for _ in range(workers)]
+        for url in urls:
+            await url_queue.put(url)
+        for _ in fetchers:
+            await url_queue.put(None)
+        await asyncio.gather(*fetchers)
+        for _ in parsers:
+            await page_queue.put(None)
+    logger.info(progress())
+    return stats
+
+
+def run(site, detail_urls=None, **crawler_kwargs):
+    """Crawl a site with a new `Crawler`, see `crawl`."""
+
+    async def _run():
+        async with Crawler(**crawler_kwargs) as crawler:
+            return await crawl(site, crawler, detail_urls)
+
+    return asyncio.run(_run())
@@ -0,0 +1,212 @@
+import re
+import zlib
+
+import numpy as np
+
+from .helpers_cleaning import check_instance, clean_text, extract_phones, parse_price
+from .regular_expressions import NUM_PAT, PHONE_RE, PRICE_RE
+
+# Hash family for MinHash: h(x) = ((a * x + b) mod p) & MAX_HASH
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+NUM_RE = re.compile(NUM_PAT)
+
+
+def normalize_for_dedup(text):
+    """Normalize an ad for near-duplicate detection: lowercase, drop phone numbers, emojis and symbols."""
+    check_instance(text, str)
+    text = PHONE_RE.sub(" ", text)
+    return clean_text(text).lower()
+
+
+def shingles(text, k=5):
+    """Character k-shingles of a normalized text."""
+    text = normalize_for_dedup(text)
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i : i + k] for i in range(len(text) - k + 1)}
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two sets."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def optimal_bands(threshold, num_perm):
+    """
+    Choose the number of LSH bands `b` and rows per band `r` (b * r <= num_perm),
+    such that the S-curve's inflection point (1/b)^(1/r) is closest to `threshold`.
+    """
+    best = None
+    for r in range(1, num_perm + 1):
+        b = num_perm // r
+        error = abs((1 / b) ** (1 / r) - threshold)
+        if best is None or error < best[0]:
+            best = (error, b, r)
+    return best[1], best[2]
+
+
+class MinHashLSH:
+    """
+    A MinHash/LSH index over character shingles. Texts whose estimated Jaccard similarity is above
+    `threshold` land in the same bucket of at least one band with high probability.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, k=5, seed=1):
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold must be a number in (0, 1].")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.k = k
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(self.bands)]
+        self.shingles = {}
+
+    def minhash(self, shingle_set):
+        """MinHash signature of a set of shingles."""
+        if not shingle_set:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        hv = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingle_set),
+            dtype=np.uint64,
+            count=len(shingle_set),
+        )
+        # uint64 overflow wraps around, which is fine for a hash family
+        phv = ((np.outer(self._a, hv) + self._b[:, None]) % MERSENNE_PRIME) & MAX_HASH
+        return phv.min(axis=1)
+
+    def insert(self, key, text):
+        """Add a text to the index under `key`."""
+        shingle_set = shingles(text, self.k)
+        self.shingles[key] = shingle_set
+        signature = self.minhash(shingle_set)
+        for band, buckets in enumerate(self._buckets):
+            start = band * self.rows
+            band_hash = signature[start : start + self.rows].tobytes()
+            buckets.setdefault(band_hash, []).append(key)
+
+    def candidate_pairs(self):
+        """Pairs of keys that share a bucket in at least one band."""
+        pairs = set()
+        for buckets in self._buckets:
+            for keys in buckets.values():
+                for i in range(len(keys)):
+                    for j in range(i + 1, len(keys)):
+                        pairs.add((keys[i], keys[j]))
+        return pairs
+
+
+def _find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def other_numbers(text):
+    """The numbers of a text outside its phone numbers and price (see `parse_price`), e.g. rooms, size, floor."""
+    text = PHONE_RE.sub(" ", text)
+    for match in PRICE_RE.finditer(text):
+        if match.group("kw") or match.group("mult") or match.group("cur"):
+            text = text[: match.start()] + " " + text[match.end() :]
+            break
+    return sorted(NUM_RE.findall(text))
+
+
+def field_overrides(representative, member):
+    """
+    Fields of `member` that differ from its `representative` and can be patched onto the
+    representative's extracted output without calling the model: phone number and price.
+    Returns a dict of dotted field paths to values, or None if the price differs but cannot be parsed,
+    or any other number differs (e.g. bedrooms or size, which can't be patched).
+    """
+    if other_numbers(member) != other_numbers(representative):
+        return None
+    overrides = {}
+    phones = extract_phones(member)
+    if phones and phones != extract_phones(representative):
+        overrides["seller.contact.phone"] = phones[0]
+    price = parse_price(member)
+    if price != parse_price(representative):
+        if price is None:
+            return None
+        overrides["price.amount"] = price
+    return overrides
+
+
+def group_near_duplicates(texts, threshold=0.8, num_perm=128, k=5):
+    """
+    Group near-duplicate texts, e.g. the same listing reposted with a different phone number, emojis or price.
+
+    Parameters:
+    texts (iterable of str): The (unique) texts to group.
+    threshold (float): The minimum Jaccard similarity of shingles for two texts to be near-duplicates.
+
+    Returns:
+    dict: {representative text: {member text: field overrides}}. The longest text in a group is its
+    representative, and maps to itself with no overrides. Members whose differences cannot be patched
+    (see `field_overrides`) are kept in a group of their own.
+    """
+    texts = list(dict.fromkeys(texts))
+    lsh = MinHashLSH(threshold, num_perm, k)
+    for i, text in enumerate(texts):
+        lsh.insert(i, text)
+
+    # Verify candidate pairs with the exact Jaccard similarity, and union the matches
+    parent = list(range(len(texts)))
+    for i, j in lsh.candidate_pairs():
+        if jaccard(lsh.shingles[i], lsh.shingles[j]) >= threshold:
+            parent[_find(parent, i)] = _find(parent, j)
+
+    clusters = {}
+    for i in range(len(texts)):
+        clusters.setdefault(_find(parent, i), []).append(texts[i])
+
+    groups = {}
+    for members in clusters.values():
+        representative = max(members, key=len)
+        groups[representative] = {representative: {}}
+        for member in members:
+            if member == representative:
+                continue
+            overrides = field_overrides(representative, member)
+            if overrides is None:
+                groups[member] = {member: {}}
+            else:
+                groups[representative][member] = overrides
+    return groups
+
+
+def apply_overrides(output, overrides):
+    """
+    Patch the field `overrides` of a near-duplicate onto the extracted output of its representative.
+    Outputs that are not (lists of) dicts, e.g. unparsed strings or errors, are returned unchanged.
+    """
+    if not overrides or not isinstance(output, (dict, list)):
+        return output
+    if isinstance(output, dict) and "error" in output:
+        return output
+
+    def _patch(record):
+        if not isinstance(record, dict):
+            return record
+        record = dict(record)
+        for path, value in overrides.items():
+            *parents, leaf = path.split(".")
+            node = record
+            for part in parents:
+                child = node.get(part)
+                child = dict(child) if isinstance(child, dict) else {}
+                node[part] = child
+                node = child
+            node[leaf] = value
+        return record
+
+    if isinstance(output, list):
+        return [_patch(record) for record in output]
+    return _patch(output)
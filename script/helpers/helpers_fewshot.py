@@ -0,0 +1,87 @@
+import math
+import re
+from collections import Counter
+from typing import NamedTuple
+
+from .helpers_cleaning import clean_text
+
+EXAMPLE_START_RE = re.compile(r"^\*\*Input\*\*:", re.MULTILINE)
+# Some examples omit the `**Output**:` marker before the JSON block
+OUTPUT_START_RE = re.compile(r"^(\*\*Output\*\*:|(?=```json))", re.MULTILINE)
+
+
+class Example(NamedTuple):
+    """A few-shot example: the ad, the expected output, and the full prompt block."""
+
+    input: str
+    output: str
+    block: str
+
+
+def split_examples(examples: str) -> list[Example]:
+    """Split a block of few-shot examples into examples, on the `**Input**:` markers."""
+    starts = [m.start() for m in EXAMPLE_START_RE.finditer(examples)]
+    bank = []
+    for start, end in zip(starts, starts[1:] + [len(examples)]):
+        block = examples[start:end].strip()
+        match = OUTPUT_START_RE.search(block)
+        if not match:
+            raise ValueError(f"No **Output** in example: {block[:50]}...")
+        input_text = block[len("**Input**:") : match.start()].strip().strip('"')
+        bank.append(Example(input_text, block[match.end() :].strip(), block))
+    return bank
+
+
+def char_ngrams(text, n=3):
+    """Character n-gram counts of a normalized text (word boundaries are kept as spaces)."""
+    text = f" {clean_text(text).lower()} "
+    return Counter(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+class ExampleIndex:
+    """
+    A character n-gram TF-IDF index over a bank of few-shot examples, to pick the examples
+    most similar to an ad. Character n-grams separate Amharic, transliterated and English ads
+    without a tokenizer. An optional `tagger` (text -> list of tags, e.g. the script or the
+    property type) adds `tag_weight` to the cosine similarity for each shared tag.
+    """
+
+    def __init__(self, examples, n=3, tagger=None, tag_weight=0.2):
+        self.examples = list(examples)
+        self.n = n
+        self.tagger = tagger
+        self.tag_weight = tag_weight
+        counts = [char_ngrams(e.input, n) for e in self.examples]
+        df = Counter(gram for c in counts for gram in c)
+        num_docs = len(self.examples)
+        self.idf = {
+            gram: math.log((1 + num_docs) / (1 + d)) + 1 for gram, d in df.items()
+        }
+        self._vectors = [self._vectorize(c) for c in counts]
+        self._tags = [self._get_tags(e.input) for e in self.examples]
+
+    def _get_tags(self, text):
+        return set(self.tagger(text)) if self.tagger else set()
+
+    def _vectorize(self, counts):
+        vector = {g: tf * self.idf[g] for g, tf in counts.items() if g in self.idf}
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        return {g: v / norm for g, v in vector.items()} if norm else {}
+
+    def scores(self, text):
+        """The similarity of `text` with each example in the bank."""
+        vector = self._vectorize(char_ngrams(text, self.n))
+        tags = self._get_tags(text)
+        scores = []
+        for doc, doc_tags in zip(self._vectors, self._tags):
+            score = sum(v * doc.get(g, 0) for g, v in vector.items())
+            if tags:
+                score += self.tag_weight * len(tags & doc_tags) / len(tags)
+            scores.append(score)
+        return scores
+
+    def top_k(self, text, k=3):
+        """The indices of the `k` examples most similar to `text`, in the bank's order."""
+        scores = self.scores(text)
+        best = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+        return tuple(sorted(best))
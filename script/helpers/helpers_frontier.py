@@ -0,0 +1,248 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+# The states of a url in the frontier
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+
+
+class Task(NamedTuple):
+    """A leased url, with the data it was added with (e.g. the phone number of a jiji ad)."""
+
+    url: str
+    data: Optional[dict]
+    attempts: int
+
+
+def default_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Frontier:
+    """
+    An on-disk crawl queue (SQLite): each url is pending, in flight, done or failed, with its
+    attempts, priority and, once done, its record. Workers (threads, processes or machines on a
+    shared disk) lease batches of pending urls, highest priority first; a lease that isn't
+    completed in time (e.g. the worker crashed) expires and the urls are leased again, to
+    whichever worker asks first.
+
+    Adding a url that is already in the frontier is a no-op, so a restart only fetches what is
+    left. Urls are grouped (e.g. per category) and a group is marked as listed once all of its
+    urls were added, so a restart can skip the list pages too. Delete the frontier (`delete`)
+    to start over, and once its crawl completed.
+    """
+
+    def __init__(self, path, worker=None, lease_seconds=LEASE_SECONDS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.worker = worker or default_worker()
+        self.lease_seconds = lease_seconds
+        self._conn = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                grp TEXT NOT NULL DEFAULT '',
+                state TEXT NOT NULL DEFAULT 'pending',
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                data TEXT,
+                result TEXT,
+                error TEXT,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS urls_queue ON urls (state, priority DESC);
+            CREATE INDEX IF NOT EXISTS urls_group ON urls (grp, state);
+            CREATE TABLE IF NOT EXISTS groups (grp TEXT PRIMARY KEY, listed_at REAL);
+            """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def delete(self):
+        """Close and delete the frontier, e.g. once its crawl completed."""
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+
+    def _write(self, sql, params=()):
+        """Run a write in its own immediate transaction, so concurrent workers serialize on it."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall()
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def add(self, items, group="", priority=0):
+        """
+        Add urls, or (url, data) pairs, as pending; the urls already in the frontier are left as
+        they are.
+
+        Returns:
+        int: The number of urls added.
+        """
+        rows = []
+        for item in items:
+            url, data = item if isinstance(item, tuple) else (item, None)
+            data = json.dumps(data, ensure_ascii=False) if data is not None else None
+            rows.append((url, group, priority, data, time.time()))
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO urls (url, grp, priority, data, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            added = self._conn.total_changes - before
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def mark_listed(self, group):
+        self._write(
+            "INSERT OR REPLACE INTO groups (grp, listed_at) VALUES (?, ?)",
+            (group, time.time()),
+        )
+
+    def is_listed(self, group):
+        row = self._conn.execute(
+            "SELECT 1 FROM groups WHERE grp = ?", (group,)
+        ).fetchone()
+        return row is not None
+
+    def lease(self, n=1, group=None):
+        """
+        Lease up to `n` urls: the pending ones and those whose lease expired, highest priority
+        first, then in the order they were added.
+
+        Returns:
+        list[Task]: The leased urls, empty if there is nothing left to lease.
+        """
+        now = time.time()
+        where = "(state = ? OR (state = ? AND lease_until < ?))"
+        params = [PENDING, IN_FLIGHT, now]
+        if group is not None:
+            where += " AND grp = ?"
+            params.append(group)
+        rows = self._write(
+            f"""
+            UPDATE urls SET state = ?, worker = ?, lease_until = ?,
+                attempts = attempts + 1, updated_at = ?
+            WHERE rowid IN (
+                SELECT rowid FROM urls WHERE {where}
+                ORDER BY priority DESC, rowid LIMIT ?
+            )
+            RETURNING url, data, attempts, priority, rowid
+            """,
+            (IN_FLIGHT, self.worker, now + self.lease_seconds, now, *params, n),
+        )
+        rows.sort(key=lambda row: (-row[3], row[4]))
+        return [
+            Task(url, json.loads(data) if data else None, attempts)
+            for url, data, attempts, _, _ in rows
+        ]
+
+    def tasks(self, group=None, batch_size=10):
+        """Lease and yield urls until none are left, see `lease`."""
+        while True:
+            batch = self.lease(batch_size, group)
+            if not batch:
+                return
+            yield from batch
+
+    def _finish(self, url, sql, params):
+        # Only the lease holder can complete a url, a worker whose lease expired can't
+        rows = self._write(
+            f"{sql}, worker = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE url = ? AND state = ? AND worker = ? RETURNING url",
+            (*params, time.time(), url, IN_FLIGHT, self.worker),
+        )
+        return bool(rows)
+
+    def done(self, url, result=None):
+        """Mark a leased url as done, with its record. Returns False if the lease was lost."""
+        result = json.dumps(result, ensure_ascii=False) if result is not None else None
+        return self._finish(
+            url, "UPDATE urls SET state = ?, result = ?, error = NULL", (DONE, result)
+        )
+
+    def fail(self, url, error, max_attempts=MAX_ATTEMPTS):
+        """
+        Record a failed attempt: the url is pending again, behind the fresh ones, or failed once
+        it has been attempted `max_attempts` times. Returns False if the lease was lost.
+        """
+        return self._finish(
+            url,
+            "UPDATE urls SET state = CASE WHEN attempts < ? THEN ? ELSE ? END, "
+            "priority = priority - 1, error = ?",
+            (max_attempts, PENDING, FAILED, str(error)),
+        )
+
+    def release(self, worker=None):
+        """
+        Return the urls leased by `worker` (this one by default) to the queue, e.g. those a
+        scraper leased before it crashed, on its restart under the same worker name.
+        """
+        rows = self._write(
+            "UPDATE urls SET state = ?, worker = NULL, lease_until = NULL, "
+            "attempts = attempts - 1 WHERE state = ? AND worker = ? RETURNING url",
+            (PENDING, IN_FLIGHT, worker or self.worker),
+        )
+        return len(rows)
+
+    def retry_failed(self, group=None):
+        """Make the failed urls pending again, with their attempts reset."""
+        sql = "UPDATE urls SET state = ?, attempts = 0 WHERE state = ?"
+        params = [PENDING, FAILED]
+        if group is not None:
+            sql += " AND grp = ?"
+            params.append(group)
+        return len(self._write(sql + " RETURNING url", params))
+
+    def results(self, group=None):
+        """The records of the done urls, in the order the urls were added."""
+        sql = "SELECT result FROM urls WHERE state = ? AND result IS NOT NULL"
+        params = [DONE]
+        if group is not None:
+            sql += " AND grp = ?"
+            params.append(group)
+        rows = self._conn.execute(sql + " ORDER BY rowid", params)
+        return [json.loads(result) for (result,) in rows]
+
+    def counts(self, group=None):
+        """The number of urls in each state."""
+        sql = "SELECT state, COUNT(*) FROM urls"
+        params = []
+        if group is not None:
+            sql += " WHERE grp = ?"
+            params.append(group)
+        counts = dict.fromkeys((PENDING, IN_FLIGHT, DONE, FAILED), 0)
+        counts.update(self._conn.execute(sql + " GROUP BY state", params).fetchall())
+        return counts
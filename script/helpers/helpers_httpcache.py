@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = "./data/housing/raw/http_cache.db"
+
+
+def body_hash(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class HTTPCache:
+    """
+    The bodies of the pages fetched so far (zlib-compressed, in SQLite), with their validators
+    (ETag, Last-Modified), to make conditional requests: `validators(url)` are the headers to
+    send, and on a 304 `not_modified(url)` is the cached body. For sites that don't send
+    validators, `store` compares the hash of the new body to the cached one, so the page is at
+    least known to be unchanged (e.g. to skip parsing it again).
+
+    Counts, per host: requests, 304s, unchanged bodies, bytes downloaded and bytes saved.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                body BLOB,
+                fetched_at REAL
+            );
+            """)
+        self.stats = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def _stats(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.stats:
+            self.stats[host] = dict.fromkeys(
+                ("requests", "not_modified", "unchanged", "bytes", "bytes_saved"), 0
+            )
+        return self.stats[host]
+
+    def validators(self, url):
+        """The conditional request headers for `url`, empty if it isn't cached."""
+        row = self._conn.execute(
+            "SELECT etag, last_modified FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return {}
+        etag, last_modified = row
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def not_modified(self, url):
+        """The cached body of `url`, after a 304; None if it isn't cached."""
+        row = self._conn.execute(
+            "SELECT body FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        body = zlib.decompress(row[0])
+        stats = self._stats(url)
+        stats["requests"] += 1
+        stats["not_modified"] += 1
+        stats["bytes_saved"] += len(body)
+        with self._conn:
+            self._conn.execute(
+                "UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url)
+            )
+        return body
+
+    def store(self, url, body, headers):
+        """
+        Cache a 200 response.
+
+        Returns:
+        bool: Whether the body is the same as the cached one.
+        """
+        digest = body_hash(body)
+        row = self._conn.execute(
+            "SELECT body_hash FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        unchanged = row is not None and row[0] == digest
+        stats = self._stats(url)
+        stats["requests"] += 1
+        stats["bytes"] += len(body)
+        stats["unchanged"] += unchanged
+        with self._conn:
+            if unchanged:
+                self._conn.execute(
+                    "UPDATE responses SET etag = ?, last_modified = ?, fetched_at = ? "
+                    "WHERE url = ?",
+                    (
+                        headers.get("etag"),
+                        headers.get("last-modified"),
+                        time.time(),
+                        url,
+                    ),
+                )
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        url,
+                        headers.get("etag"),
+                        headers.get("last-modified"),
+                        digest,
+                        zlib.compress(body),
+                        time.time(),
+                    ),
+                )
+        return unchanged
+
+    def report(self):
+        """Log the hit rate and the bytes saved, per host."""
+        for host, s in sorted(self.stats.items()):
+            hits = s["not_modified"] + s["unchanged"]
+            logger.info(
+                f"{host}: {s['requests']} requests, {s['not_modified']} not modified, "
+                f"{s['unchanged']} unchanged ({hits / max(s['requests'], 1):.0%} hits), "
+                f"{s['bytes'] / 1e6:.1f} MB downloaded, {s['bytes_saved'] / 1e6:.1f} MB saved."
+            )
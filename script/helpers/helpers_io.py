@@ -22,6 +22,50 @@ def read_json(filepath: str, verbose: bool = False):
         raise json.JSONDecodeError(f"Error reading from {filepath}.")
 
 
+def iter_json_array(filepath, chunk_size=1000, block_size=1 << 20):
+    """
+    Stream the elements of a JSON array file in chunks of `chunk_size`, reading `block_size`
+    characters at a time, without loading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    chunk = []
+    with open(filepath, "r") as f:
+        buffer = f.read(block_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"Expecting a JSON array in {filepath}.")
+        pos = 1
+        eof = False
+        while True:
+            # Skip whitespace and the comma between elements
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                break
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                if end == len(buffer) and not eof:
+                    # A number may continue in the next block
+                    raise json.JSONDecodeError(
+                        "Element at the end of the block", buffer, pos
+                    )
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The element continues in the next block
+                block = f.read(block_size)
+                eof = not block
+                buffer = buffer[pos:] + block
+                pos = 0
+                continue
+            chunk.append(element)
+            pos = end
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
 def write_json(data, filepath, overwrite=False, verbose: bool = True):
     ensure_dir_exists(filepath)
     try:
@@ -42,6 +86,44 @@ def write_json(data, filepath, overwrite=False, verbose: bool = True):
         raise Exception(f"Error writing data to {filepath}: {e}")
 
 
+class JSONLWriter:
+    """
+    Append records to a JSON lines file, one per line, flushed as they come: memory doesn't grow
+    with the number of records and a crash loses none. Use as `with JSONLWriter(path) as w:`.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = ensure_dir_exists(filepath)
+        self._file = open(filepath, "a", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def iter_jsonl(filepath):
+    """The records of a JSON lines file, one at a time; a truncated last line (a crash while writing) is skipped."""
+    if not os.path.exists(filepath):
+        return
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise
+                print(f"Skipped a truncated last line of {filepath}.")
+
+
 def update_json(file_path, new_data, file_size_limit=500e6):
     # file_size_limit is in bytes, 500e6 bytes is approximately 500MB
     # Load existing data
@@ -0,0 +1,415 @@
+import json
+import re
+from json.decoder import scanstring
+
+OPENERS = {"{": "}", "[": "]"}
+CLOSERS = {"}", "]"}
+# Characters a JSON value can start with, besides objects and arrays
+SCALAR_START_RE = re.compile(r'["\-0-9tfn]')
+
+WHITESPACE_RE = re.compile(r"\s*")
+STRING_CHUNK_RE = re.compile(r'[^"\\\x00-\x1f]*')
+CONTROL_CHARACTER_RE = re.compile(r"[\x00-\x1f]")
+NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+LITERAL_RE = re.compile(r"[A-Za-z_]+")
+LITERALS = {"true": True, "false": False, "null": None}
+# Python and JavaScript spellings the model sometimes uses
+NON_JSON_LITERALS = {
+    "True": True,
+    "False": False,
+    "None": None,
+    "NULL": None,
+    "Null": None,
+    "undefined": None,
+}
+ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+FENCE_START_RE = re.compile(r"\s*(?:```(?:json)?)?", re.IGNORECASE)
+FENCE_END_RE = re.compile(r"```\s*$")
+
+
+class MalformedJSONError(ValueError):
+    """The JSON text is structurally broken, e.g. mismatched brackets, and can't be completed."""
+
+    pass
+
+
+class IncompleteJSONError(ValueError):
+    """The JSON text ended before its top-level value was closed, e.g. a truncated response."""
+
+    pass
+
+
+class IncrementalJSONParser:
+    """
+    Parse a JSON value fed in chunks, e.g. a streamed model response, and emit each element of a
+    top-level array as soon as it closes (a top-level object is emitted as one element).
+
+    The parser skips markdown fences and any text around the value, and tolerates trailing commas.
+    Each element is parsed with `repair_json` if it isn't valid JSON, e.g. a `//` comment or an
+    unescaped inner quote; the repairs applied are counted into `repairs`. It raises
+    `MalformedJSONError` on the first structural error (a mismatched bracket, a stray character or
+    a missing comma between elements) or an element that can't be repaired.
+    """
+
+    def __init__(self):
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        # Characters of the current array element (or of the top-level object)
+        self._element = []
+        self._top = None  # "[" or "{" once the value started
+        self._done = False
+        self._expect_separator = False  # an array element just closed
+        self.elements = []
+        self.repairs = {}
+        self.tail = ""  # text after the value, e.g. the closing fence
+
+    def _error(self, message, char):
+        raise MalformedJSONError(
+            f"{message}: {char!r} after {''.join(self._element)[-40:]!r}"
+        )
+
+    def _emit(self):
+        text = "".join(self._element).strip()
+        self._element = []
+        if not text:
+            return []
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                value, repairs = repair_json(text)
+            except json.JSONDecodeError as e:
+                raise MalformedJSONError(f"Invalid element: {e}") from e
+            for name, count in repairs.items():
+                self.repairs[name] = self.repairs.get(name, 0) + count
+        self.elements.append(value)
+        return [value]
+
+    def _drop_trailing_comma(self):
+        """Drop a comma right before a closer, e.g. `{"a": 1,}`."""
+        for i in range(len(self._element) - 1, -1, -1):
+            if self._element[i].isspace():
+                continue
+            if self._element[i] == ",":
+                del self._element[i]
+            return
+
+    def feed(self, chunk):
+        """Feed a chunk of text; returns the elements completed by it."""
+        completed = []
+        for char in chunk:
+            if self._done:
+                self.tail += char
+                continue
+            if self._top is None:
+                if char in OPENERS:
+                    self._top = char
+                    self._stack.append(char)
+                    if char == "{":
+                        self._element.append(char)
+                continue  # skip fences and chatter before the value
+
+            if self._in_string:
+                self._element.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            depth = len(self._stack)
+            if self._top == "[" and depth == 1:
+                # Between or inside scalar elements of the top-level array
+                if char == ",":
+                    completed.extend(self._emit())
+                    self._expect_separator = False
+                    continue
+                if char == "]":
+                    completed.extend(self._emit())
+                    self._stack.pop()
+                    self._done = True
+                    continue
+                if char.isspace():
+                    continue
+                if char == "}":
+                    self._error("Unexpected closer in array", char)
+                if self._expect_separator:
+                    self._error("Missing comma between elements", char)
+                if (
+                    not self._element
+                    and char not in OPENERS
+                    and not SCALAR_START_RE.match(char)
+                ):
+                    self._error("Unexpected character between elements", char)
+
+            if char == '"':
+                self._in_string = True
+            elif char in OPENERS:
+                self._stack.append(char)
+            elif char in CLOSERS:
+                if OPENERS[self._stack[-1]] != char:
+                    self._error("Mismatched closer", char)
+                self._drop_trailing_comma()
+                self._stack.pop()
+                self._element.append(char)
+                if not self._stack:
+                    # The top-level object closed
+                    completed.extend(self._emit())
+                    self._done = True
+                elif self._top == "[" and len(self._stack) == 1:
+                    # An object or array element of the top-level array closed
+                    completed.extend(self._emit())
+                    self._expect_separator = True
+                continue
+            self._element.append(char)
+        return completed
+
+    def close(self):
+        """
+        End the input; returns the parsed value: the list of elements of a top-level array,
+        or the top-level object.
+        """
+        if self._top is None:
+            raise IncompleteJSONError("No JSON value in the input.")
+        if not self._done:
+            raise IncompleteJSONError(
+                f"Input ended at depth {len(self._stack)}, the value is truncated."
+            )
+        if self._top == "{":
+            return self.elements[0]
+        return self.elements
+
+
+def parse_json_stream(chunks):
+    """Parse a JSON value from an iterable of text chunks, see `IncrementalJSONParser`."""
+    parser = IncrementalJSONParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+class _RepairParser:
+    """
+    A recursive-descent JSON parser that repairs the usual defects of model outputs as it goes,
+    in a single pass over the text. See `repair_json`.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text)
+        self.pos = 0
+        self.repairs = {}
+
+    def _repair(self, name):
+        self.repairs[name] = self.repairs.get(name, 0) + 1
+
+    def _fail(self, message):
+        raise json.JSONDecodeError(message, self.text, self.pos)
+
+    def _peek(self):
+        """Skip whitespace and `//` or `/* */` comments; returns the next character."""
+        text = self.text
+        while True:
+            pos = WHITESPACE_RE.match(text, self.pos).end()
+            self.pos = pos
+            char = text[pos] if pos < self.length else ""
+            if char != "/" or not text.startswith(("//", "/*"), pos):
+                return char
+            if text.startswith("//", pos):
+                end = text.find("\n", pos)
+                self.pos = self.length if end == -1 else end
+            else:
+                end = text.find("*/", pos)
+                self.pos = self.length if end == -1 else end + 2
+            self._repair("comment")
+
+    def parse(self):
+        value = self._value()
+        if self._peek():
+            self._fail("Extra data")
+        return value
+
+    def _value(self):
+        char = self._peek()
+        if char == "{":
+            return self._object()
+        if char == "[":
+            return self._array()
+        if char == '"':
+            return self._string(closers=",}]")
+        match = NUMBER_RE.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            number = match.group()
+            return float(number) if any(c in number for c in ".eE") else int(number)
+        match = LITERAL_RE.match(self.text, self.pos)
+        if match and match.group() in LITERALS:
+            self.pos = match.end()
+            return LITERALS[match.group()]
+        if match and match.group() in NON_JSON_LITERALS:
+            self.pos = match.end()
+            self._repair("literal")
+            return NON_JSON_LITERALS[match.group()]
+        if char in (",", "}", "]"):
+            # A missing value, e.g. `"price": ,`
+            self._repair("null")
+            return None
+        self._fail("Expecting value")
+
+    def _members(self, closer, parse_member):
+        """Parse comma-separated members up to `closer`, repairing trailing and missing commas."""
+        self.pos += 1  # the opener
+        char = self._peek()
+        while True:
+            if char == closer:
+                self.pos += 1
+                return
+            if not char:
+                self._fail(f"Expecting '{closer}'")
+            parse_member()
+            char = self._peek()
+            if char == ",":
+                self.pos += 1
+                char = self._peek()
+                if char == closer:
+                    self._repair("trailing_comma")
+            elif char != closer:
+                if char in ('"', "{", "["):
+                    self._repair("missing_comma")
+                else:
+                    self._fail(f"Expecting ',' or '{closer}'")
+
+    def _object(self):
+        obj = {}
+
+        def member():
+            if self._peek() != '"':
+                self._fail("Expecting property name enclosed in double quotes")
+            key = self._string(closers=":")
+            if self._peek() != ":":
+                self._fail("Expecting ':' delimiter")
+            self.pos += 1
+            obj[key] = self._value()
+
+        self._members("}", member)
+        return obj
+
+    def _array(self):
+        arr = []
+        self._members("]", lambda: arr.append(self._value()))
+        return arr
+
+    def _closes_string(self, quote_pos, closers):
+        """
+        Whether the quote at `quote_pos` ends the string: it must be followed by one of `closers`
+        (":" for keys, ",}]" for values), and a comma by something that can follow a value.
+        """
+        text = self.text
+        i = quote_pos + 1
+        if i < self.length and text[i] == ":" and closers == ":":
+            return True  # the usual key
+        i = WHITESPACE_RE.match(text, i).end()
+        if i >= self.length or text.startswith("//", i):
+            return True
+        if text[i] not in closers:
+            return False
+        if text[i] == ",":
+            j = WHITESPACE_RE.match(text, i + 1).end()
+            return j >= len(text) or text[j] in '"}]{[/'
+        return True
+
+    def _string(self, closers):
+        text = self.text
+        self.pos += 1  # the opening quote
+        # Fast path: the C scanner of `json`, if the string is valid and its end quote is real
+        try:
+            value, end = scanstring(text, self.pos, False)
+        except json.JSONDecodeError:
+            pass
+        else:
+            if self._closes_string(end - 1, closers):
+                if CONTROL_CHARACTER_RE.search(text, self.pos, end):
+                    self._repair("control_character")
+                self.pos = end
+                return value
+        chunks = []
+        while True:
+            end = STRING_CHUNK_RE.match(text, self.pos).end()
+            chunks.append(text[self.pos : end])
+            self.pos = end
+            if end >= len(text):
+                self._fail("Unterminated string")
+            char = text[end]
+            if char == '"':
+                if self._closes_string(end, closers):
+                    self.pos = end + 1
+                    return "".join(chunks)
+                self._repair("inner_quote")
+                chunks.append('"')
+                self.pos = end + 1
+            elif char == "\\":
+                escaped = text[end + 1 : end + 2]
+                if escaped in ESCAPES:
+                    chunks.append(ESCAPES[escaped])
+                    self.pos = end + 2
+                elif escaped == "u" and re.fullmatch(
+                    r"[0-9a-fA-F]{4}", text[end + 2 : end + 6]
+                ):
+                    chunks.append(chr(int(text[end + 2 : end + 6], 16)))
+                    self.pos = end + 6
+                else:
+                    # Keep a stray backslash, e.g. "G+1\G+2"
+                    self._repair("invalid_escape")
+                    chunks.append("\\")
+                    self.pos = end + 1
+            else:
+                # A raw control character, e.g. a newline in a value
+                self._repair("control_character")
+                chunks.append(char)
+                self.pos = end + 1
+
+
+def repair_json(text):
+    """
+    Parse a JSON text from a model, repairing in the same pass: markdown code fences, `//` and
+    `/* */` comments, trailing and missing commas, unescaped inner quotes (a quote only closes a
+    string if a delimiter follows), stray backslashes, raw control characters, Python and
+    JavaScript literals (`None`, `True`, `NULL`, `undefined`), and missing values (as null).
+
+    Returns:
+    tuple: The parsed value and the repairs applied, {repair name: count}.
+
+    Raises:
+    json.JSONDecodeError: If the text can't be repaired, e.g. a truncated output.
+    """
+    repairs = {}
+    start = FENCE_START_RE.match(text)
+    end = FENCE_END_RE.search(text)
+    if start.group().strip() or end:
+        repairs["fence"] = 1
+        text = text[start.end() : end.start() if end else len(text)]
+    parser = _RepairParser(text)
+    value = parser.parse()
+    repairs.update(parser.repairs)
+    return value, repairs
+
+
+def loads_tolerant(text):
+    """`json.loads` for valid JSON (after stripping fences), `repair_json` otherwise; returns (value, repairs)."""
+    clean = text.strip().removeprefix("```json").removesuffix("```")
+    try:
+        return json.loads(clean), {"fence": 1} if clean != text.strip() else {}
+    except json.JSONDecodeError:
+        return repair_json(text)
@@ -0,0 +1,332 @@
+"""
+One interface over the HTML parsers, so the scrapers can switch to a fast C backend:
+
+    doc = parse_html(html)  # or parse_html(html, backend="bs4")
+    title = my_get_text(doc.select_one("h1 > strong"))
+    links = [a.get("href") for a in doc.select("a[href]")]
+
+Backends: "selectolax" (lexbor), "lxml" (with cssselect) and "bs4" (BeautifulSoup's
+html.parser, the reference). The default is the fastest one installed. Nodes support the CSS
+selectors the scrapers use, `get_text(strip=True)` with BeautifulSoup's semantics, so
+`my_get_text` works with any backend, `get`/`attrs` and `next_text`. Selectors are compiled
+once per process (`compile_selector` checks one ahead of the pages).
+
+Detail parsers that only need a few subtrees can skip the rest of the page:
+`parse_subtrees(html, ["div.main-container", "#overview"])` parses only those elements, and
+`find_json_ld`/`find_js_object` pull the JSON blobs out of the raw HTML without a tree.
+"""
+
+import importlib.util
+import json
+import re
+from functools import lru_cache
+
+from bs4 import BeautifulSoup, NavigableString
+
+BACKENDS = ("selectolax", "lxml", "bs4")
+
+
+def available_backends():
+    modules = {"selectolax": "selectolax", "lxml": "cssselect", "bs4": "bs4"}
+    return [b for b in BACKENDS if importlib.util.find_spec(modules[b]) is not None]
+
+
+DEFAULT_BACKEND = available_backends()[0]
+
+
+class Node:
+    """An element of a parsed document, see the subclasses for the backends."""
+
+    def select(self, selector):
+        raise NotImplementedError
+
+    def select_one(self, selector):
+        nodes = self.select(selector)
+        return nodes[0] if nodes else None
+
+    def get_text(self, strip=False, separator=""):
+        """The text of the element; with `strip`, each piece of text is stripped, as in bs4."""
+        pieces = self._strings()
+        if strip:
+            pieces = (s.strip() for s in pieces)
+            pieces = [s for s in pieces if s]
+        return separator.join(pieces)
+
+    @property
+    def text(self):
+        return self.get_text()
+
+    def get(self, attr, default=None):
+        return self.attrs.get(attr, default)
+
+    def __getitem__(self, attr):
+        return self.attrs[attr]
+
+
+@lru_cache(maxsize=512)
+def _soup_selector(selector):
+    import soupsieve
+
+    return soupsieve.compile(selector)
+
+
+class SoupNode(Node):
+    def __init__(self, tag):
+        self._tag = tag
+
+    def select(self, selector):
+        return [SoupNode(tag) for tag in _soup_selector(selector).select(self._tag)]
+
+    def select_one(self, selector):
+        tag = _soup_selector(selector).select_one(self._tag)
+        return SoupNode(tag) if tag is not None else None
+
+    def _strings(self):
+        return self._tag.strings
+
+    def get_text(self, strip=False, separator=""):
+        return self._tag.get_text(separator, strip=strip)
+
+    @property
+    def attrs(self):
+        return {
+            k: " ".join(v) if isinstance(v, list) else v
+            for k, v in self._tag.attrs.items()
+        }
+
+    @property
+    def html(self):
+        return str(self._tag)
+
+    def next_text(self):
+        sibling = self._tag.next_sibling
+        return str(sibling) if isinstance(sibling, NavigableString) else ""
+
+
+class LexborNode(Node):
+    def __init__(self, node):
+        self._node = node
+
+    def select(self, selector):
+        return [LexborNode(node) for node in self._node.css(selector)]
+
+    def select_one(self, selector):
+        node = self._node.css_first(selector)
+        return LexborNode(node) if node is not None else None
+
+    def _strings(self):
+        for node in self._node.traverse(include_text=True):
+            if node.tag == "-text":
+                yield node.text_content
+
+    @property
+    def attrs(self):
+        return {k: v if v is not None else "" for k, v in self._node.attributes.items()}
+
+    @property
+    def html(self):
+        return self._node.html
+
+    def next_text(self):
+        sibling = self._node.next
+        return (
+            sibling.text_content
+            if sibling is not None and sibling.tag == "-text"
+            else ""
+        )
+
+
+@lru_cache(maxsize=512)
+def _lxml_selector(selector):
+    # Translating a selector to XPath costs more than running it, translate each once
+    from lxml.cssselect import CSSSelector
+
+    return CSSSelector(selector, translator="html")
+
+
+class LxmlNode(Node):
+    def __init__(self, element):
+        self._element = element
+
+    def select(self, selector):
+        return [LxmlNode(e) for e in _lxml_selector(selector)(self._element)]
+
+    def _strings(self):
+        return self._element.itertext()
+
+    @property
+    def attrs(self):
+        return dict(self._element.attrib)
+
+    @property
+    def html(self):
+        from lxml import html
+
+        return html.tostring(self._element, encoding="unicode", with_tail=False)
+
+    def next_text(self):
+        return self._element.tail or ""
+
+
+def compile_selector(selector, backend=None):
+    """
+    Compile a CSS selector for `backend` ahead of the pages, the nodes reuse it (lexbor doesn't
+    expose compiled selectors, for selectolax it's only checked).
+
+    Raises:
+    soupsieve.SelectorSyntaxError: If the selector is invalid.
+    """
+    backend = backend or DEFAULT_BACKEND
+    compiled = _soup_selector(selector)
+    if backend == "lxml":
+        return _lxml_selector(selector)
+    return compiled if backend == "bs4" else selector
+
+
+def parse_html(html, backend=None):
+    """
+    Parse an HTML document with `backend` (one of `BACKENDS`, `DEFAULT_BACKEND` by default).
+
+    Returns:
+    Node: The document, as a node to `select` from.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == "selectolax":
+        from selectolax.lexbor import LexborHTMLParser
+
+        return LexborNode(LexborHTMLParser(html).root)
+    if backend == "lxml":
+        from lxml import html as lxml_html
+
+        return LxmlNode(lxml_html.document_fromstring(html))
+    if backend == "bs4":
+        return SoupNode(BeautifulSoup(html, "html.parser"))
+    raise ValueError(f"Unknown HTML parser backend: {backend}, use one of {BACKENDS}.")
+
+
+@lru_cache(maxsize=256)
+def _open_tag_re(spec):
+    """
+    The opening tags of a simple selector ("tag.class", "tag#id", "#id" or "tag"), and the class
+    or id they contain, if any.
+    """
+    match = re.fullmatch(r"([\w-]*)(?:([.#])([\w-]+))?", spec)
+    if not match:
+        raise ValueError(f"Not a simple selector: {spec}")
+    tag, kind, value = match.groups()
+    tag = re.escape(tag) if tag else r"[a-zA-Z][\w-]*"
+    if kind is None:
+        return re.compile(rf"<({tag})(?=[\s/>])[^>]*>", re.I), None
+    attr = "class" if kind == "." else "id"
+    name = re.escape(value)
+    # Quoted (among other classes) or unquoted
+    quoted = rf"[^\"']*(?<![\w-]){name}(?![\w-])[^\"']*" if kind == "." else name
+    name = rf"(?:[\"']{quoted}[\"']|{name}(?=[\s/>]))"
+    pattern = rf"<({tag})(?=[\s/>])[^>]*?\s{attr}\s*=\s*{name}[^>]*>"
+    return re.compile(pattern, re.I), value
+
+
+def _open_tags(html, spec):
+    """The opening tags of a simple selector in `html`, as regex matches."""
+    pattern, value = _open_tag_re(spec)
+    if value is None:
+        yield from pattern.finditer(html)
+        return
+    # Trying the pattern at every tag is slow, try it only at the tags containing the class/id
+    last_start = -1
+    pos = html.find(value)
+    while pos != -1:
+        start = html.rfind("<", 0, pos)
+        if start > last_start:
+            match = pattern.match(html, start)
+            if match and match.end() > pos:
+                last_start = start
+                yield match
+        pos = html.find(value, pos + len(value))
+
+
+@lru_cache(maxsize=64)
+def _tag_re(tag):
+    return re.compile(rf"<(/?){re.escape(tag)}(?=[\s/>])[^>]*>", re.I)
+
+
+def _element_end(html, tag, start):
+    """The end of the element whose opening tag ends at `start`, None if it isn't closed."""
+    depth = 1
+    for match in _tag_re(tag.lower()).finditer(html, start):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            return match.end()
+    return None
+
+
+def slice_elements(html, specs):
+    """
+    The HTML of the elements matching the simple selectors `specs`, from the raw text: each
+    element is cut out by balancing its tags. Elements within an element already cut out are
+    skipped.
+
+    Returns:
+    list[str]: The fragments in document order, None if an element isn't closed.
+    """
+    spans = []
+    for spec in specs:
+        for match in _open_tags(html, spec):
+            end = _element_end(html, match.group(1), match.end())
+            if end is None:
+                return None
+            spans.append((match.start(), end))
+    fragments, last_end = [], -1
+    for start, end in sorted(spans):
+        if start >= last_end:
+            fragments.append(html[start:end])
+            last_end = end
+    return fragments
+
+
+def parse_subtrees(html, specs, backend=None):
+    """
+    Parse only the elements of `html` matching the simple selectors `specs` (see
+    `slice_elements`), into one document; the whole page if one of them isn't closed. Selectors
+    run on it must not go through the elements' ancestors, except `body`.
+    """
+    fragments = slice_elements(html, specs)
+    if fragments is None:
+        return parse_html(html, backend)
+    return parse_html("<html><body>" + "".join(fragments) + "</body></html>", backend)
+
+
+_JSON_LD_RE = re.compile(
+    r"<script(?=[^>]*type\s*=\s*[\"']application/ld\+json[\"'])([^>]*)>(.*?)</script\s*>",
+    re.I | re.S,
+)
+_ASSIGNMENT_RE = re.compile(r"\s*=\s*(?=\{)")
+
+
+def find_json_ld(html, class_=None):
+    """The JSON-LD blocks of a page (with the class `class_`), parsed, without a tree."""
+    blocks = []
+    for match in _JSON_LD_RE.finditer(html):
+        if class_ is not None and not re.search(
+            rf"class\s*=\s*[\"'][^\"']*(?<![\w-]){re.escape(class_)}(?![\w-])",
+            match.group(1),
+        ):
+            continue
+        blocks.append(json.loads(match.group(2)))
+    return blocks
+
+
+def find_js_object(html, name):
+    """The JSON object assigned to the JavaScript variable `name` (`var name = {...}`), or None."""
+    decoder = json.JSONDecoder()
+    pos = html.find(name)
+    while pos != -1:
+        if pos == 0 or not (html[pos - 1].isalnum() or html[pos - 1] in "_$"):
+            match = _ASSIGNMENT_RE.match(html, pos + len(name))
+            if match:
+                try:
+                    return decoder.raw_decode(html, match.end())[0]
+                except json.JSONDecodeError:
+                    pass
+        pos = html.find(name, pos + len(name))
+    return None
@@ -0,0 +1,138 @@
+import re
+
+from .helpers_cleaning import clean_text2, remove_html_stuff
+from .helpers_geocoding import (
+    ADMIN_AREAS_2,
+    RE_ADMIN_TERMS,
+    RE_CONDO_ADDRESSES,
+    RE_LOCALITY_TERMS,
+    RE_SEFER_ADDRESSES,
+    construct_regex,
+)
+from .helpers_tokens import estimate_tokens
+from .regular_expressions import PHONE_RE
+
+# Token budget of an ad in the prompt. Most ads are well below it, the long ones are mostly
+# repeated boilerplate (amenity lists, "call now" lines, hashtags).
+AD_TOKEN_BUDGET = 400
+
+URL_RE = re.compile(r"https?://\S+|www\.\S+", re.IGNORECASE)
+HASHTAGS_RE = re.compile(r"(?:#\w+\s*){2,}")
+# The "Title: ...\nDescription: ..." layout of `combine_text`, also after whitespace is squished
+TITLE_DESCRIPTION_RE = re.compile(
+    r"^\s*(?:Title:\s*(?P<title>.*?)\s*)?(?:\bDescription:\s*(?P<description>.*))?$",
+    re.DOTALL,
+)
+# Lines, and sentences ending in a full stop or the Ethiopic full stop (።)
+SEGMENT_SPLIT_RE = re.compile(r"\n+|(?<=[.!?።])\s+")
+ADDRESS_HINT_RE = re.compile(
+    "|".join(
+        [
+            RE_LOCALITY_TERMS,
+            RE_ADMIN_TERMS,
+            construct_regex(ADMIN_AREAS_2),
+            RE_SEFER_ADDRESSES,
+            RE_CONDO_ADDRESSES,
+            r"\b(address|location|located|near)\b|አድራሻ|አጠገብ|ፊት\s*ለፊት",
+        ]
+    ),
+    re.IGNORECASE | re.UNICODE,
+)
+
+
+def _normalize_for_match(text):
+    return " ".join(re.sub(r"[^\w]+", " ", text.lower()).split())
+
+
+def split_title_description(text):
+    """The title and description of an ad text as built by `combine_text`, or None if unlabeled."""
+    match = TITLE_DESCRIPTION_RE.match(text)
+    if not match or match.group("title", "description") == (None, None):
+        return None
+    title, description = match.group("title", "description")
+    return title or "", description or ""
+
+
+def split_segments(text):
+    """Clean a text and split it into lines and sentences, dropping empty and repeated ones."""
+    text = URL_RE.sub(" ", remove_html_stuff(text))
+    text = HASHTAGS_RE.sub(" ", text)
+    segments = (clean_text2(s) for s in SEGMENT_SPLIT_RE.split(text))
+    seen = set()
+    unique = []
+    for segment in segments:
+        key = _normalize_for_match(segment)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(segment)
+    return unique
+
+
+def is_protected(segment):
+    """Whether a segment carries a phone number or an address, which are never truncated away."""
+    return bool(PHONE_RE.search(segment) or ADDRESS_HINT_RE.search(segment))
+
+
+def _truncate_words(text, budget):
+    """The longest prefix of whole words of `text` within `budget` tokens."""
+    words = text.split()
+    kept = []
+    used = 0
+    for word in words:
+        cost = estimate_tokens(word)
+        if used + cost > budget:
+            break
+        kept.append(word)
+        used += cost
+    return " ".join(kept)
+
+
+def fit_segments(segments, budget):
+    """
+    Keep the segments that fit in `budget` tokens: the protected ones (phones, addresses) first,
+    then the others in order of appearance. The kept segments are returned in their original order.
+    """
+    costs = [estimate_tokens(s) for s in segments]
+    if sum(costs) <= budget:
+        return segments
+    order = [i for i, s in enumerate(segments) if is_protected(s)]
+    order += [i for i in range(len(segments)) if i not in set(order)]
+    kept = {}
+    used = 0
+    for i in order:
+        if used + costs[i] <= budget:
+            kept[i] = segments[i]
+            used += costs[i]
+        elif not kept:
+            # A single segment over budget, e.g. an ad without line breaks
+            kept[i] = _truncate_words(segments[i], budget)
+            used = budget
+    return [kept[i] for i in sorted(kept)]
+
+
+def preprocess_ad_text(text, token_budget=AD_TOKEN_BUDGET):
+    """
+    Shrink an ad text before extraction: strip html, urls, emojis and symbol runs, drop repeated
+    lines and a title repeated in the description, and keep it within `token_budget` tokens
+    (estimated locally, see `estimate_tokens`) without losing the phone and address-bearing parts.
+    Returns the text on a single line.
+    """
+    parts = split_title_description(text)
+    if parts is None:
+        return " ".join(fit_segments(split_segments(text), token_budget))
+    title, description = parts
+    title = " ".join(split_segments(title))
+    segments = split_segments(description)
+    if title and _normalize_for_match(title) in _normalize_for_match(
+        " ".join(segments)
+    ):
+        title = ""
+    if title:
+        token_budget -= estimate_tokens(f"Title: {title} Description:")
+    segments = fit_segments(segments, max(token_budget, 0))
+    shrunk = []
+    if title:
+        shrunk.append(f"Title: {title}")
+    if segments:
+        shrunk.append(f"Description: {' '.join(segments)}")
+    return " ".join(shrunk)
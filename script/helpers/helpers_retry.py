@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RetryableError(Exception):
+    """Base class for transient errors that are worth retrying."""
+
+    retry_after = None  # seconds, if the server says so
+
+
+class RateLimitError(RetryableError):
+    """HTTP 429 / ResourceExhausted: quota or rate limit exceeded."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ServerError(RetryableError):
+    """HTTP 5xx: the service is unavailable or failed."""
+
+    pass
+
+
+class MalformedResponseError(RetryableError):
+    """The response is structurally broken, e.g. invalid JSON from the model. `text` is what was received."""
+
+    def __init__(self, message, text=None):
+        super().__init__(message)
+        self.text = text
+
+
+class AuthError(Exception):
+    """HTTP 401/403: the API key is invalid, disabled or not authorized. Not retried, but trips the key's circuit."""
+
+    pass
+
+
+class LocationNotSupportedError(Exception):
+    """HTTP 400 FailedPrecondition: the API is not available from the current location (region)."""
+
+    pass
+
+
+class MaxTokensError(Exception):
+    """The model stopped at `max_output_tokens`. The same prompt and config fails again, so it is not retried."""
+
+    pass
+
+
+class CircuitOpenError(Exception):
+    """The circuit for a key or endpoint is open: calls fail fast instead of adding to a retry storm."""
+
+    pass
+
+
+def _get_status_code(e):
+    """The HTTP status code of a `requests` or `google.api_core` exception, if any."""
+    response = getattr(e, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        # google.api_core.exceptions.GoogleAPICallError has the HTTP status in `code`
+        status = getattr(e, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def _get_retry_after(e):
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_connection_error(e):
+    # requests' ConnectionError and Timeout, httpx's TransportError (connect/read errors, timeouts)
+    names = ("ConnectionError", "Timeout", "TransportError")
+    return any(cls.__name__ in names for cls in type(e).__mro__)
+
+
+def classify_exception(e):
+    """
+    Map an exception raised by `requests` or the Gemini client to the typed exceptions above,
+    based on its HTTP status code rather than on its message. Other exceptions are returned as they are.
+    """
+    if isinstance(
+        e,
+        (
+            RetryableError,
+            AuthError,
+            LocationNotSupportedError,
+            MaxTokensError,
+            CircuitOpenError,
+        ),
+    ):
+        return e
+    status = _get_status_code(e)
+    if status == 429:
+        err = RateLimitError(str(e), _get_retry_after(e))
+    elif status is not None and 500 <= status < 600:
+        err = ServerError(str(e))
+    elif status in (401, 403):
+        err = AuthError(str(e))
+    elif status == 400 and "location" in str(e).lower():
+        err = LocationNotSupportedError(str(e))
+    elif status is None and _is_connection_error(e):
+        err = ServerError(str(e))
+    else:
+        return e
+    err.__cause__ = e
+    return err
+
+
+def full_jitter_backoff(attempt, base_delay=1.0, max_delay=60.0, rng=random):
+    """Exponential backoff with full jitter: uniform(0, min(max_delay, base_delay * 2**attempt))."""
+    return rng.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker. After `failure_threshold` consecutive failures of the types in
+    `trip_on`, the circuit opens and calls fail fast with `CircuitOpenError` for `reset_timeout`
+    seconds. Then a single trial call is let through (half-open): success closes the circuit,
+    failure opens it again. `on_open` is called (without the lock held) each time it opens.
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=5,
+        reset_timeout=30.0,
+        trip_on=(RateLimitError, ServerError, AuthError),
+        on_open=None,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trip_on = trip_on
+        self.on_open = on_open
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Whether a call may go through now."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """Give back a half-open trial call that was allowed but not made."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, err):
+        """Count a failure, if it is of a type this circuit trips on."""
+        if not isinstance(err, self.trip_on):
+            with self._lock:
+                self._trial_in_flight = False
+            return
+        with self._lock:
+            self._failures += 1
+            was_open = self._opened_at is not None and not self._trial_in_flight
+            self._trial_in_flight = False
+            if self._failures < self.failure_threshold or was_open:
+                return
+            self._opened_at = self._clock()
+        logger.warning(f"Circuit '{self.name}' opened after {self._failures} failures.")
+        if self.on_open is not None:
+            self.on_open(self)
+
+    def retry_in(self):
+        """Seconds until the circuit lets a trial call through."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(name, **kwargs):
+    """
+    The circuit breaker registered under `name` (e.g. "gemini:key-1", "gmaps:<key>"), created with
+    `kwargs` on first use. Workers that use the same key or endpoint share the same circuit.
+    """
+    with _BREAKERS_LOCK:
+        if name not in _BREAKERS:
+            _BREAKERS[name] = CircuitBreaker(name, **kwargs)
+        return _BREAKERS[name]
+
+
+def reset_breakers():
+    """Forget the registered circuit breakers, e.g. between the runs of a benchmark."""
+    with _BREAKERS_LOCK:
+        _BREAKERS.clear()
+
+
+class RetryPolicy:
+    """
+    Retry a call on `retry_on` exceptions (after `classify_exception`) with full-jitter exponential
+    backoff, honoring Retry-After, and guarded by circuit breakers. The final error is re-raised as
+    its typed exception.
+    """
+
+    def __init__(
+        self,
+        max_retries=4,
+        base_delay=1.0,
+        max_delay=60.0,
+        retry_on=(RetryableError,),
+        rng=None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.rng = rng or random.Random()
+
+    def _check_breakers(self, breakers):
+        for i, breaker in enumerate(breakers):
+            if not breaker.allow():
+                for other in breakers[:i]:
+                    other.release()
+                raise CircuitOpenError(
+                    f"Circuit '{breaker.name}' is open, retry in {breaker.retry_in():.0f}s."
+                )
+
+    def _handle_failure(self, e, attempt, breakers):
+        """Classify a failure and return the delay before the next attempt, or raise."""
+        err = classify_exception(e)
+        for breaker in breakers:
+            breaker.record_failure(err)
+        if not isinstance(err, self.retry_on) or attempt == self.max_retries - 1:
+            if err is e:
+                raise e
+            raise err from e
+        delay = full_jitter_backoff(attempt, self.base_delay, self.max_delay, self.rng)
+        if err.retry_after:
+            delay = max(delay, min(err.retry_after, self.max_delay))
+        logger.info(
+            f"{type(err).__name__} (attempt {attempt + 1}/{self.max_retries}), retrying in {delay:.1f}s: {err}"
+        )
+        return delay
+
+    def call(self, func, *args, breakers=(), on_retry=None, **kwargs):
+        """Call `func(*args, **kwargs)` with retries. `on_retry(err)` is called before each retry."""
+        for attempt in range(self.max_retries):
+            self._check_breakers(breakers)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._handle_failure(e, attempt, breakers)
+                if on_retry is not None:
+                    on_retry(e)
+                time.sleep(delay)
+            else:
+                for breaker in breakers:
+                    breaker.record_success()
+                return result
+
+    async def acall(self, func, *args, breakers=(), on_retry=None, **kwargs):
+        """The async variant of `call`, for a coroutine function `func`."""
+        for attempt in range(self.max_retries):
+            self._check_breakers(breakers)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._handle_failure(e, attempt, breakers)
+                if on_retry is not None:
+                    on_retry(e)
+                await asyncio.sleep(delay)
+            else:
+                for breaker in breakers:
+                    breaker.record_success()
+                return result
@@ -0,0 +1,99 @@
+from typing import NamedTuple
+
+from .helpers_preprocess import preprocess_ad_text
+from .helpers_tokens import estimate_tokens
+from .regular_expressions import BEDROOM_RE, PRICE_RE
+
+# `max_output_tokens` of the default and the long-output model configs (8192 is the model's limit)
+MAX_OUTPUT_TOKENS = 2048
+LONG_MAX_OUTPUT_TOKENS = 8192
+# Output tokens of one record of `PROPERTY_SCHEMA` as the model prints it (indented JSON in a
+# markdown block), and the share of the ad copied into free-text fields (addresses, features)
+RECORD_TOKENS = 350
+COPIED_INPUT_SHARE = 0.3
+# Send a job to the long-output config when its estimate exceeds this share of the default limit
+OUTPUT_MARGIN = 0.8
+
+
+class Job(NamedTuple):
+    """An extraction job: the ad text, its estimated input and output tokens, and whether it needs the long-output config."""
+
+    text: str
+    input_tokens: int
+    output_tokens: int
+    long_output: bool
+
+    @property
+    def tokens(self):
+        return self.input_tokens + self.output_tokens
+
+
+def estimate_records(text):
+    """The number of records the model will likely output, e.g. an ad listing several units with their prices."""
+    prices = sum(
+        1 for m in PRICE_RE.finditer(text) if any(m.group("kw", "mult", "cur"))
+    )
+    bedrooms = len({m.group("n") for m in BEDROOM_RE.finditer(text)})
+    return max(1, min(prices, bedrooms) if prices and bedrooms else 1)
+
+
+def estimate_output_tokens(text):
+    """The estimated number of output tokens of extracting `text`."""
+    return int(
+        estimate_records(text) * RECORD_TOKENS
+        + COPIED_INPUT_SHARE * estimate_tokens(text)
+    )
+
+
+def make_job(text, max_output_tokens=MAX_OUTPUT_TOKENS, margin=OUTPUT_MARGIN):
+    """An extraction job for `text`, estimated on the text as it is sent (see `preprocess_ad_text`)."""
+    clean = preprocess_ad_text(text)
+    output_tokens = estimate_output_tokens(clean)
+    return Job(
+        text,
+        estimate_tokens(clean),
+        output_tokens,
+        output_tokens > margin * max_output_tokens,
+    )
+
+
+def schedule(texts, max_output_tokens=MAX_OUTPUT_TOKENS, margin=OUTPUT_MARGIN):
+    """
+    The extraction jobs of `texts`, longest first, so that the slow jobs (and their retries) start
+    early instead of holding up the tail of a batch. Jobs likely to hit `max_output_tokens` are
+    flagged `long_output`, to be sent to a config with a higher limit up front.
+    """
+    jobs = [make_job(text, max_output_tokens, margin) for text in texts]
+    return sorted(jobs, key=lambda job: job.tokens, reverse=True)
+
+
+def pack_batches(jobs, max_batch_tokens, max_batch_size=None):
+    """
+    Pack jobs into batches of at most `max_batch_tokens` estimated tokens (and `max_batch_size`
+    jobs) with first-fit decreasing: long jobs get batches of their own or share them with a few
+    short ones, and the short jobs fill up the rest. A job over the budget gets its own batch.
+    Batches are returned longest first.
+    """
+    jobs = sorted(jobs, key=lambda job: job.tokens, reverse=True)
+    if not jobs:
+        return []
+    smallest = jobs[-1].tokens
+    batches = []
+    loads = []
+    # Indices of the batches that can still take the smallest job
+    open_batches = []
+    for job in jobs:
+        for i in open_batches:
+            if loads[i] + job.tokens <= max_batch_tokens:
+                batches[i].append(job)
+                loads[i] += job.tokens
+                break
+        else:
+            batches.append([job])
+            loads.append(job.tokens)
+            i = len(batches) - 1
+            open_batches.append(i)
+        full = max_batch_size is not None and len(batches[i]) >= max_batch_size
+        if full or loads[i] + smallest > max_batch_tokens:
+            open_batches.remove(i)
+    return batches
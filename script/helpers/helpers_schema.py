@@ -0,0 +1,329 @@
+import re
+
+import numpy as np
+import pandas as pd
+from pandas._libs.sparse import IntIndex
+
+from .helpers_cleaning import parse_price
+
+NUMBER_RE = re.compile(r"(?<![\w.])[-+]?\d[\d,]*(?:\.\d+)?")
+TRUE_VALUES = {"true", "yes", "y", "1", "available"}
+FALSE_VALUES = {"false", "no", "n", "0", "not available", "none"}
+# pandas dtypes of the schema types, for the columns of the tidy data
+DTYPES = {"float": "float64", "int": "Int64", "bool": "boolean"}
+# Most extracted fields are missing from most ads: float and object columns with at most this
+# share of values are stored sparse, and string columns with few distinct values (currency,
+# listing type, unit, furnishing, ...) as categoricals
+SPARSE_MAX_DENSITY = 0.1
+CATEGORY_MAX_LEVELS = 32
+
+
+class CoercionError(ValueError):
+    """A value can't be cast to the type of its field in the schema."""
+
+    pass
+
+
+def _join_list(values):
+    return ";".join(str(v) for v in values)
+
+
+def to_float(value):
+    if isinstance(value, bool):
+        raise CoercionError(f"Expecting a number, got {value!r}")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        # e.g. "2.5 million", "20,000 birr"
+        price = parse_price(value)
+        if price is not None:
+            return price
+        # e.g. "1,500", "200 sqm", but not ranges or several numbers
+        numbers = NUMBER_RE.findall(value)
+        if len(numbers) == 1:
+            return float(numbers[0].replace(",", ""))
+    raise CoercionError(f"Expecting a number, got {value!r}")
+
+
+def to_int(value):
+    number = to_float(value)
+    if not number.is_integer():
+        raise CoercionError(f"Expecting an integer, got {value!r}")
+    return int(number)
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in TRUE_VALUES:
+            return True
+        if text in FALSE_VALUES:
+            return False
+    raise CoercionError(f"Expecting a boolean, got {value!r}")
+
+
+def to_str(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        # e.g. "materials": ["brick", "wood"]
+        return _join_list(value)
+    if isinstance(value, (int, float, bool)):
+        return str(value)
+    raise CoercionError(f"Expecting a string, got {value!r}")
+
+
+def to_str_list(value):
+    if isinstance(value, list):
+        return _join_list(value)
+    return to_str(value)
+
+
+CASTERS = {
+    "float": to_float,
+    "int": to_int,
+    "bool": to_bool,
+    "str": to_str,
+    "list": to_str_list,
+}
+
+
+def _compile(node, prefix=""):
+    """{key: caster or compiled sub-schema} of a schema node, and {dotted field path: type}."""
+    compiled = {}
+    types = {}
+    for key, value in node.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            compiled[key], sub_types = _compile(value, f"{path}.")
+            types.update(sub_types)
+        else:
+            kind = "list" if isinstance(value, list) else value
+            if kind not in CASTERS:
+                raise ValueError(f"Unknown type {value!r} of the field {path}.")
+            compiled[key] = CASTERS[kind]
+            types[path] = kind
+    return compiled, types
+
+
+class CompiledSchema:
+    """
+    A record schema (e.g. `PROPERTY_SCHEMA`, as loaded by `load_schema`) compiled once into a tree
+    of casters. `flatten` checks, casts and flattens a record in a single pass: the schema fields
+    come out typed (lists joined with ";"), other fields are flattened like `pd.json_normalize`
+    with their lists joined, and values that can't be cast are set to None and counted.
+    """
+
+    def __init__(self, schema):
+        if isinstance(schema, list):
+            schema = schema[0]
+        self._tree, self.types = _compile(schema)
+        self.columns = list(self.types)
+        self.errors = {}  # {field path: number of values that couldn't be cast}
+
+    @property
+    def dtypes(self):
+        """{column: pandas dtype} of the typed columns."""
+        return {
+            path: DTYPES[kind] for path, kind in self.types.items() if kind in DTYPES
+        }
+
+    def flatten(self, record, flat=None, keys=None):
+        """
+        {dotted field path: value} of a record (of its `keys` only, if given), with the schema
+        fields cast to their type.
+        """
+        if flat is None:
+            flat = {}
+        items = record.items() if keys is None else ((k, record[k]) for k in keys)
+        self._flatten(items, self._tree, "", flat)
+        return flat
+
+    def _flatten(self, items, tree, prefix, flat):
+        for key, value in items:
+            path = f"{prefix}{key}"
+            node = tree.get(key) if tree is not None else None
+            if isinstance(value, dict):
+                # Unknown sub-fields are kept, like `json_normalize` does
+                self._flatten(
+                    value.items(),
+                    node if isinstance(node, dict) else None,
+                    f"{path}.",
+                    flat,
+                )
+            elif value is None:
+                flat[path] = None
+            elif callable(node):
+                try:
+                    flat[path] = node(value)
+                except CoercionError:
+                    self.errors[path] = self.errors.get(path, 0) + 1
+                    flat[path] = None
+            elif isinstance(value, list):
+                flat[path] = _join_list(value)
+            else:
+                flat[path] = value
+
+
+class ColumnBuffers:
+    """
+    Sparse column buffers for flattened records: each column keeps only the row indices and
+    values it has, so a wide table with mostly missing fields is built without a dict per cell.
+    `to_frame` builds the DataFrame in one step, with the schema dtypes, and with the mostly
+    missing columns sparse and the low-cardinality ones categorical (see `compact_array`).
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.n_rows = 0
+        self.columns = {}  # {column: (row indices, values)}
+
+    def _add(self, items):
+        """Add the (column, value) items to the current row."""
+        i = self.n_rows
+        for column, value in items:
+            if value is None:
+                continue
+            if column not in self.columns:
+                self.columns[column] = ([], [])
+            rows, values = self.columns[column]
+            rows.append(i)
+            values.append(value)
+
+    def append(self, record_id, output, input_text=None):
+        """
+        Add a row: the flattened, typed `output` between its id and its input text (left out
+        of the child rows of a record, see `append_children`).
+        """
+        row = {"id": record_id}
+        self.schema.flatten(output, row)
+        if input_text is not None:
+            row["input"] = input_text
+        self._add(row.items())
+        self.n_rows += 1
+
+    def append_children(self, record_id, outputs, input_text, suffix="multi"):
+        """
+        Add the records of one output as the child rows of a shared parent: the first row gets the
+        parent's id and input text, the others the id `{record_id}_{suffix}_suffix_{i}` and no
+        input, they refer to the parent through their id. The input text is stored once.
+        """
+        for i, output in enumerate(outputs):
+            if i == 0:
+                self.append(record_id, output, input_text)
+            else:
+                self.append(f"{record_id}_{suffix}_suffix_{i}", output)
+
+    def append_expanded(self, record_id, record, list_keys, length, input_text):
+        """
+        Add a record whose `list_keys` hold lists of dicts (e.g. several prices) as `length` child
+        rows, one per element, named like `append_children` with the "expand" suffix. The other
+        fields are flattened once and shared by the rows.
+        """
+        shared = self.schema.flatten(
+            record, keys=[k for k in record if k not in list_keys]
+        )
+        for i in range(length):
+            row_id = record_id if i == 0 else f"{record_id}_expand_suffix_{i}"
+            self._add((("id", row_id),))
+            self._add(shared.items())
+            element = {key: record[key][i] for key in list_keys}
+            self._add(self.schema.flatten(element).items())
+            if i == 0:
+                self._add((("input", input_text),))
+            self.n_rows += 1
+
+    def count(self, column):
+        """The number of non-missing values of a column."""
+        return len(self.columns[column][0]) if column in self.columns else 0
+
+    def _dense(self, column):
+        rows, values = self.columns[column]
+        dtype = self.schema.dtypes.get(column)
+        if dtype in ("Int64", "boolean"):
+            data = np.zeros(self.n_rows, dtype="int64" if dtype == "Int64" else "bool")
+            mask = np.ones(self.n_rows, dtype=bool)
+            data[rows] = values
+            mask[rows] = False
+            cls = pd.arrays.IntegerArray if dtype == "Int64" else pd.arrays.BooleanArray
+            return cls(data, mask)
+        return compact_array(rows, values, self.n_rows, dtype)
+
+    def to_frame(self):
+        """The DataFrame of the rows, columns in order of first appearance."""
+        return pd.DataFrame(
+            {column: self._dense(column) for column in self.columns},
+            index=pd.RangeIndex(self.n_rows),
+        )
+
+
+def compact_array(rows, values, n_rows, dtype=None):
+    """
+    A column of `n_rows` with `values` at `rows` (missing elsewhere): categorical for strings with
+    at most `CATEGORY_MAX_LEVELS` distinct values, sparse if at most `SPARSE_MAX_DENSITY` of the
+    rows have a value, dense otherwise. `dtype` "float64" makes a float column.
+    """
+    rows = np.asarray(rows, dtype=np.int32)
+    if dtype != "float64" and all(isinstance(v, str) for v in values):
+        levels = dict.fromkeys(values)
+        if len(levels) <= CATEGORY_MAX_LEVELS:
+            index = {level: i for i, level in enumerate(levels)}
+            codes = np.full(n_rows, -1, dtype=np.int8)
+            codes[rows] = [index[v] for v in values]
+            return pd.Categorical.from_codes(codes, list(levels))
+    values = np.asarray(values, dtype="float64" if dtype == "float64" else object)
+    if len(rows) <= SPARSE_MAX_DENSITY * n_rows:
+        return pd.arrays.SparseArray(
+            values,
+            sparse_index=IntIndex(n_rows, rows),
+            fill_value=np.nan,
+            dtype=pd.SparseDtype(values.dtype, np.nan),
+        )
+    array = np.full(n_rows, np.nan if dtype == "float64" else None, dtype=values.dtype)
+    array[rows] = values
+    return array
+
+
+def compact_frame(df, dtypes=None):
+    """
+    `df` with its float and object columns made compact like `ColumnBuffers.to_frame` does, e.g.
+    after concatenating frames whose categories or sparse columns differ. `dtypes` are the schema
+    dtypes ({column: pandas dtype}, see `CompiledSchema.dtypes`).
+    """
+    dtypes = dtypes or {}
+    columns = {}
+    for column, series in df.items():
+        dtype = dtypes.get(column)
+        if dtype in ("Int64", "boolean"):
+            columns[column] = series.astype(dtype)
+            continue
+        if isinstance(series.dtype, pd.SparseDtype):
+            series = series.sparse.to_dense()
+        values = series.to_numpy(dtype=object)
+        rows = np.flatnonzero(series.notna().to_numpy())
+        columns[column] = compact_array(rows, values[rows].tolist(), len(df), dtype)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def na_fractions(df):
+    """
+    The fraction of missing values of each column of `df`, read from the sparse index and the
+    categorical codes where it can, without a dense mask.
+    """
+    n = len(df)
+    fractions = {}
+    for column, series in df.items():
+        values = series.array
+        if n == 0:
+            fractions[column] = 1.0
+        elif isinstance(values, pd.arrays.SparseArray) and pd.isna(values.fill_value):
+            fractions[column] = 1 - values.sp_index.npoints / n
+        elif isinstance(values, pd.Categorical):
+            fractions[column] = float(np.count_nonzero(values.codes == -1)) / n
+        else:
+            fractions[column] = float(series.isna().mean())
+    return pd.Series(fractions, dtype="float64")
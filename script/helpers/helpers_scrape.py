@@ -1,4 +1,4 @@
-# Gets the text of a soup object (Tag) without raising an exception
+# Gets the text of a soup object (Tag), or of a `helpers_parse` node, without raising an exception
 def my_get_text(element, strip=True, default=""):
     try:
         return element.get_text(strip=strip)
@@ -0,0 +1,125 @@
+import sqlite3
+import time
+from pathlib import Path
+
+SEEN_PATH = "./data/housing/raw/seen.db"
+# Consecutive known listings after which a newest-first listing is abandoned
+STOP_AFTER = 20
+# Days between full sweeps, which walk every page and refetch the known listings for updates
+SWEEP_EVERY_DAYS = 28
+
+
+class SeenIndex:
+    """The listings (detail urls) scraped so far, per provider, with when they were first and last seen."""
+
+    def __init__(self, path=SEEN_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS listings (
+                provider TEXT NOT NULL,
+                url TEXT NOT NULL,
+                first_seen REAL,
+                last_seen REAL,
+                PRIMARY KEY (provider, url)
+            );
+            CREATE TABLE IF NOT EXISTS sweeps (provider TEXT PRIMARY KEY, at REAL);
+            """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def known(self, provider, urls):
+        """The subset of `urls` already seen."""
+        urls = list(urls)
+        known = set()
+        for i in range(0, len(urls), 500):
+            chunk = urls[i : i + 500]
+            rows = self._conn.execute(
+                "SELECT url FROM listings WHERE provider = ? "
+                f"AND url IN ({', '.join('?' * len(chunk))})",
+                (provider, *chunk),
+            )
+            known.update(url for (url,) in rows)
+        return known
+
+    def add(self, provider, urls):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO listings (provider, url, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (provider, url) DO UPDATE SET last_seen = excluded.last_seen",
+                [(provider, url, now, now) for url in urls],
+            )
+
+    def count(self, provider):
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM listings WHERE provider = ?", (provider,)
+        ).fetchone()[0]
+
+    def sweep_due(self, provider, every_days=SWEEP_EVERY_DAYS):
+        """Whether the last full sweep of a provider is older than `every_days`, or never was."""
+        row = self._conn.execute(
+            "SELECT at FROM sweeps WHERE provider = ?", (provider,)
+        ).fetchone()
+        return row is None or time.time() - row[0] > every_days * 86400
+
+    def record_sweep(self, provider):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sweeps (provider, at) VALUES (?, ?)",
+                (provider, time.time()),
+            )
+
+
+class EarlyStop:
+    """
+    Newest-first pagination with an early stop: feed it the links of each list page in order,
+    it returns the new ones and sets `stop` once `stop_after` known listings came in a row (a
+    new listing in between, e.g. a promoted old ad, starts the count over). Call `reset` at the
+    start of each listing and `seen(url)` once a listing is scraped.
+
+    A full sweep (by default when `index.sweep_due(provider)`) never stops and returns all
+    links, so the known listings are refetched for updates; call `finish` once it completed.
+    """
+
+    def __init__(self, index, provider, stop_after=STOP_AFTER, full_sweep=None):
+        self.index = index
+        self.provider = provider
+        self.stop_after = stop_after
+        self.full_sweep = (
+            index.sweep_due(provider) if full_sweep is None else full_sweep
+        )
+        self.streak = 0
+        self.skipped = 0
+
+    @property
+    def stop(self):
+        return not self.full_sweep and self.streak >= self.stop_after
+
+    def reset(self):
+        self.streak = 0
+
+    def filter(self, links):
+        """The links of a list page to scrape."""
+        known = self.index.known(self.provider, links)
+        for link in links:
+            self.streak = self.streak + 1 if link in known else 0
+        if self.full_sweep:
+            return list(links)
+        self.skipped += len(known)
+        return [link for link in links if link not in known]
+
+    def seen(self, url):
+        self.index.add(self.provider, [url])
+
+    def finish(self):
+        if self.full_sweep:
+            self.index.record_sweep(self.provider)
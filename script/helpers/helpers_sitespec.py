@@ -0,0 +1,265 @@
+"""
+Declarative extractors of detail pages: a site spec (JSON, in `scrapers/specs/<site>.json`)
+lists the fields of a record, where they are on the page and how to clean them; it is compiled
+once into a plan (checked selectors, resolved post-processors) that `SiteSpec.extract` runs on
+each page, with any backend of `helpers_parse`. A new site with the usual kind of page is a new
+spec; the odd cleaning step is a function registered with `@post_processor`.
+
+    {
+      "subtrees": ["div.main-container"],
+      "scopes": {"content": {"css": "div.main-container div.page-content", "required": true}},
+      "fields": {
+        "title": {"from": "content", "css": "h1 > strong", "default": ""},
+        "image_urls": {"from": "content", "css": "img", "all": true, "attr": "src"},
+        "id": {"css": "h4", "post": [["split", ": ", -1]]},
+        "details": {"css": "li.row", "all": true, "key": {"css": "b"}, "value": {"css": "i"}}
+      }
+    }
+
+A field selects, with `css` from the document (from a scope with `from`, or from the element of
+the enclosing field), one element (`all` for every one, `index` for the n-th), and takes its
+text (`strip`, `separator` as in bs4's `get_text`), an attribute (`attr`) or the text after it
+(`"get": "next_text"`); the `post` processors (`[name, *args]`) run on each value. Of several
+elements: `join` joins the values, `compact` drops the empty ones, `key`/`value` (sub-fields of
+each element) make a dict and so does `pairs` (of values that are `[key, value]` pairs). A
+field with `fields` is a dict of sub-fields of its element. `default` is the value when nothing
+matched (or the value is None), `optional` leaves the field out when nothing matched; `merge` puts the keys of a dict
+value in the record, `names` unpacks a list value into several keys, and `into` puts the value
+in an earlier dict field. A `required` scope that isn't on the page makes `extract` return None.
+"""
+
+import json
+from functools import lru_cache
+from pathlib import Path
+
+from .helpers_parse import (
+    available_backends,
+    compile_selector,
+    parse_html,
+    parse_subtrees,
+)
+
+SPECS_DIR = Path(__file__).resolve().parent.parent / "scrapers" / "specs"
+
+POST_PROCESSORS = {}
+
+
+def post_processor(fn):
+    """Register `fn(value, *args)` as a post-processor, under its name."""
+    POST_PROCESSORS[fn.__name__] = fn
+    return fn
+
+
+@post_processor
+def strip(value, chars=None):
+    return value.strip(chars)
+
+
+@post_processor
+def replace(value, old, new):
+    return value.replace(old, new)
+
+
+@post_processor
+def split(value, sep, index, maxsplit=-1):
+    """The `index`-th part of `value` split at `sep`."""
+    return value.split(sep, maxsplit)[index]
+
+
+@post_processor
+def pair(value, sep, default=None):
+    """The two parts of `value` split at `sep`, `[value, default]` unless there are two."""
+    parts = value.split(sep)
+    return parts if len(parts) == 2 else [value, default]
+
+
+@post_processor
+def drop(value, *values):
+    """None for the `values` (case-insensitive), e.g. placeholders; use with `compact`."""
+    return None if value.lower() in {v.lower() for v in values} else value
+
+
+FIELD_KEYS = {
+    "css",
+    "from",
+    "all",
+    "index",
+    "attr",
+    "get",
+    "strip",
+    "separator",
+    "post",
+    "join",
+    "compact",
+    "key",
+    "value",
+    "pairs",
+    "fields",
+    "default",
+    "optional",
+    "merge",
+    "names",
+    "into",
+}
+
+
+class Field:
+    """A compiled field of a spec, see the module docstring."""
+
+    def __init__(self, name, spec):
+        unknown = set(spec) - FIELD_KEYS
+        if unknown:
+            raise ValueError(f"Field {name}: unknown keys {sorted(unknown)}.")
+        self.name = name
+        self.css = spec.get("css")
+        if self.css is not None:
+            for backend in available_backends():
+                compile_selector(self.css, backend)
+        self.scope = spec.get("from")
+        self.all = spec.get("all", False)
+        self.index = spec.get("index")
+        self.attr = spec.get("attr")
+        self.get = spec.get("get", "text")
+        if self.get not in ("text", "next_text"):
+            raise ValueError(f"Field {name}: `get` is one of 'text', 'next_text'.")
+        self.strip = spec.get("strip", True)
+        self.separator = spec.get("separator", "")
+        self.post = []
+        for processor, *args in spec.get("post", []):
+            if processor not in POST_PROCESSORS:
+                raise ValueError(f"Field {name}: unknown post-processor {processor}.")
+            self.post.append((POST_PROCESSORS[processor], args))
+        self.join = spec.get("join")
+        self.compact = spec.get("compact", False)
+        self.key = Field("key", spec["key"]) if "key" in spec else None
+        self.value = Field("value", spec["value"]) if "value" in spec else None
+        self.pairs = spec.get("pairs", False)
+        self.fields = [Field(n, s) for n, s in spec.get("fields", {}).items()] or None
+        self.has_default = "default" in spec
+        self.default = spec.get("default")
+        self.optional = spec.get("optional", False)
+        self.merge = spec.get("merge", False)
+        self.names = spec.get("names")
+        self.into = spec.get("into")
+
+    def _value(self, node):
+        if self.fields is not None:
+            record = {}
+            for field in self.fields:
+                field.extract(node, record)
+            return record
+        if self.attr is not None:
+            value = node.get(self.attr)
+        elif self.get == "next_text":
+            value = node.next_text()
+        else:
+            value = node.get_text(strip=self.strip, separator=self.separator)
+        for fn, args in self.post:
+            if value is None:
+                break
+            value = fn(value, *args)
+        return value
+
+    def elements(self, node):
+        if self.css is None:
+            return [node]
+        if self.all:
+            return node.select(self.css)
+        if self.index is not None:
+            elements = node.select(self.css)
+            return elements[self.index : self.index + 1 or None]
+        element = node.select_one(self.css)
+        return [element] if element is not None else []
+
+    def value_of(self, node):
+        """The value of the field in `node`, None (or the default) if it isn't there."""
+        elements = self.elements(node) if node is not None else []
+        if not elements and (self.optional or self.has_default or not self.all):
+            return None if self.optional else self.default
+        if not self.all:
+            value = self._value(elements[0])
+        elif self.key is not None:
+            value = {}
+            for element in elements:
+                key = self.key.value_of(element)
+                if key:
+                    value[key] = self.value.value_of(element)
+        else:
+            values = [self._value(element) for element in elements]
+            if self.compact:
+                values = [v for v in values if v]
+            if self.pairs:
+                value = {k: v for k, v in values if k}
+            elif self.join is not None:
+                value = self.join.join(values)
+            else:
+                value = values
+        return self.default if value is None else value
+
+    def extract(self, node, record, scopes=None):
+        """Put the value of the field in `node` (or its scope) into `record`."""
+        if self.scope is not None:
+            node = scopes[self.scope]
+        value = self.value_of(node)
+        if value is None and self.optional:
+            return
+        if self.merge:
+            record.update(value or {})
+        elif self.names:
+            record.update(zip(self.names, value or [None] * len(self.names)))
+        elif self.into:
+            record[self.into][self.name] = value
+        else:
+            record[self.name] = value
+
+
+class SiteSpec:
+    """
+    A compiled site spec: `extract(html)` is the record of a page, None if a required scope
+    isn't on the page.
+    """
+
+    def __init__(self, spec):
+        self.subtrees = spec.get("subtrees")
+        self.scopes = []
+        for name, scope in spec.get("scopes", {}).items():
+            scope = dict(scope)
+            required = scope.pop("required", False)
+            self.scopes.append((name, Field(name, scope), required))
+        self.fields = [Field(name, field) for name, field in spec["fields"].items()]
+
+    def extract(self, html, backend=None, targeted=True):
+        if targeted and self.subtrees:
+            doc = parse_subtrees(html, self.subtrees, backend)
+        else:
+            doc = parse_html(html, backend)
+        return self.extract_from(doc)
+
+    def extract_from(self, doc):
+        """The record of a parsed page (a `helpers_parse` node)."""
+        scopes = {}
+        for name, scope, required in self.scopes:
+            node = scopes[scope.scope] if scope.scope else doc
+            elements = scope.elements(node) if node is not None else []
+            scopes[name] = elements[0] if elements else None
+            if scopes[name] is None and required:
+                return None
+        record = {}
+        for field in self.fields:
+            field.extract(doc, record, scopes)
+        return record
+
+
+@lru_cache(maxsize=None)
+def load_spec(site):
+    """
+    The compiled spec of a site, from `SPECS_DIR/<site>.json` (or the path `site`), compiled
+    once per process.
+
+    Raises:
+    ValueError: If the spec has unknown keys or post-processors.
+    soupsieve.SelectorSyntaxError: If a selector is invalid.
+    """
+    path = Path(site) if site.endswith(".json") else SPECS_DIR / f"{site}.json"
+    with open(path, "r", encoding="utf-8") as f:
+        return SiteSpec(json.load(f))
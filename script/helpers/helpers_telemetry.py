@@ -0,0 +1,179 @@
+import json
+import sqlite3
+import statistics
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+# USD per 1M (prompt, response) tokens, prompts up to 128k tokens (Google AI pricing, mid 2024)
+PRICES = {
+    "gemini-1.5-pro-latest": (3.50, 10.50),
+    "gemini-1.5-flash-latest": (0.35, 1.05),
+    "gemini-pro": (0.50, 1.50),
+}
+
+
+class RequestMetrics(NamedTuple):
+    """
+    The metrics of one extraction request: `attempts` includes the retries, and the token counts
+    add up over the attempts. A `cache_hit` is an ad answered without a model request (e.g. by
+    the rule-based fast path). `ads` is the number of ads the result was mapped to.
+    """
+
+    time: float
+    source: Optional[str]
+    model: Optional[str]
+    key_index: Optional[int]
+    prompt_tokens: int
+    response_tokens: int
+    latency: float
+    attempts: int
+    finish_reason: Optional[str]
+    parsed: bool
+    cache_hit: bool
+    ads: int
+    error: Optional[str]
+
+
+FIELDS = RequestMetrics._fields
+COLUMN_TYPES = {
+    "time": "REAL",
+    "latency": "REAL",
+    "prompt_tokens": "INTEGER",
+    "response_tokens": "INTEGER",
+    "attempts": "INTEGER",
+    "key_index": "INTEGER",
+    "parsed": "INTEGER",
+    "cache_hit": "INTEGER",
+    "ads": "INTEGER",
+}
+
+
+def make_metrics(**fields):
+    """A `RequestMetrics` with defaults for the fields not given."""
+    defaults = {
+        "time": time.time(),
+        "source": None,
+        "model": None,
+        "key_index": None,
+        "prompt_tokens": 0,
+        "response_tokens": 0,
+        "latency": 0.0,
+        "attempts": 0,
+        "finish_reason": None,
+        "parsed": False,
+        "cache_hit": False,
+        "ads": 1,
+        "error": None,
+    }
+    defaults.update(fields)
+    return RequestMetrics(**defaults)
+
+
+class JSONLSink:
+    """Append metrics to a JSON lines file, one request per line. Thread-safe."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, metrics):
+        line = json.dumps(metrics._asdict(), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SQLiteSink:
+    """Insert metrics into the `requests` table of a SQLite database. Thread-safe."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        columns = ", ".join(f"{f} {COLUMN_TYPES.get(f, 'TEXT')}" for f in FIELDS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS requests ({columns})")
+        self._insert = (
+            f"INSERT INTO requests ({', '.join(FIELDS)}) "
+            f"VALUES ({', '.join('?' * len(FIELDS))})"
+        )
+
+    def write(self, metrics):
+        with self._lock:
+            self._conn.execute(self._insert, tuple(metrics))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_sink(path):
+    """A `SQLiteSink` for a .db/.sqlite path, a `JSONLSink` otherwise."""
+    if Path(path).suffix in (".db", ".sqlite", ".sqlite3"):
+        return SQLiteSink(path)
+    return JSONLSink(path)
+
+
+_SINK = None
+
+
+def set_sink(sink):
+    """Send the metrics of the extraction requests to `sink` (None to stop); returns the previous sink."""
+    global _SINK
+    previous, _SINK = _SINK, sink
+    return previous
+
+
+def emit(metrics):
+    """Write `metrics` to the current sink, if any."""
+    if _SINK is not None:
+        _SINK.write(metrics)
+
+
+def read_metrics(path):
+    """The metrics written by a sink, as a list of dicts."""
+    if not Path(path).exists():
+        raise FileNotFoundError(f"File not found: {path}")
+    if Path(path).suffix in (".db", ".sqlite", ".sqlite3"):
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute(f"SELECT {', '.join(FIELDS)} FROM requests").fetchall()
+        finally:
+            conn.close()
+        records = [dict(zip(FIELDS, row)) for row in rows]
+        for record in records:
+            record["parsed"] = bool(record["parsed"])
+            record["cache_hit"] = bool(record["cache_hit"])
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def request_cost(record, prices=PRICES):
+    """The cost of a request in USD, from its token counts; None if the model has no price."""
+    if record["cache_hit"]:
+        return 0.0
+    model = (record["model"] or "").removeprefix("models/")
+    if model not in prices:
+        return None
+    prompt_price, response_price = prices[model]
+    return (
+        record["prompt_tokens"] * prompt_price
+        + record["response_tokens"] * response_price
+    ) / 1e6
+
+
+def percentile(values, q):
+    """The `q`-th percentile of `values`."""
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
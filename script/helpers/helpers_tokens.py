@@ -0,0 +1,31 @@
+import math
+import re
+
+# Rough characters per token of the Gemini tokenizer, by kind of text. Ethiopic script is split
+# into much shorter pieces than English. Check against `model.count_tokens` when precision matters.
+CHARS_PER_TOKEN = {
+    "latin": 4.0,
+    "digits": 3.0,
+    "ethiopic": 1.5,
+}
+PIECES_RE = re.compile(
+    r"(?P<latin>[A-Za-z]+)|(?P<digits>\d+)|(?P<ethiopic>[\u1200-\u137F]+)|(?P<space>\s+)|(?P<other>.)",
+    re.UNICODE | re.DOTALL,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text locally, without calling the API."""
+    if not text:
+        return 0
+    n = 0
+    for match in PIECES_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        if kind == "other":
+            # Punctuation is one token, emojis and other symbols are usually split in two
+            n += 1 if match.group().isascii() else 2
+            continue
+        n += math.ceil(len(match.group()) / CHARS_PER_TOKEN[kind])
+    return n
@@ -42,3 +42,49 @@ AM_RE = re.compile(AM_PAT, re.UNICODE)
 # pattern for irrelevant characters
 IRRELEVANT_PAT = r"[^a-zA-Z0-9\u1200-\u137F\s%s]" % re.escape("%#._+,/():|*@?$&-")
 IRRELEVANT_RE = re.compile(IRRELEVANT_PAT, re.IGNORECASE | re.UNICODE)
+
+# Price-like amounts, e.g. "ዋጋ 140 ሽ", "5.5 million", "50,000ብር", "birr 2,500,000"
+PRICE_RE = re.compile(
+    r"(?:(?P<kw>ዋጋው|ዋጋዉ|ዋጋ|price|birr|etb|ብር)\s*[:=-]?\s*)?"
+    r"(?P<amount>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)\s*"
+    r"(?:(?P<mult>ሚሊዮን|ሚሊየን|ሚሊ|million|mil|ሺህ|ሺ|ሽ|thousand|k)(?![a-z\u1200-\u137F]))?\s*"
+    r"(?:(?P<cur>ብር|birr|etb|br|usd|\$)(?![a-z]))?",
+    re.IGNORECASE | re.UNICODE,
+)
+
+# Property attributes stated in predictable forms, used by the rule-based extractor
+NUM_PAT = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+SQM_PAT = r"ካሬ(?:\s*ሜትር)?|kare|care|sqm|sq\.?\s*m|m2|m²|square\s*met(?:er|re)s?"
+# e.g. "120 kare", "114.8m²" and, if there is none, "ካሬ ሜትር 600"
+SIZE_RE = re.compile(
+    rf"(?P<n>{NUM_PAT})\s*(?:{SQM_PAT})(?![a-z])", re.IGNORECASE | re.UNICODE
+)
+SIZE_AFTER_UNIT_RE = re.compile(
+    rf"(?:{SQM_PAT})\s*[:=-]?\s*(?P<n>{NUM_PAT})", re.IGNORECASE | re.UNICODE
+)
+BEDROOM_PAT = r"መኝታ|bed\s*rooms?|beds?|bdrms?|mign?ta|megn?i?ta"
+# e.g. "ባለ 2 መኝታ", "3bdrm", "1 mignta" and, if there is none, "መኝታ ቤት 6"
+BEDROOM_RE = re.compile(
+    rf"(?P<n>\d+)[ \t]*-?[ \t]*(?:{BEDROOM_PAT})", re.IGNORECASE | re.UNICODE
+)
+BEDROOM_AFTER_RE = re.compile(
+    rf"(?:{BEDROOM_PAT})(?:\s*ቤት)?\s*[:=-]?\s*(?P<n>\d+)(?!\s*(?:{SQM_PAT}))",
+    re.IGNORECASE | re.UNICODE,
+)
+BATHROOM_PAT = r"ሻወር|ሻውር|ሽንት\s*ቤት|መታጠቢያ(?:\s*ቤት)?|bath\s*rooms?|baths?|metateb\w*"
+BATHROOM_RE = re.compile(
+    rf"(?P<n>\d+)[ \t]*-?[ \t]*(?:{BATHROOM_PAT})", re.IGNORECASE | re.UNICODE
+)
+BATHROOM_AFTER_RE = re.compile(
+    rf"(?:{BATHROOM_PAT})\s*[:=-]?\s*(?P<n>\d+)(?!\s*(?:{SQM_PAT}))",
+    re.IGNORECASE | re.UNICODE,
+)
+STUDIO_RE = re.compile(r"\bstudio\b|ስቱዲዮ", re.IGNORECASE | re.UNICODE)
+USD_RE = re.compile(r"\$|\busd\b|\bdollars?\b|ዶላር", re.IGNORECASE | re.UNICODE)
+# What a price is for, e.g. "25,000 ብር በካሬ", "50k per month", "በወር 30 ሺ"
+PER_SQM_RE = re.compile(
+    rf"(?:\bper|/|በ)\s*(?:{SQM_PAT})(?![a-z])", re.IGNORECASE | re.UNICODE
+)
+PER_MONTH_RE = re.compile(
+    r"\bper\s*month|/\s*month|\bmonthly|በወር|በየወሩ|ወርሃዊ", re.IGNORECASE | re.UNICODE
+)
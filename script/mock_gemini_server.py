@@ -0,0 +1,315 @@
+"""
+A local stand-in for the Gemini `generate_content` REST API (also streamed), to benchmark the extraction runners
+without burning quota. It replays the outputs recorded in our `*_extracted_property_attributes_gemini.json`
+files, and can inject latency, HTTP errors (429/500/503), `MAX_TOKENS` finish reasons and malformed JSON.
+
+Point the client at it with:
+    configure_model(api_key, transport="rest", api_endpoint="http://127.0.0.1:8080")
+
+Usage:
+    python3 ./script/mock_gemini_server.py --port 8080 --latency lognormal:0.5,0.6 --errors 429=0.05,503=0.01
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from helpers.helpers_io import list_files, read_json
+from helpers.helpers_preprocess import preprocess_ad_text
+
+# The ad text is embedded at the end of the prompt, after the few-shot examples' own markers,
+# see `extract_attributes`
+PROMPT_INPUT_RE = re.compile(r'.*\*\*Input\*\*: "(.*)"\n\*\*Output\*\*: $', re.DOTALL)
+GENERATE_PATH_RE = re.compile(r"/v1beta/models/(?P<model>[^:/]+):(?P<method>\w+)")
+
+# Characters per streamed chunk, and the share of the latency before the first chunk
+CHUNK_SIZE = 100
+FIRST_CHUNK_SHARE = 0.2
+
+HTTP_STATUSES = {
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+}
+
+
+def _normalize(text):
+    # The same preprocessing as `extract_attributes`, so that raw recorded inputs match the prompts
+    return preprocess_ad_text(text)
+
+
+def load_recorded_outputs(paths):
+    """
+    {input text: response text} from recorded extraction files. Parsed outputs are serialized back
+    into the markdown JSON block the model returns, raw (unparsed) outputs are replayed as they are.
+    """
+    recorded = {}
+    for path in paths:
+        for item in read_json(path):
+            output = item.get("output")
+            if not output or (isinstance(output, dict) and "error" in output):
+                continue
+            if not isinstance(output, str):
+                output = (
+                    f"```json\n{json.dumps(output, indent=2, ensure_ascii=False)}\n```"
+                )
+            recorded[_normalize(item["input"])] = output
+    return recorded
+
+
+def parse_latency(spec):
+    """
+    A latency sampler (in seconds) from a spec string: "fixed:0.5", "uniform:0.2,1.5",
+    "lognormal:mu,sigma" (of the underlying normal), or "none".
+    """
+    if not spec or spec == "none":
+        return lambda rng: 0.0
+    kind, _, params = spec.partition(":")
+    params = [float(p) for p in params.split(",") if p]
+    if kind == "fixed":
+        return lambda rng: params[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(*params)
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(*params)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_rates(spec):
+    """{HTTP status: probability} from a spec string, e.g. "429=0.05,503=0.01"."""
+    rates = {}
+    for part in filter(None, (spec or "").split(",")):
+        status, rate = part.split("=")
+        if int(status) not in HTTP_STATUSES:
+            raise ValueError(
+                f"Unsupported status {status}, one of {list(HTTP_STATUSES)}"
+            )
+        rates[int(status)] = float(rate)
+    return rates
+
+
+class MockGemini:
+    """The replay and fault-injection logic, and request statistics, shared by the handler threads."""
+
+    def __init__(
+        self,
+        recorded,
+        latency="none",
+        errors=None,
+        max_tokens_rate=0.0,
+        malformed_rate=0.0,
+        seed=1,
+    ):
+        self.recorded = recorded
+        self.sample_latency = parse_latency(latency)
+        self.error_rates = errors or {}
+        self.max_tokens_rate = max_tokens_rate
+        self.malformed_rate = malformed_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _draw(self):
+        with self._lock:
+            return self._rng.random(), self.sample_latency(self._rng)
+
+    def respond(self, body, stream=False):
+        """
+        (HTTP status, response payload) for a `generateContent` request body. With `stream`
+        (`streamGenerateContent`), the payload of a successful response is a generator of chunks.
+        """
+        self._count("requests")
+        u, latency = self._draw()
+        if stream:
+            # Time to first chunk; the rest of the latency is spread over the chunks
+            time.sleep(latency * FIRST_CHUNK_SHARE)
+        else:
+            time.sleep(latency)
+
+        # Injected HTTP errors, drawn from one uniform number so that the rates add up
+        threshold = 0.0
+        for status, rate in self.error_rates.items():
+            threshold += rate
+            if u < threshold:
+                self._count(f"error_{status}")
+                message = f"Injected error {status}"
+                return status, {
+                    "error": {
+                        "code": status,
+                        "message": message,
+                        "status": HTTP_STATUSES[status],
+                    }
+                }
+
+        prompt = "".join(
+            part.get("text", "")
+            for content in body.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        match = PROMPT_INPUT_RE.search(prompt)
+        text = self.recorded.get(_normalize(match.group(1))) if match else None
+        if text is None:
+            self._count("not_recorded")
+            text = "```json\n[]\n```"
+
+        finish_reason = "STOP"
+        u -= threshold
+        if u < self.max_tokens_rate:
+            self._count("max_tokens")
+            finish_reason = "MAX_TOKENS"
+            text = text[: len(text) // 2]
+        elif u < self.max_tokens_rate + self.malformed_rate:
+            self._count("malformed")
+            # Drop a closing brace and add a trailing comma, the usual suspects
+            text = text.replace("}", ",", 1)
+        self._count("ok")
+
+        prompt_tokens = len(prompt) // 4
+        response_tokens = len(text) // 4
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": response_tokens,
+            "totalTokenCount": prompt_tokens + response_tokens,
+        }
+        if stream:
+            delay = latency * (1 - FIRST_CHUNK_SHARE)
+            return 200, self._stream_chunks(text, finish_reason, usage, delay)
+        return 200, _response_payload(text, finish_reason, usage)
+
+    def _stream_chunks(self, text, finish_reason, usage, delay):
+        chunks = [text[i : i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
+        for i, chunk in enumerate(chunks):
+            time.sleep(delay / len(chunks))
+            last = i == len(chunks) - 1
+            yield _response_payload(
+                chunk, finish_reason if last else None, usage if last else None
+            )
+
+
+def _response_payload(text, finish_reason=None, usage=None):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish_reason:
+        candidate["finishReason"] = finish_reason
+    payload = {"candidates": [candidate]}
+    if usage:
+        payload["usageMetadata"] = usage
+    return payload
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, chunks):
+            # The REST transport reads a streamed JSON array of responses
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, payload in enumerate(chunks):
+                data = ("," if i else "[") + json.dumps(payload, ensure_ascii=False)
+                self._write_chunk(data.encode("utf-8"))
+            self._write_chunk(b"]")
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/stats":
+                return self._send(200, mock.stats)
+            self._send(404, {"error": {"code": 404, "message": "Not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            match = GENERATE_PATH_RE.match(self.path)
+            method = match.group("method") if match else None
+            if method not in ("generateContent", "streamGenerateContent"):
+                return self._send(404, {"error": {"code": 404, "message": self.path}})
+            stream = method == "streamGenerateContent"
+            status, payload = mock.respond(body, stream)
+            if stream and status == 200:
+                return self._send_stream(payload)
+            self._send(status, payload)
+
+        def log_message(self, format, *args):
+            pass  # keep the benchmark output clean
+
+    return Handler
+
+
+def make_server(mock, host="127.0.0.1", port=8080):
+    """A threading HTTP server for `mock`; `port=0` picks a free port (see `server.server_port`)."""
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    return server
+
+
+def start_server(mock, host="127.0.0.1", port=0):
+    """Start the server in a background thread; returns the server and its endpoint."""
+    server = make_server(mock, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def default_recordings():
+    data_dir = Path("./data/housing/processed/structured")
+    return list_files(str(data_dir), "*_extracted_property_attributes_gemini.json")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--recordings", nargs="*", default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", default="none")
+    parser.add_argument("--errors", default="", help='e.g. "429=0.05,500=0.01"')
+    parser.add_argument("--max-tokens-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser
+
+
+def mock_from_args(args):
+    recorded = load_recorded_outputs(args.recordings or default_recordings())
+    return MockGemini(
+        recorded,
+        latency=args.latency,
+        errors=parse_rates(args.errors),
+        max_tokens_rate=args.max_tokens_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    mock = mock_from_args(args)
+    server = make_server(mock, args.host, args.port)
+    print(
+        f"Replaying {len(mock.recorded)} recorded outputs on http://{args.host}:{args.port}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Stats: {mock.stats}")
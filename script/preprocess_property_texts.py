@@ -0,0 +1,53 @@
+"""
+Report the tokens saved per ad by the preprocessing before extraction (see `helpers_preprocess`),
+per provider: the average tokens per ad before, after and saved, and the share saved. Token
+counts are the local estimates of `estimate_tokens`.
+
+Usage:
+    python3 ./script/preprocess_property_texts.py --budget 400
+"""
+
+import argparse
+import csv
+from pathlib import Path
+
+from extract_property_attributes_gemini import load_property_texts
+from helpers.helpers_preprocess import AD_TOKEN_BUDGET, preprocess_ad_text
+from helpers.helpers_tokens import estimate_tokens
+
+PROVIDERS = ["listings", "loozap", "ethiopianproperties", "ethiopiapropertycentre"]
+
+
+def token_savings(texts, token_budget=AD_TOKEN_BUDGET):
+    """The number of ads, the average tokens per ad before and after preprocessing, and the number of truncated ads."""
+    before = after = truncated = 0
+    for text in texts:
+        clean = preprocess_ad_text(text, token_budget)
+        before += estimate_tokens(" ".join(text.split()))
+        after += estimate_tokens(clean)
+        truncated += clean != preprocess_ad_text(text, float("inf"))
+    n = max(len(texts), 1)
+    return len(texts), before / n, after / n, truncated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget", type=int, default=AD_TOKEN_BUDGET)
+    parser.add_argument("--data-dir", default="./data/housing/processed")
+    args = parser.parse_args()
+
+    csv.field_size_limit(1000_000)
+    print(
+        f"{'provider':<25}{'ads':>7}{'before':>9}{'after':>9}{'saved':>9}{'saved %':>9}{'truncated':>11}"
+    )
+    for provider in PROVIDERS:
+        csv_path = Path(args.data_dir) / f"{provider}_cleaned.csv"
+        if not csv_path.exists():
+            continue
+        texts = list(load_property_texts(csv_path))
+        if not texts:
+            continue
+        n, before, after, truncated = token_savings(texts, args.budget)
+        print(
+            f"{provider:<25}{n:>7}{before:>9.1f}{after:>9.1f}{before - after:>9.1f}{1 - after / before:>9.1%}{truncated:>11}"
+        )
@@ -0,0 +1,232 @@
+"""
+Re-parse the saved ad pages of a site (loozap, Ethiopia Property Centre) on a process pool.
+The files are sharded into chunks, each chunk's records are written as a partition as soon as it
+is parsed (in whichever order the chunks finish), then the partitions are assembled into one
+JSON file. With --only-changed, only the files whose mtime/size (or content hash, with
+--fingerprint hash) changed since the last run are parsed again.
+
+Usage:
+    python3 -m script.reparse_html loozap --workers 8 --only-changed
+    python3 -m script.reparse_html epc --backend bs4 --out ./data/housing/raw/epc_reparsed.json
+"""
+
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from script.helpers.helpers_io import list_files, read_json, write_json
+
+# The saved pages of a site, and the output of the re-parse
+SITES = {
+    "loozap": (
+        "./data/housing/raw/loozap/html",
+        "./data/housing/raw/loozap/loozap_data_from_file.json",
+    ),
+    "epc": (
+        "./data/housing/raw/ethiopiapropertycentre/html",
+        "./data/housing/raw/ethiopiapropertycentre/product_data_from_file.json",
+    ),
+}
+
+
+def get_parser(site):
+    """The parse function of a site, `parse(html, filename, backend)`."""
+    if site == "loozap":
+        from script.scrapers.scrape_loozap_async import parse_details
+
+        return parse_details
+    if site == "epc":
+        from script.scrapers.scrape_ethiopiapropertycentre_from_file import (
+            parse_product_details,
+        )
+
+        return parse_product_details
+    raise ValueError(f"Unknown site: {site}, use one of {list(SITES)}.")
+
+
+def fingerprint(path, how="mtime", content=None):
+    """What tells a file changed: its mtime and size, or the hash of its content."""
+    if how == "hash":
+        if content is None:
+            with open(path, "rb") as f:
+                content = f.read()
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _parse_chunk(site, paths, known, how, backend):
+    """
+    Parse the changed files of a chunk (in a worker process).
+
+    Returns:
+    tuple: (records, {file: fingerprint} of the parsed files, number of failed files)
+    """
+    parse = get_parser(site)
+    records, fingerprints, failed = [], {}, 0
+    for path in paths:
+        name = os.path.basename(path)
+        with open(path, "rb") as f:
+            content = f.read()
+        fp = fingerprint(path, how, content)
+        if known.get(name) == fp:
+            continue
+        try:
+            record = parse(content.decode("utf-8"), name, backend)
+        except Exception as e:
+            print(f"Failed to parse {path}: {e!r}")
+            failed += 1
+            continue
+        fingerprints[name] = fp
+        if record:
+            records.append(record)
+    return records, fingerprints, failed
+
+
+def record_file(record):
+    return record.get("file_path") or os.path.basename(record["url"])
+
+
+def load_manifest(parts_dir):
+    """{"parts": [partition files], "fingerprints": {file: fingerprint}, "part_of": {file: partition index}}"""
+    try:
+        return read_json(parts_dir / "manifest.json")
+    except FileNotFoundError:
+        return {"parts": [], "fingerprints": {}, "part_of": {}}
+
+
+def assemble_partitions(parts_dir, parts, part_of):
+    """The records of each file from its (latest) partition."""
+    records = []
+    for i, part in enumerate(parts):
+        records.extend(
+            r for r in read_json(parts_dir / part) if part_of.get(record_file(r)) == i
+        )
+    return records
+
+
+def reparse(
+    site,
+    out_path,
+    executor,
+    workers=1,
+    html_dir=None,
+    chunk_size=500,
+    only_changed=False,
+    how="mtime",
+    backend=None,
+):
+    """
+    Re-parse the saved pages of a site into `out_path`, see the module docstring. At most twice
+    as many chunks as the `workers` of `executor` are in flight.
+
+    Returns:
+    dict: The number of files, parsed files, failures, records and pages/s.
+    """
+    html_dir = html_dir or SITES[site][0]
+    files = sorted(list_files(html_dir, "*.html"))
+    parts_dir = Path(out_path).parent / "parts" / Path(out_path).stem
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(parts_dir)
+    if not only_changed or manifest.get("how", how) != how:
+        manifest = {"parts": [], "fingerprints": {}, "part_of": {}}
+    manifest["how"] = how
+    known = manifest["fingerprints"]
+
+    start = time.perf_counter()
+    stats = {"files": len(files), "parsed": 0, "failed": 0}
+    chunks = [files[i : i + chunk_size] for i in range(0, len(files), chunk_size)]
+    max_in_flight = 2 * workers
+    # Partitions are named in sequence, kept ones may have any number
+    part_number = max((int(p[5:10]) for p in manifest["parts"]), default=-1) + 1
+    pending, next_chunk = set(), 0
+    while pending or next_chunk < len(chunks):
+        while next_chunk < len(chunks) and len(pending) < max_in_flight:
+            chunk = chunks[next_chunk]
+            chunk_known = {
+                name: known[name]
+                for name in map(os.path.basename, chunk)
+                if name in known
+            }
+            pending.add(
+                executor.submit(_parse_chunk, site, chunk, chunk_known, how, backend)
+            )
+            next_chunk += 1
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            records, fingerprints, failed = future.result()
+            stats["failed"] += failed
+            if not fingerprints:
+                continue
+            part = f"part-{part_number:05d}.json"
+            part_number += 1
+            if records:
+                write_json(records, parts_dir / part, overwrite=True, verbose=False)
+            else:
+                # write_json leaves an empty file for no data
+                (parts_dir / part).write_text("[]")
+            index = len(manifest["parts"])
+            manifest["parts"].append(part)
+            for name, fp in fingerprints.items():
+                known[name] = fp
+                manifest["part_of"][name] = index
+            stats["parsed"] += len(fingerprints)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Parsed {stats['parsed']} files ({stats['failed']} failed) "
+            f"of {len(files)}, {stats['parsed'] / max(elapsed, 1e-9):.0f} pages/s."
+        )
+    # Saved pages that were deleted since the last run
+    names = set(map(os.path.basename, files))
+    for name in set(manifest["part_of"]) - names:
+        del manifest["part_of"][name]
+        known.pop(name, None)
+    # Partitions whose files were all parsed again since
+    used = sorted(set(manifest["part_of"].values()))
+    for i, part in enumerate(manifest["parts"]):
+        if i not in used:
+            (parts_dir / part).unlink(missing_ok=True)
+    renumber = {old: new for new, old in enumerate(used)}
+    manifest["parts"] = [manifest["parts"][i] for i in used]
+    manifest["part_of"] = {n: renumber[i] for n, i in manifest["part_of"].items()}
+    write_json(manifest, parts_dir / "manifest.json", overwrite=True, verbose=False)
+
+    records = assemble_partitions(parts_dir, manifest["parts"], manifest["part_of"])
+    write_json(records, out_path, overwrite=True)
+    elapsed = time.perf_counter() - start
+    stats["records"] = len(records)
+    stats["pages_per_s"] = stats["parsed"] / max(elapsed, 1e-9)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("site", choices=list(SITES))
+    parser.add_argument("--html-dir", default=None)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--only-changed", action="store_true")
+    parser.add_argument("--fingerprint", choices=["mtime", "hash"], default="mtime")
+    parser.add_argument("--backend", default=None)
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        stats = reparse(
+            args.site,
+            args.out or SITES[args.site][1],
+            executor,
+            workers=args.workers,
+            html_dir=args.html_dir,
+            chunk_size=args.chunk_size,
+            only_changed=args.only_changed,
+            how=args.fingerprint,
+            backend=args.backend,
+        )
+    print(
+        f"{stats['records']} records from {stats['files']} files, {stats['parsed']} parsed "
+        f"({stats['failed']} failed) at {stats['pages_per_s']:.0f} pages/s."
+    )
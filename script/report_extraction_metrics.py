@@ -0,0 +1,76 @@
+"""
+Summarize the per-request extraction metrics (see `helpers/helpers_telemetry.py`) per provider CSV
+and per model and API key: requests, ads, cache hits, p50/p95 latency, attempts, parse success,
+tokens and cost per 1k ads. Use it to tune the concurrency and batch sizes of the runners.
+
+Usage:
+    python3 ./script/report_extraction_metrics.py --metrics ./logs/extraction_metrics.jsonl
+"""
+
+import argparse
+
+from helpers.helpers_telemetry import percentile, read_metrics, request_cost
+
+
+def summarize(records):
+    """The summary of a group of request metrics."""
+    requests = [r for r in records if not r["cache_hit"]]
+    latencies = [r["latency"] for r in requests]
+    costs = [request_cost(r) for r in records]
+    ads = sum(r["ads"] for r in records)
+    cost = sum(c for c in costs if c is not None)
+    return {
+        "requests": len(requests),
+        "ads": ads,
+        "cache_hits": sum(r["ads"] for r in records if r["cache_hit"]),
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "attempts": sum(r["attempts"] for r in requests) / max(len(requests), 1),
+        "parsed": sum(r["parsed"] for r in requests) / max(len(requests), 1),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in requests),
+        "response_tokens": sum(r["response_tokens"] for r in requests),
+        "cost": cost,
+        "cost_per_1k_ads": 1000 * cost / ads if ads else float("nan"),
+        "unpriced": sum(c is None for c in costs),
+    }
+
+
+def group_by(records, key):
+    groups = {}
+    for record in records:
+        groups.setdefault(key(record), []).append(record)
+    return {name: summarize(group) for name, group in sorted(groups.items())}
+
+
+def print_table(title, rows):
+    header = (
+        f"{title:<40}{'requests':>9}{'ads':>8}{'hits':>7}{'p50 s':>8}{'p95 s':>8}"
+        f"{'tries':>7}{'parsed':>8}{'tokens in':>11}{'out':>9}{'$/1k ads':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for name, r in rows.items():
+        print(
+            f"{name:<40}{r['requests']:>9}{r['ads']:>8}{r['cache_hits']:>7}"
+            f"{r['p50_s']:>8.2f}{r['p95_s']:>8.2f}{r['attempts']:>7.2f}{r['parsed']:>8.1%}"
+            f"{r['prompt_tokens']:>11}{r['response_tokens']:>9}{r['cost_per_1k_ads']:>10.3f}"
+        )
+    unpriced = sum(r["unpriced"] for r in rows.values())
+    if unpriced:
+        print(f"Note: {unpriced} requests of models without a price are not costed.")
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--metrics", default="./logs/extraction_metrics.jsonl")
+    args = parser.parse_args()
+
+    records = read_metrics(args.metrics)
+    if not records:
+        raise SystemExit(f"No metrics in {args.metrics}.")
+    print_table("provider", group_by(records, lambda r: r["source"] or "-"))
+    model_key = lambda r: f"{r['model'] or '-'} #{r['key_index']}"
+    print_table(
+        "model #key", group_by([r for r in records if not r["cache_hit"]], model_key)
+    )
@@ -1,17 +1,22 @@
+import asyncio
 import json
 import logging
 import os
 import re
-import requests
 import time
+from functools import partial
+
+import httpx
 from bs4 import BeautifulSoup
+from ..helpers.helpers_crawl import Crawler, Site, crawl
+from ..helpers.helpers_seen import EarlyStop, SeenIndex
 
 logging.basicConfig(filename="./script/scrapers/beten.log", level=logging.DEBUG)
 
 
 # apartment, land, villa, etc?
-def get_property_categories():
-    resp = requests.get("https://betenethiopia.com/properties")
+async def get_property_categories(crawler):
+    resp = await crawler.get("https://betenethiopia.com/properties")
     soup = BeautifulSoup(resp.text, "html.parser")
     property_cats = soup.select(
         'select#ptype[name="property_category"] > option[value]'
@@ -20,15 +25,15 @@ def get_property_categories():
 
 
 # for rent or sale?
-def get_property_types():
-    resp = requests.get("https://betenethiopia.com/properties")
+async def get_property_types(crawler):
+    resp = await crawler.get("https://betenethiopia.com/properties")
     soup = BeautifulSoup(resp.text, "html.parser")
     property_types = soup.select("select#propertytype > option[value]")
     return {opt.text.strip(): opt.attrs.get("value") for opt in property_types}
 
 
-def get_property_page_links(session, property_category_id, property_type_id):
-    """Fetches URLs of all properties across pages for a specific property category and type."""
+async def get_page_links(crawler, property_category_id, property_type_id):
+    """Fetches the URLs of the pages of properties of a specific property category and type."""
     url = "https://betenethiopia.com/advance/search"
     params = {
         "city": "1",
@@ -37,14 +42,10 @@ def get_property_page_links(session, property_category_id, property_type_id):
     }
 
     try:
-        response = session.get(url, params=params)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
+        response = await crawler.get(url, params=params)
+    except httpx.HTTPError as e:
         print(f"HTTP error occurred: {e}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Requests Error occurred: {e}")
-        return None
+        return []
 
     soup = BeautifulSoup(response.text, "html.parser")
     pagination_selector = "nav > ul.pagination > li.page-item > a.page-link:not([rel='next']):not([rel='prev'])[href]"
@@ -52,45 +53,27 @@ def get_property_page_links(session, property_category_id, property_type_id):
 
     if pages:
         last_page_num = int(pages[-1].text.strip())
-        base_page_url = response.url
+        base_page_url = str(response.url)
         page_urls = [f"{base_page_url}&page={i}" for i in range(1, last_page_num + 1)]
     else:
-        page_urls = [response.url]
-
-    # find product URLs on each page
-    property_urls = []
-    # make the english page load with localization
-    with session as s:
-        s.get("https://betenethiopia.com/localization/en")
-        print(
-            f"Getting property urls from {property_category_id=} and {property_type_id=}, across {len(page_urls)} pages ..."
-        )
-        for page_url in page_urls:
-            response = s.get(page_url)
-            soup = BeautifulSoup(response.text, "html.parser")
-            property_selector = "div.row.justify-content-center div.property-listing.list_view > a[href]"
-            products = soup.select(property_selector)
-            for product in products:
-                property_url = product["href"]
-                property_urls.append(property_url)
-        print(
-            f"Extracted {len(property_urls)} property urls for {property_category_id=}, {property_type_id=}."
-        )
-
-    return property_urls
-
-
-def get_property_details(session, property_url):
-    try:
-        response = session.get(property_url, timeout=15)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-    except requests.exceptions.HTTPError as e:
-        print(f"HTTP error occurred: {e} for {property_url}.")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"Requests Error occurred: {e} for {property_url}.")
-        return None
+        page_urls = [str(response.url)]
+    print(
+        f"Getting property urls from {property_category_id=} and {property_type_id=}, across {len(page_urls)} pages ..."
+    )
+    return page_urls
+
+
+# find product URLs on each page
+def parse_property_links(html, page_url):
+    soup = BeautifulSoup(html, "html.parser")
+    property_selector = (
+        "div.row.justify-content-center div.property-listing.list_view > a[href]"
+    )
+    return [product["href"] for product in soup.select(property_selector)]
+
+
+def parse_property_details(html, property_url):
+    soup = BeautifulSoup(html, "html.parser")
 
     # extract property details
     property_details = {}
@@ -159,42 +142,52 @@ def get_property_details(session, property_url):
     return property_details
 
 
-def get_data_category_type(session, category_id, type_id):
-    product_urls = get_property_page_links(
-        session, property_category_id=category_id, property_type_id=type_id
-    )
-    print(
-        f"Getting details of {len(product_urls)} properties: {category_id=}, {type_id=}"
+def beten_site(category_id, type_id):
+    return Site(
+        f"beten/{category_id}/{type_id}",
+        partial(
+            get_page_links, property_category_id=category_id, property_type_id=type_id
+        ),
+        parse_property_links,
+        parse_property_details,
+        concurrency=4,
+        rate=4.0,
     )
-    property_details = []
-    counter = 1
-    for url in product_urls:
-        details = get_property_details(session, url)
-        if details is not None:
-            property_details.append(details)
-        if counter % 10 == 0:
-            print(f"Retrieved {counter}/{len(product_urls)} of properties.")
-        counter += 1
-        time.sleep(0.01)
-    return property_details
-
 
-def main():
-    session = requests.Session()
-    property_cats = get_property_categories()
-    property_types = get_property_types()
-    timestamp = time.strftime("%Y-%m-%d")
 
-    for cat_name, cat_id in property_cats.items():
-        for type_name, type_id in property_types.items():
-            property_details = get_data_category_type(session, cat_id, type_id)
-            file_path = f'./data/housing/raw/beten/{cat_name.lower().replace(" ", "-")}_{type_name.lower()}_{timestamp}.json'
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, "w") as f:
-                json.dump(property_details, f, indent=2, ensure_ascii=False)
-            print(f"Saved {file_path}.")
-            time.sleep(0.1)
+async def get_data_category_type(crawler, category_id, type_id, early_stop=None):
+    """
+    The details of the properties of a category and type. With an `early_stop`
+    (helpers_seen.EarlyStop), only the new ones, stopping at the known ones.
+    """
+    print(f"Getting details of the properties: {category_id=}, {type_id=}")
+    return await crawl(beten_site(category_id, type_id), crawler, early_stop=early_stop)
+
+
+async def main():
+    async with Crawler() as crawler:
+        # make the english page load with localization (a session cookie)
+        await crawler.get("https://betenethiopia.com/localization/en")
+        property_cats = await get_property_categories(crawler)
+        property_types = await get_property_types(crawler)
+        timestamp = time.strftime("%Y-%m-%d")
+        # Only the new properties, but every page of every category once in a while
+        seen = SeenIndex()
+        full_sweep = seen.sweep_due("beten")
+
+        for cat_name, cat_id in property_cats.items():
+            for type_name, type_id in property_types.items():
+                early_stop = EarlyStop(seen, "beten", full_sweep=full_sweep)
+                property_details = await get_data_category_type(
+                    crawler, cat_id, type_id, early_stop
+                )
+                file_path = f'./data/housing/raw/beten/{cat_name.lower().replace(" ", "-")}_{type_name.lower()}_{timestamp}.json'
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, "w") as f:
+                    json.dump(property_details, f, indent=2, ensure_ascii=False)
+                print(f"Saved {file_path} ({len(property_details)} properties).")
+        seen.close()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,22 +1,32 @@
+import asyncio
 import json
 import os
 import time
-import re
-import requests
+import httpx
 from bs4 import BeautifulSoup
+from ..helpers.helpers_crawl import Crawler
+from ..helpers.helpers_frontier import Frontier
+from ..helpers.helpers_parse import find_js_object, find_json_ld
+from ..helpers.helpers_seen import EarlyStop, SeenIndex
+from ..helpers.helpers_sitespec import load_spec, post_processor
 
 
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36"
 }
 
+HOST = "ethiopianproperties.com"
+# Politeness, the list and the property pages together: in flight, and started per second
+CONCURRENCY = 4
+RATE = 4.0
+
 
 # for-rent, for-sale, etc
-def get_property_status(session):
+async def get_property_status(crawler):
     url = "https://www.ethiopianproperties.com/property-search/"
     payload = {"location": "addis-ababa"}
     try:
-        r = session.get(url, params=payload, headers=headers)
+        r = await crawler.get(url, params=payload)
         soup = BeautifulSoup(r.content, "html.parser")
         status = soup.select('#select-status > option[value!=""]')
         status = [t.attrs.get("value") for t in status]
@@ -27,11 +37,11 @@ def get_property_status(session):
 
 
 # residential, commercial, land, hotel, ...
-def get_property_types(session):
+async def get_property_types(crawler):
     url = "https://www.ethiopianproperties.com/property-search/"
     payload = {"location": "addis-ababa"}
     try:
-        r = session.get(url, params=payload, headers=headers)
+        r = await crawler.get(url, params=payload)
         soup = BeautifulSoup(r.content, "html.parser")
         types = soup.select('#select-property-type > option[value!=""]')
         types = [t.attrs["value"] for t in types]
@@ -41,190 +51,208 @@ def get_property_types(session):
     return types
 
 
-def get_property_links(session, property_type, property_status):
+async def get_property_links(crawler, property_type, property_status, early_stop=None):
     url = "https://ethiopianproperties.com/property-search/"
     payload = {
         "location": "addis-ababa",
         "type": property_type,
         "status": property_status,
     }
-    r = session.get(url, params=payload, headers=headers)
+    r = await crawler.get(url, params=payload)
     soup = BeautifulSoup(r.text, "html.parser")
 
     selector = "#search-results section > div.list-container.clearfix article.property-item.clearfix > h4 > a[href]"
     print(f"Getting links for {property_type=}, and {property_status=} properties ...")
     # first page
     property_links = [link.attrs.get("href") for link in soup.select(selector)]
+    if early_stop is not None:
+        early_stop.reset()
+        property_links = early_stop.filter(property_links)
     # the rest of pages, if any
     page_num = 2
     while True:
-        r = session.get(f"{url}/page/{page_num}/", params=payload, headers=headers)
+        if early_stop is not None and early_stop.stop:
+            print(f"Stopped at known properties, on page {page_num - 1}.")
+            break
+        try:
+            r = await crawler.get(f"{url}/page/{page_num}/", params=payload)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+            print(f"Reached the last page: {page_num}.")
+            break
         soup = BeautifulSoup(r.text, "html.parser")
         links = [link.attrs.get("href") for link in soup.select(selector)]
         if not links:
             print(f"Reached the last page: {page_num}.")
             break
+        if early_stop is not None:
+            links = early_stop.filter(links)
         property_links.extend(links)
         if page_num % 10 == 0:
             print(f"Gathered property links on {page_num} pages.")
         page_num += 1
-        time.sleep(0.1)
     return property_links
 
 
-def extract_property_details(session, property_link):
-    response = session.get(property_link, headers=headers)
-    soup = BeautifulSoup(response.content, "html.parser")
+async def extract_property_details(crawler, property_link):
+    response = await crawler.get(property_link)
+    return parse_property_details(response.content.decode("utf-8", "replace"), property_link)
 
-    def _get_text(element, strip=True):
-        try:
-            return element.get_text(strip=strip)
-        except AttributeError:
-            return None
-
-    # CSS Selectors
-    TITLE = "body > div.page-head > div > div > h1 > span"
-    ID = "#overview > article > div.wrap.clearfix > h4"
-    STATUS = "#overview > article > div.wrap.clearfix > h5 > span.status-label"
-    PRICE_AND_TYPE = "#overview > article > div.wrap.clearfix > h5 > span:nth-child(2)"
-    CHARACTERISTICS = "#overview > article > div.property-meta.clearfix > span:has(svg)"
-    DESCRIPTION = "#overview > article > div.content.clearfix > p"
-    ADDITIONAL_DETAILS = "#overview > article > div.content.clearfix > ul > li"
-    FEATURES = "#overview > article > div.features > ul > li > a[href]"
-    IMAGES = "#property-carousel-two > ul.slides > li > img[src]"
-    AGENT_NAME = "#overview > div.agent-detail.clearfix > div.left-box > h3"
-    AGENT_ADDRESS = "#overview > div.agent-detail.clearfix > div.left-box > ul > li"
-    # No pure selector for address, sometimes found in the title, url, or description
-    # constructing from region and neighborhood/town
-    ADDRESS = "body > div.page-head > div > div > div > nav > ul > li:not(:first-child) > a[href]"
-    MAP_DATA = "#overview > div.map-wrap.clearfix > script"
-    JSON_LD = "script[type='application/ld+json'].yoast-schema-graph"
-
-    property_title = _get_text(soup.select_one(TITLE))
-    property_id = _get_text(soup.select_one(ID)).split(": ")[-1]
-    property_status = _get_text(soup.select_one(STATUS))
 
+# "5\xa0Bedrooms" as (Bedrooms, 5), the area has no label
+@post_processor
+def characteristic(text):
     try:
-        price, property_type = _get_text(soup.select_one(PRICE_AND_TYPE)).split("- ")
+        value, key = text.replace("\xa0", ";").split(";")
     except ValueError:
-        price, property_type = _get_text(soup.select_one(PRICE_AND_TYPE)), None
-
-    characteristics = {}
-    for res in soup.select(CHARACTERISTICS):
-        try:
-            value, key = _get_text(res).replace("\xa0", ";").split(";")
-        except ValueError:
-            value = _get_text(res).strip()
-            key = "unknown or sqm"
-        characteristics.update({key: value})
-
-    description = "\n".join([_get_text(p) for p in soup.select(DESCRIPTION)])
-
-    additional_details = [_get_text(p) for p in soup.select(ADDITIONAL_DETAILS)]
-    additional_details = "; ".join(additional_details) if additional_details else None
+        value = text.strip()
+        key = "unknown or sqm"
+    return key, value
 
-    features = "; ".join([_get_text(f) for f in soup.select(FEATURES)])
-    images = [img.attrs.get("src") for img in soup.select(IMAGES)]
 
-    agent_details = {
-        "agent-name": _get_text(soup.select_one(AGENT_NAME)),
-        "agent-address": _get_text(soup.select_one(AGENT_ADDRESS)),
-    }
+# The selectors and cleaning of the fields are in `specs/ethiopianproperties.json`
+def parse_property_details(html, property_link, backend=None, targeted=True):
+    record = load_spec("ethiopianproperties").extract(html, backend, targeted)
 
+    # No pure selector for address, sometimes found in the title, url, or description;
+    # the spec's `address` is constructed from region and neighborhood/town
     # parse property_map_data mainly for property address ----
-    property_address_text = ", ".join([_get_text(a) for a in soup.select(ADDRESS)])
-    property_map_data = _get_text(soup.select_one(MAP_DATA))
-
-    try:
-        json_data = re.search(
-            r"var propertyMarkerInfo = (\{.*?\})", property_map_data
-        ).group(1)
-        data = json.loads(json_data)
+    # straight from the page's text, the script of #overview > div.map-wrap.clearfix
+    data = find_js_object(html, "propertyMarkerInfo")
+    if data is not None:
         latitude, longitude = data.get("lat"), data.get("lang")
-    except (TypeError, AttributeError):
+    else:
         # print("No valid `property_map_data` found or JSON data not found in `property_map_data`.")
         latitude, longitude = None, None
 
     # parse JSON_LD_DATA for date_info ----
-    json_ld_data = _get_text(soup.select_one(JSON_LD))
-    json_ld_data = json.loads(json_ld_data)["@graph"][0]
+    json_ld_data = find_json_ld(html, "yoast-schema-graph")[0]["@graph"][0]
     date_info = {
         "date_published": json_ld_data.get("datePublished"),
         "date_modified": json_ld_data.get("dateModified"),
     }
 
     details = {
-        "property_id": property_id,
+        "property_id": record["property_id"],
         "property_url": property_link,
-        "property_type": property_type,
-        "property_status": property_status,
-        "title": property_title,
-        "price": price,
+        "property_type": record["property_type"],
+        "property_status": record["property_status"],
+        "title": record["title"],
+        "price": record["price"],
         **date_info,
-        "address": property_address_text,
+        "address": record["address"],
         "latitude": latitude,
         "longitude": longitude,
-        **characteristics,
-        "description": description,
-        "additional_details": additional_details,
-        "features": features,
-        "images": images,
-        **agent_details,
+        **record["characteristics"],
+        "description": record["description"],
+        "additional_details": record["additional_details"],
+        "features": record["features"],
+        "images": record["images"],
+        "agent-name": record["agent-name"],
+        "agent-address": record["agent-address"],
     }
 
     return details
 
 
-def get_category_data(session, property_type, property_status):
-    property_links = get_property_links(
-        session, property_type=property_type, property_status=property_status
-    )
-    category_data = []
-    print(f"Getting data for {len(property_links)} properties.")
-    counter = 1
-    for property_link in property_links:
-        try:
-            category_data.append(extract_property_details(session, property_link))
-        except Exception as e:
-            print(f"{property_link}: {e}")
-        if counter % 25 == 0 or counter == len(property_links):
-            print(f"Extracted data for {counter}/{len(property_links)} properties.")
-        counter += 1
-        time.sleep(0.1)
-    return category_data
-
-
-def main():
-    session = requests.Session()
-    property_types = ["any"] #get_property_types(session)
-    property_statuses = ["any"] #get_property_status(session)
+async def get_category_data(
+    crawler,
+    property_type,
+    property_status,
+    frontier,
+    early_stop=None,
+    workers=CONCURRENCY,
+):
+    """
+    The data of the properties of a category, fetched by `workers` tasks. The links and the
+    extracted details are kept in `frontier`, so a restart after a crash resumes where it
+    stopped. With an `early_stop`, only the new properties are scraped.
+    """
+    group = f"{property_status}_{property_type}"
+    if not frontier.is_listed(group):
+        property_links = await get_property_links(
+            crawler,
+            property_type=property_type,
+            property_status=property_status,
+            early_stop=early_stop,
+        )
+        frontier.add(property_links, group=group)
+        frontier.mark_listed(group)
+    counts = frontier.counts(group)
+    total = sum(counts.values())
+    print(f"Getting data for {total} properties, {counts['done']} already done.")
+    counter = counts["done"]
+
+    async def extract():
+        nonlocal counter
+        while tasks := frontier.lease(1, group):
+            task = tasks[0]
+            try:
+                details = await extract_property_details(crawler, task.url)
+                frontier.done(task.url, details)
+                if early_stop is not None:
+                    early_stop.seen(task.url)
+            except Exception as e:
+                print(f"{task.url}: {e!r}")
+                frontier.fail(task.url, e)
+            counter += 1
+            if counter % 25 == 0 or counter == total:
+                print(f"Extracted data for {counter}/{total} properties.")
+
+    async with asyncio.TaskGroup() as task_group:
+        for _ in range(workers):
+            task_group.create_task(extract())
+    return frontier.results(group)
+
+
+async def main():
+    property_types = ["any"]  # await get_property_types(crawler)
+    property_statuses = ["any"]  # await get_property_status(crawler)
     timestamp = time.strftime("%Y_%m_%d")
     with open("./data/housing/raw/ethiopianproperties/any_any_2024_02_04.json", "r") as f:
         data = json.load(f)
-    for status in property_statuses:
-        for type in property_types:
-            # category_data = get_category_data(
-            #     session, property_type=type, property_status=status
-            # )
-            category_data = []
-            urls = [d['property_url'] for d in data]
-            for url in urls:
-                try:
-                    category_data.append(extract_property_details(session, url))
-                except:
-                    print(url)
-                    continue
-                time.sleep(1)
-            file_path = f"data/housing/raw/ethiopianproperties/{status}_{type}_{timestamp}.json"
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, "w") as f:
-                json.dump(category_data, f, indent=2, ensure_ascii=False)
-            print(f"Saved data for [{status}, {type}] to {file_path}")
-            print("-" * 25)
+    # Resumes the last run, if it crashed
+    frontier = Frontier(
+        "./data/housing/raw/ethiopianproperties/frontier.db",
+        worker="ethiopianproperties",
+    )
+    # Leases held when the last run crashed
+    frontier.release()
+    # Only the new properties, but every page of every category once in a while
+    seen = SeenIndex()
+    full_sweep = seen.sweep_due("ethiopianproperties")
+    # Re-scrape the properties of an earlier crawl, instead of listing them anew. They are added
+    # once, to the category of that crawl: a url is in a single group of the frontier
+    if not frontier.is_listed("any_any"):
+        frontier.add([d["property_url"] for d in data], group="any_any")
+        frontier.mark_listed("any_any")
+    async with Crawler(headers=headers) as crawler:
+        for host in (HOST, f"www.{HOST}"):
+            crawler.set_limits(host, CONCURRENCY, RATE)
+        for status in property_statuses:
+            for type in property_types:
+                early_stop = EarlyStop(seen, "ethiopianproperties", full_sweep=full_sweep)
+                category_data = await get_category_data(
+                    crawler,
+                    property_type=type,
+                    property_status=status,
+                    frontier=frontier,
+                    early_stop=early_stop,
+                )
+                early_stop.finish()
+                file_path = f"data/housing/raw/ethiopianproperties/{status}_{type}_{timestamp}.json"
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, "w") as f:
+                    json.dump(category_data, f, indent=2, ensure_ascii=False)
+                print(f"Saved data for [{status}, {type}] to {file_path}")
+                print("-" * 25)
+    seen.close()
+    frontier.delete()
 
 
 if __name__ == "__main__":
     st = time.time()
-    main()
+    asyncio.run(main())
     et = time.time()
     print(f"Total time: {et - st}")
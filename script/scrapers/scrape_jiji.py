@@ -1,45 +1,96 @@
+import asyncio
 import time
-import requests
+import httpx
 import sys
 
 sys.path.append("script")
-from helpers.helpers_io import list_files, write_json, read_json
+from helpers.helpers_crawl import Crawler
+from helpers.helpers_frontier import Frontier
+from helpers.helpers_io import write_json, read_json
+from helpers.helpers_seen import EarlyStop, SeenIndex
+from helpers.helpers_retry import (
+    CircuitOpenError,
+    RetryableError,
+    RetryPolicy,
+    get_breaker,
+)
 
 
 headers = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.2 Safari/605.1.15",
 }
 
+HOST = "jiji.com.et"
+# Politeness, the listing and the ad requests together: in flight, and started per second
+CONCURRENCY = 8
+RATE = 8.0
+
 
 def get_advert_info(advert):
     """Helper function to get relevant advert info"""
     return {key: advert[key] for key in ["guid", "url", "user_phone"] if key in advert}
 
 
-def request_with_backoff(session, url, max_retries=5, **kwargs):
-    """Make an HTTP request with exponential backoff."""
-    for attempt in range(max_retries):
+# Retries on 429/5xx and connection errors with full-jitter exponential backoff
+RETRY_POLICY = RetryPolicy(max_retries=5, base_delay=1.0, max_delay=30.0)
+
+
+async def request_with_backoff(crawler, url, max_retries=5, **kwargs):
+    """
+    Make an HTTP request with exponential backoff, guarded by the jiji circuit breaker, within
+    jiji's limits (see `helpers_crawl.HostLimiter`).
+
+    Raises:
+    httpx.HTTPError: If the request failed, after the retries for the transient errors.
+    """
+
+    async def _get():
+        async with crawler.limiter(HOST):
+            response = await crawler.client.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    policy = RETRY_POLICY
+    if max_retries != policy.max_retries:
+        policy = RetryPolicy(max_retries, policy.base_delay, policy.max_delay)
+    try:
+        return await policy.acall(_get, breakers=[get_breaker(HOST)])
+    except (RetryableError, CircuitOpenError) as e:
+        raise httpx.HTTPError(f"Failed after {max_retries} retries: {e}") from e
+
+
+async def request_page(crawler, url, **kwargs):
+    """
+    `request_with_backoff`, waiting for jiji's circuit to let a request through again instead
+    of failing while it is open.
+
+    Raises:
+    httpx.HTTPError: If the request failed for another reason, after the retries.
+    """
+    while True:
         try:
-            response = session.get(url, **kwargs)
-            response.raise_for_status()
-            return response
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code in [429, 500, 502, 503, 504]:
-                sleep_time = 2 ** attempt
-                time.sleep(sleep_time)
-            else:
+            return await request_with_backoff(crawler, url, **kwargs)
+        except httpx.HTTPError as e:
+            if not isinstance(e.__cause__, CircuitOpenError):
                 raise
-        except requests.exceptions.RequestException:
-            time.sleep(1)
-    raise requests.exceptions.RequestException(f"Failed after {max_retries} retries.")
+            delay = max(get_breaker(HOST).retry_in(), 1.0)
+            print(f"Circuit open, retrying {url} in {delay:.0f}s.")
+            await asyncio.sleep(delay)
 
-def get_listings(session, category_slug):
+
+async def get_listings(crawler, category_slug, on_adverts=None, early_stop=None):
     """
     Get a list of ads of a category scattered across pages.
-    session: requests.Session object for making HTTP requests.
+    crawler: helpers_crawl.Crawler for making HTTP requests.
     category_slug: String representing category slug to be scraped.
+    on_adverts: Called with the ads of each page as soon as it arrives, e.g. to start scraping
+        them while the next pages are listed.
+    early_stop: helpers_seen.EarlyStop, to get only the new ads (newest first) and stop at the
+        known ones.
     Returns the guid, url, and user's phone number.
     The last one is hidden in advert's main page.
+    Returns None if a page failed: the next pages are only known from it, so the listing
+    stops there (the ads of the earlier pages were passed to `on_adverts`).
     """
     endpoint = "https://jiji.com.et/api_web/v1/listing"
     params = {
@@ -49,7 +100,7 @@ def get_listings(session, category_slug):
         "lsmid": "1685041575972",
     }
 
-    response = request_with_backoff(session, endpoint, params=params, headers=headers)
+    response = await request_with_backoff(crawler, endpoint, params=params)
 
     data = response.json()
     if "adverts_list" not in data:
@@ -62,24 +113,36 @@ def get_listings(session, category_slug):
     adverts = adverts_list.get("adverts")
     adverts_info = [get_advert_info(advert) for advert in adverts]
     next_page = data.get("next_url")
+    if early_stop is not None:
+        early_stop.reset()
+        adverts_info = new_adverts(adverts_info, early_stop)
+    if on_adverts is not None:
+        on_adverts(adverts_info)
 
     print(f"In {category_slug}, Num ads={count}, Num pages={total_pages}.")
     current_page = 1
     while next_page and current_page <= total_pages:
+        if early_stop is not None and early_stop.stop:
+            print(f"Stopped at known ads, on page {current_page} of {total_pages}.")
+            break
         try:
-            response = request_with_backoff(session, next_page, headers=headers)
-        except requests.RequestException as e:
-            print(f"Failed to get page {current_page} of {total_pages}: {e}")
-            continue
+            response = await request_page(crawler, next_page)
+        except httpx.HTTPError as e:
+            print(f"Failed to get page {current_page} of {total_pages}, stopped: {e}")
+            return None
         else:
             data = response.json()
             adverts = data.get("adverts_list").get("adverts")
-            adverts_info.extend([get_advert_info(advert) for advert in adverts])
+            adverts = [get_advert_info(advert) for advert in adverts]
+            if early_stop is not None:
+                adverts = new_adverts(adverts, early_stop)
+            if on_adverts is not None:
+                on_adverts(adverts)
+            adverts_info.extend(adverts)
             next_page = data.get("next_url")
             current_page += 1
             if current_page % 50 == 0:
                 print(f"Page {current_page} of {total_pages} scraped.")
-            time.sleep(0.1)
     print(f"Got {len(adverts_info)} ads from {category_slug}.")
     timestamp = time.strftime("%Y-%m-%d")
     write_json(
@@ -89,12 +152,18 @@ def get_listings(session, category_slug):
     return adverts_info
 
 
-def get_advert_details(session, advert_guid):
+# The ads of a list page to scrape, see `helpers_seen.EarlyStop`
+def new_adverts(adverts, early_stop):
+    urls = set(early_stop.filter([advert.get("url") for advert in adverts]))
+    return [advert for advert in adverts if advert.get("url") in urls]
+
+
+async def get_advert_details(crawler, advert_guid):
     """Get details of an advert"""
     if advert_guid is None:
         return dict(advert=None, seller=None)
     endpoint_advert = f"https://jiji.com.et/api_web/v1/item/{advert_guid}"
-    response = request_with_backoff(session, endpoint_advert, headers=headers)
+    response = await request_with_backoff(crawler, endpoint_advert)
     if response.status_code == 200:
         response_data = response.json()
         advert_details = {
@@ -112,54 +181,105 @@ def get_scraped_urls(file_path):
     return guids
 
 
-def scrape_data(session, category_slug):
-    """Scrape ads from a given category."""
-    adverts = get_listings(session, category_slug)
-    # adverts = read_json(f"./data/housing/raw/jiji/intermittents/pages/{category_slug}_adverts_2024-03-08.json")
-    if not adverts:
-        print(f"No ads scraped from {category_slug}")
-        return
-    adverts = [advert for advert in adverts if advert]
-    # iterate over urls of ads in category
-    advert_details = []
+def advert_endpoint(guid):
+    return f"https://jiji.com.et/api_web/v1/item/{guid}"
+
+
+async def scrape_data(
+    crawler, category_slug, frontier, early_stop=None, workers=CONCURRENCY
+):
+    """
+    Scrape ads from a given category: `workers` tasks fetch the ads as soon as their listing
+    page arrives, while the next pages are listed. The ads and their details are kept in
+    `frontier`, so a restart after a crash resumes where it stopped, without listing the pages
+    again. With an `early_stop`, only the new ads are scraped.
+    """
+    listed = asyncio.Event()
+    new_ads = asyncio.Event()
     advert_counter = 0
-    for i, advert in enumerate(adverts, 1):
-        guid = advert.get("guid")
-        user_phone = advert.get("user_phone")
-        if guid:
-            details = get_advert_details(session, guid)
-            if details:
-                details.get("seller")["phone"] = user_phone
-                advert_details.append(details)
-            time.sleep(0.1)
+
+    def add_adverts(adverts):
+        adverts = [advert for advert in adverts if advert]
+        if not all(advert.get("guid") for advert in adverts):
+            print("No guid found for some adverts, scraping them skipped.")
+        frontier.add(
+            (
+                (advert_endpoint(advert["guid"]), advert)
+                for advert in adverts
+                if advert.get("guid")
+            ),
+            group=category_slug,
+        )
+        new_ads.set()
+
+    async def list_adverts():
+        try:
+            adverts = await get_listings(
+                crawler, category_slug, add_adverts, early_stop
+            )
+            # adverts = read_json(f"./data/housing/raw/jiji/intermittents/pages/{category_slug}_adverts_2024-03-08.json")
+            if not adverts:
+                # Listed again on the next run
+                print(f"No complete listing of {category_slug}")
+                return
+            frontier.mark_listed(category_slug)
+        finally:
+            listed.set()
+            new_ads.set()
+
+    async def scrape_adverts():
+        nonlocal advert_counter
+        while True:
+            tasks = frontier.lease(1, category_slug)
+            if not tasks:
+                if listed.is_set():
+                    return
+                # Wait for the next listing page
+                new_ads.clear()
+                await new_ads.wait()
+                continue
+            task = tasks[0]
+            try:
+                details = await get_advert_details(crawler, task.data["guid"])
+                if details:
+                    details["seller"]["phone"] = task.data.get("user_phone")
+            except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+                # A failed request or an unexpected response, e.g. an ad without a seller
+                print(f"Failed to get {task.url}: {e!r}")
+                frontier.fail(task.url, e)
+                continue
+            if details is None:
+                print(f"No details for {task.url}")
+                frontier.fail(task.url, "No details")
+                continue
+            frontier.done(task.url, details)
+            if early_stop is not None:
+                early_stop.seen(task.data.get("url"))
             advert_counter += 1
-            if advert_counter % 100 == 0 or i == len(adverts):
-                write_json(
-                    advert_details,
-                    f"./data/housing/raw/jiji/intermittents/data/{category_slug}_details_{advert_counter:0>2}.json",
+            if advert_counter % 100 == 0:
+                print(
+                    f"Scraped {advert_counter} ads, {frontier.counts(category_slug)}."
                 )
-                advert_details = []
+
+    async with asyncio.TaskGroup() as group:
+        if frontier.is_listed(category_slug):
+            listed.set()
         else:
-            print("No guid found for an advert, scraping so skipped.")
+            group.create_task(list_adverts())
+        for _ in range(workers):
+            group.create_task(scrape_adverts())
     print(f"Scraped {advert_counter} ads from {category_slug}.")
-    return advert_details
+    return frontier.results(category_slug)
 
 
-# Recombine the intermittents and save it
-def save_data(category_slug, timestamp):
-    file_paths = list_files(
-        "./data/housing/raw/jiji/intermittents/data/", 
-        f"{category_slug}_*.json"
-    )
-    adverts = []
-    for file_path in file_paths:
-        chunk = read_json(file_path)
-        adverts.extend(chunk)
+# Save the scraped ads of a category
+def save_data(category_slug, timestamp, frontier):
+    adverts = frontier.results(category_slug)
     write_json(
         adverts,
         f"./data/housing/raw/jiji/{category_slug}_{timestamp}.json",
     )
-    print(f"Recombined {len(adverts)} ads from {category_slug}.")
+    print(f"Saved {len(adverts)} ads from {category_slug}.")
 
 
 def get_category_slugs():
@@ -194,7 +314,7 @@ def get_category_slugs():
     return slugs
 
 
-def main():
+async def main():
     # category_slugs = get_category_slugs()
     category_slugs = [
         # "new-builds",
@@ -208,12 +328,26 @@ def main():
         # "temporary-and-vacation-rentals",
     ]
     timestamp = time.strftime("%Y-%m-%d")
-    session = requests.Session()
+    # Resumes the last run, if it crashed
+    frontier = Frontier(
+        "./data/housing/raw/jiji/intermittents/frontier.db", worker="jiji"
+    )
+    # Leases held when the last run crashed
+    frontier.release()
+    # Only the new ads, but every page of every category once in a while
+    seen = SeenIndex()
+    full_sweep = seen.sweep_due("jiji")
 
-    for category_slug in category_slugs:
-        scrape_data(session, category_slug)
-        save_data(category_slug, timestamp)
+    async with Crawler(headers=headers) as crawler:
+        crawler.set_limits(HOST, CONCURRENCY, RATE)
+        for category_slug in category_slugs:
+            early_stop = EarlyStop(seen, "jiji", full_sweep=full_sweep)
+            await scrape_data(crawler, category_slug, frontier, early_stop)
+            save_data(category_slug, timestamp, frontier)
+            early_stop.finish()
+    seen.close()
+    frontier.delete()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,20 +1,13 @@
 import asyncio
 import os
+from concurrent.futures import ProcessPoolExecutor
 import time
-import requests
 import logging
-from bs4 import BeautifulSoup
-from ..helpers.helpers_scrape import my_get_text
-from ..helpers.helpers_io import read_json, write_json
-
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(message)s",
-    filename="./logs/scrapers/loozap.log",
-    filemode="a",
-)
-
+from ..helpers.helpers_crawl import Crawler, Site, pipeline
+from ..helpers.helpers_httpcache import HTTPCache
+from ..helpers.helpers_io import JSONLWriter, iter_jsonl, read_json
+from ..helpers.helpers_parse import parse_html
+from ..helpers.helpers_sitespec import load_spec
 
 # Constants
 BASE_URL = "https://et.loozap.com/category/real-estate-house-apartment-and-land"
@@ -25,226 +18,132 @@ LAST_PAGE_SELECTOR = (
 TIMEOUT = 15  # Loozap's server is quite slow, a longer timeout is needed
 
 
-# Fetch all links from a single page
-async def fetch_page_links(page_url, selector=LINK_SELECTOR):
-    try:
-        response = await asyncio.to_thread(requests.get, page_url, timeout=TIMEOUT)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error: {e}")
-        raise e
-    soup = BeautifulSoup(response.content, "html.parser")
-    links = soup.select(selector)
-    links = [link.get("href") for link in links]
+# All links to the ads on a list page
+def parse_page_links(html, page_url, selector=LINK_SELECTOR):
+    soup = parse_html(html)
+    links = [link.get("href") for link in soup.select(selector)]
     if not links:
         logging.info(f"No links found on page: {page_url}")
-        return []
     return links
 
 
-# Fetch all links across all pages
-async def get_links(
-    base_url=BASE_URL,
-    last_page_selector=LAST_PAGE_SELECTOR,
-    link_selector=LINK_SELECTOR,
+# The urls of all list pages, from the number of pages on the first one
+async def get_list_pages(
+    crawler, base_url=BASE_URL, last_page_selector=LAST_PAGE_SELECTOR
 ):
-    try:
-        resp = requests.get(base_url, timeout=TIMEOUT)
-        resp.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP Error: {e}")
-        raise e
-    soup = BeautifulSoup(resp.content, "html.parser")
+    resp = await crawler.get(base_url)
+    soup = parse_html(resp.text)
     # get total pages
     last_page = soup.select_one(last_page_selector).get_text()
     last_page = int(last_page)
 
     print(f"Total pages: {last_page}")
-    tasks = []
-    for page in range(1, last_page + 1):
-        page_url = f"{base_url}?{page=}"
-        task = asyncio.create_task(fetch_page_links(page_url, link_selector))
-        tasks.append(task)
-    links_list = await asyncio.gather(*tasks)
-    return [link for links in links_list for link in links]
+    return [f"{base_url}?{page=}" for page in range(1, last_page + 1)]
 
 
-# Asynchronously fetch property details using requests in a separate thread
-async def get_details(url):
+# Fetch all links across all pages
+async def get_links(crawler, base_url=BASE_URL, link_selector=LINK_SELECTOR):
+    pages = await get_list_pages(crawler, base_url)
+    responses = await asyncio.gather(*(crawler.get(page) for page in pages))
+    return [
+        link
+        for page, response in zip(pages, responses)
+        for link in parse_page_links(response.text, page, link_selector)
+    ]
+
+
+# Save the content of an ad page to a file for debugging (and reparsing)
+def save_html(html, url):
+    basename = os.path.basename(url)
+    basename = basename + ".html" if not basename.endswith(".html") else basename
+    filename = f"./data/housing/raw/loozap/html/{basename}"
+    if not os.path.exists(filename):
+        with open(filename, "w") as f:
+            f.write(html)
+
+
+# Parse the property details of an ad page, only its main container unless not `targeted`;
+# the selectors and cleaning of the fields are in `specs/loozap.json`
+def parse_details(html, url, backend=None, targeted=True):
     details = {"url": url}
-    try:
-        # Using asyncio.to_thread to run the blocking operation in a separate thread
-        response = await asyncio.to_thread(requests.get, url, timeout=TIMEOUT)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        logging.error(f"Request Exception for {url} - {e}")
-        return details
-    else:
-        # Save the content to a file for debugging
-        basename = os.path.basename(url)
-        basename = basename + ".html" if not basename.endswith(".html") else basename
-        filename = f"./data/housing/raw/loozap/html/{basename}"
-        if not os.path.exists(filename):
-            with open(filename, "w") as f:
-                f.write(response.text)
-
-    soup = BeautifulSoup(response.text, "html.parser")
+    record = load_spec("loozap").extract(html, backend, targeted)
     # Most details are within the main content container
-    content_selector = (
-        "#wrapper > div.main-container div > div.page-content.col-thin-right > div"
-    )
-    content = soup.select_one(content_selector)
-    if not content:
+    if record is None:
         logging.error("Content container not found.")
         return details
+    return {**details, **record}
 
-    # Define selectors scoped within the base content
-    breadcrumb_selector = "nav > ol.breadcrumb > li.breadcrumb-item:nth-child(4) > a" # contains listing type
-    title_selector = "h1 > strong"
-    date_selector = "span.info-row > span.date > span[data-bs-content]"
-    reference_number_selector = "span.info-row > span.category.float-md-end"
-    image_urls_selector = "div.gallery-container div.bxslider-pager a > img"
-    description_selector = ".col-12.detail-line-content"
-    additional_details_selector = ".row.bg-light.rounded"
-    tags_selector = ".row .col-12 > span.d-inline-block.border > a"
-    loc_price_selector = (
-        "#item-details div.items-details-info div.row .col-md-6.col-sm-6.col-6"
-    )
-    # Seller info selectors
-    seller_info_base = (
-        "div.page-sidebar-right > aside > div.card-user-info.sidebar-card"
-    )
-    seller_info_selectors = {
-        "name": f"{seller_info_base} > div.block-cell.user > div.cell-content > span.name",
-        "phone": f"{seller_info_base} > div.card-content a.btn-success[href*='https://wa.me']",
-        "rating": f"{seller_info_base} > div.block-cell.user > div.cell-content span.rating-label",
-    }
-
-    details["listing_type"] = my_get_text(soup.select_one(breadcrumb_selector))
-    # Extracting details within the content
-    details["title"] = my_get_text(content.select_one(title_selector))
-    date_published = content.select_one(date_selector)
-    if date_published:
-        details["date_published"] = date_published.attrs.get("data-bs-content", "")
-    reference_number = content.select_one(reference_number_selector)
-    if reference_number:
-        details["reference_number"] = (
-            my_get_text(reference_number).split(":", maxsplit=1)[-1].strip()
-        )
 
-    # Image URLs
-    details["image_urls"] = [
-        img.get("src") for img in content.select(image_urls_selector) if img.get("src")
-    ]
+def save_and_parse_details(html, url):
+    save_html(html, url)
+    return parse_details(html, url)
 
-    # Price and Location
-    for row in content.select(loc_price_selector):
-        key = my_get_text(row.select_one("h4 > span:nth-of-type(1)"))
-        value = my_get_text(row.select_one("h4 > span:nth-of-type(2)"))
-        if key:
-            details[key] = value
-
-    # Description
-    description_element = content.select_one(description_selector)
-    # Extract and clean the text
-    if description_element:
-        desc_content = str(description_element)
-        # Replace <br> and <br/> with \n before processing
-        desc_content = desc_content.replace("<br/>", "\n").replace("<br>", "\n")
-        desc_soup = BeautifulSoup(desc_content, "html.parser")
-        description = my_get_text(desc_soup).replace("Description", "").strip()
-        details["description"] = description
-
-    # Additional Details
-    additional_details = {}
-    for detail in content.select(additional_details_selector):
-        key = my_get_text(detail.select_one(".col-6.fw-bolder"))
-        value = my_get_text(detail.select_one(".col-6.text-sm-end.text-start"))
-        if key:
-            additional_details[key] = value
-    details["additional_details"] = additional_details
-    # Rating, reviews
-    ratings = content.select_one("div.reviews-widget.ratings span.rating-label")
-    reviews = content.select_one("#item-reviews-tab > h4")
-    if ratings:
-        details["additional_details"]["ratings"] = my_get_text(ratings)
-    if reviews:
-        details["additional_details"]["reviews"] = my_get_text(reviews)
-
-    # Tags
-    tags = [
-        my_get_text(tag)
-        for tag in content.select(tags_selector)
-        if my_get_text(tag).lower() != "etc"
-    ]
-    details["features"] = "; ".join(tags)
-
-    # Seller Info within the sidebar (not scoped within main content selector)
-    sidebar = soup.select_one("#wrapper > div.main-container div.page-sidebar-right")
-    if sidebar:
-        seller = {}
-        for key, selector in seller_info_selectors.items():
-            element = sidebar.select_one(selector)
-            if key != "phone":
-                seller[key] = my_get_text(element)
-                continue
-            phone_href = element.get("href", "") if element else ""
-            seller[key] = (
-                phone_href.rsplit("?")[0].split("wa.me/")[-1] if phone_href else ""
-            )
-        details["seller"] = seller
-
-    return details
-
-
-# Manage fetching all details
-async def fetch_all_details(urls):
-    tasks = []
-    for url in urls:
-        # Schedule get_details to run in a separate thread for each URL
-        task = asyncio.create_task(get_details(url))
-        tasks.append(task)
-    details = await asyncio.gather(*tasks)
-    return details
-
-
-# Main async function to run the scraper in chunks
-async def main(chunk_size=2500):
+
+LOOZAP = Site(
+    "loozap",
+    get_list_pages,
+    parse_page_links,
+    save_and_parse_details,
+    concurrency=8,
+    rate=4.0,
+)
+
+
+# Main async function to run the scraper: the ads are fetched, parsed (on `parse_workers`
+# processes, in the event loop with 0) and appended to a JSON lines file as they come, in
+# constant memory; a restart skips the ads already in it
+async def main(parse_workers=0):
     data_dir = "./data/housing/raw/loozap"
     links_filepath = f"{data_dir}/loozap_links.json"
     data_filepath = f"{data_dir}/loozap_data_new.json"
-
-    # Fetch links
-    # s = time.time()
-    # print("Starting to fetch links...")
-    # urls = await get_links()
-    # write_to_json(urls, links_filepath)
-    # e = time.time()
-    # print(f"Time taken to fetch links: {e - s:.2f} seconds")
-    urls = read_json(links_filepath)
-    # Fetch details
-    # urls = read_from_json(links_filepath)
-    delay = 5  # Optional delay between chunks
-
-    data = read_json(data_filepath)
-    scraped = [item["url"] for item in data]
-    urls = list(set(urls) - set(scraped))
-    # Create chunks of URLs
-    chunks = [
-        urls[i : i + chunk_size] for i in range(0, len(urls), chunk_size)
-    ]
-    s = time.time()
-    print(f"Total links to scrape: {len(urls)}")
-    print("Starting to fetch details ...")
-    for chunk_index, chunk in enumerate(chunks, start=1):
-        tasks = [get_details(url) for url in chunk]
-        details = await asyncio.gather(*tasks)
-        write_json(details, f"{os.path.splitext(data_filepath)[0]}_{chunk_index:0>2}.json", overwrite=True)
-        print(f"Completed and saved chunk {chunk_index}.")
-        await asyncio.sleep(delay)
-    e = time.time()
-    print(f"Time taken to fetch details: {e - s:.2f} seconds")
+    records_filepath = f"{data_dir}/loozap_data_new.jsonl"
+
+    cache = HTTPCache()
+    async with Crawler(timeout=TIMEOUT, cache=cache) as crawler:
+        # Fetch links
+        # s = time.time()
+        # print("Starting to fetch links...")
+        # urls = await get_links(crawler)
+        # write_json(urls, links_filepath)
+        # e = time.time()
+        # print(f"Time taken to fetch links: {e - s:.2f} seconds")
+        urls = read_json(links_filepath)
+
+        scraped = {item["url"] for item in read_json(data_filepath)}
+        scraped.update(item["url"] for item in iter_jsonl(records_filepath))
+        urls = [url for url in dict.fromkeys(urls) if url not in scraped]
+        s = time.time()
+        print(f"Total links to scrape: {len(urls)}")
+        print("Starting to fetch details ...")
+        executor = ProcessPoolExecutor(parse_workers) if parse_workers else None
+        try:
+            with JSONLWriter(records_filepath) as writer:
+                stats = await pipeline(
+                    LOOZAP,
+                    crawler,
+                    urls,
+                    writer.write,
+                    executor=executor,
+                    parsers=parse_workers,
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        e = time.time()
+        print(
+            f"Saved {stats['records']} ads to {records_filepath} ({stats['failed']} failed)."
+        )
+        print(f"Time taken to fetch details: {e - s:.2f} seconds")
+    cache.close()
 
 
 if __name__ == "__main__":
+    # Set up when run, not on import (e.g. by the parse workers)
+    os.makedirs("./logs/scrapers", exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(message)s",
+        filename="./logs/scrapers/loozap.log",
+        filemode="a",
+    )
     asyncio.run(main())
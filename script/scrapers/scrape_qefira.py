@@ -1,16 +1,20 @@
+import asyncio
 import os
 import time
-import requests
+from functools import partial
 from bs4 import BeautifulSoup
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ..helpers.helpers_crawl import Crawler, Site, crawl
+from ..helpers.helpers_httpcache import HTTPCache
+from ..helpers.helpers_seen import EarlyStop, SeenIndex
 
 headers = {"User-Agent": "Mozilla/5.0"}
 
 
-def get_page_links(session, category_slug):
+async def get_page_links(crawler, category_slug):
     url = f"https://www.qefira.com/{category_slug}/addis-ababa"
-    response = session.get(url, headers=headers)
+    response = await crawler.get(url)
     soup = BeautifulSoup(response.content, "html.parser")
 
     # find the container of the pages
@@ -28,9 +32,8 @@ def get_page_links(session, category_slug):
 
 # scrape properties on each page
 # get the list of advertised properties on each page
-def get_product_links(session, page_link):
-    response = session.get(page_link, headers=headers)
-    soup = BeautifulSoup(response.content, "html.parser")
+def parse_product_links(html, page_link):
+    soup = BeautifulSoup(html, "html.parser")
     product_list = soup.select(
         "div.listings-cards__list-item > div.listing-card.listing-card--tab > a[href].listing-card__inner"
     )
@@ -109,9 +112,8 @@ def extract_data_from_json_link_data(soup: BeautifulSoup):
 
 
 #  get the data for each property
-def get_product_data(session, property_url):
-    response = session.get(property_url, headers=headers)
-    soup = BeautifulSoup(response.content, "html.parser")
+def parse_product_data(html, property_url):
+    soup = BeautifulSoup(html, "html.parser")
     # check whether the advert is not deleted
     try:
         message_text = (
@@ -165,28 +167,20 @@ def get_product_data(session, property_url):
 #     return product_data
 
 
+def qefira_site(category_slug):
+    return Site(
+        f"qefira/{category_slug}",
+        partial(get_page_links, category_slug=category_slug),
+        parse_product_links,
+        parse_product_data,
+        concurrency=8,
+        rate=2.0,
+    )
 
-def get_product_category_data(session, category_slug):
-    print(f"\nGetting data for category {category_slug} ...")
-    pages = get_page_links(session, category_slug)
-    product_urls = []
-    for page in pages:
-        product_urls.extend(get_product_links(session, page))
-
-    product_data = []
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        future_to_url = {executor.submit(get_product_data, session, url): url for url in product_urls}
-        for future in as_completed(future_to_url):
-            url = future_to_url[future]
-            try:
-                data = future.result()
-            except Exception as exc:
-                print(f'{url} generated an exception: {exc}')
-            else:
-                product_data.append(data)
-                time.sleep(1)
-    return product_data
 
+async def get_product_category_data(crawler, category_slug, early_stop=None):
+    print(f"\nGetting data for category {category_slug} ...")
+    return await crawl(qefira_site(category_slug), crawler, early_stop=early_stop)
 
 
 def save_category_data(category_data, category_slug, timestamp=None):
@@ -199,10 +193,8 @@ def save_category_data(category_data, category_slug, timestamp=None):
     print(f"Saved data for category `{category_slug}` under `{file_path}`.")
 
 
-def get_category_slugs(session):
-    response = session.get(
-        "https://www.qefira.com/property-rentals-sales", headers=headers
-    )
+async def get_category_slugs(crawler):
+    response = await crawler.get("https://www.qefira.com/property-rentals-sales")
     soup = BeautifulSoup(response.content, "html.parser")
     slugs = [
         item.attrs["href"]
@@ -215,25 +207,32 @@ def get_category_slugs(session):
     return slugs
 
 
-def main():
-    session = requests.Session()
-    # category_slugs = get_category_slugs(session)
-    category_slugs = [
-        "apartments-for-sale",
-        "houses-for-sale",
-        "apartments-for-rent",
-        "houses-for-rent",
-        "commercial-property-for-sale",
-        "land-for-sale",
-        "commercial-property-for-rent",
-        "bedsitters-rooms-for-rent",
-    ]
-    for category_slug in category_slugs:
-        category_data = get_product_category_data(session, category_slug)
-        save_category_data(category_data, category_slug)
-        time.sleep(1)
+async def main():
+    # Only the new properties, but every page of every category once in a while
+    seen = SeenIndex()
+    full_sweep = seen.sweep_due("qefira")
+    cache = HTTPCache()
+    async with Crawler(headers=headers, cache=cache) as crawler:
+        # category_slugs = await get_category_slugs(crawler)
+        category_slugs = [
+            "apartments-for-sale",
+            "houses-for-sale",
+            "apartments-for-rent",
+            "houses-for-rent",
+            "commercial-property-for-sale",
+            "land-for-sale",
+            "commercial-property-for-rent",
+            "bedsitters-rooms-for-rent",
+        ]
+        for category_slug in category_slugs:
+            early_stop = EarlyStop(seen, "qefira", full_sweep=full_sweep)
+            category_data = await get_product_category_data(
+                crawler, category_slug, early_stop
+            )
+            save_category_data(category_data, category_slug)
+    seen.close()
+    cache.close()
 
 
 if __name__ == "__main__":
-    main()
-
+    asyncio.run(main())
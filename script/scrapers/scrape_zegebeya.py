@@ -1,13 +1,30 @@
+import asyncio
 import os
-import re
 import time
-import requests
 from bs4 import BeautifulSoup
 import json
 
-
-def get_property_types(session, url):
-    r = session.get(url)
+from ..helpers.helpers_crawl import Crawler, Site, crawl
+from ..helpers.helpers_parse import (
+    find_js_object,
+    find_json_ld,
+    parse_html,
+    parse_subtrees,
+)
+from ..helpers.helpers_httpcache import HTTPCache
+from ..helpers.helpers_seen import EarlyStop, SeenIndex
+
+# The parts of a property page `parse_property_details` reads, see `helpers_parse.parse_subtrees`
+DETAIL_SUBTREES = [
+    "div.rh-ultra-content-container",
+    "div.rh-ultra-property-content",
+    "div.rh-ultra-property-carousel",
+]
+PROPERTY_LINK_SELECTOR = "#properties-listing div.rh-ultra-page-content div.rh-ultra-list-box > div.rh-ultra-list-card div.rh-ultra-list-card-detail div.rh-ultra-title-address > h3 > a[href]"
+
+
+async def get_property_types(crawler, url):
+    r = await crawler.get(url)
     soup = BeautifulSoup(r.content, "html.parser")
     # types = soup.select("#property_types_widget-2 > ul > li a[href]")
     # only the broad groups: commercial and residential
@@ -17,36 +34,22 @@ def get_property_types(session, url):
     return dict(zip(keys, types))
 
 
-def get_property_links(session, property_type):
-    url = f"https://www.zegebeya.com/property-type/{property_type}/"
+def parse_property_links(html, page_url):
+    soup = BeautifulSoup(html, "html.parser")
+    page_links = soup.select(PROPERTY_LINK_SELECTOR)
+    return [l.attrs["href"] for l in page_links]
 
-    links = []
-    page = 1
 
-    while True:
-        print(f"Scraping page {page}...")
+# Page 2, 3, ... of a listing, until a 404
+def next_page(url, page):
+    return url + "/page/" + str(page)
 
-        try:
-            r = session.get(url + "/page/" + str(page))
-            soup = BeautifulSoup(r.content, "html.parser")
-            r.raise_for_status()
-        except requests.HTTPError:
-            if r.status_code == 404:
-                print("Looks like we've reached the end of pages.")
-                break
-        else:
-            page_links = soup.select(
-                "#properties-listing div.rh-ultra-page-content div.rh-ultra-list-box > div.rh-ultra-list-card div.rh-ultra-list-card-detail div.rh-ultra-title-address > h3 > a[href]"
-            )
-            links.extend([l.attrs["href"] for l in page_links])
-            page += 1
-
-    return links
-
-
-def extract_property_details(session, property_link):
-    response = session.get(property_link)
-    soup = BeautifulSoup(response.content, "html.parser")
+
+def parse_property_details(html, property_link, backend=None, targeted=True):
+    if targeted:
+        soup = parse_subtrees(html, DETAIL_SUBTREES, backend)
+    else:
+        soup = parse_html(html, backend)
 
     PROPERTY_CONTENT_SELECTOR = "div.rh-ultra-property-content"
 
@@ -67,8 +70,6 @@ def extract_property_details(session, property_link):
         "div.rh-ultra-content-container div.page-head-inner p.rh-ultra-property-address"
     )
     NUM_IMAGES_SELECTOR = "div.rh-ultra-property-carousel.rh-ultra-horizontal-carousel-trigger[data-count]"
-    MAP_DATA_SELECTOR = "script#property-open-street-map-js-extra"
-    JSON_LD_SELECTOR = "script[type='application/ld+json'].yoast-schema-graph"
 
     def _get_text(element):
         try:
@@ -111,24 +112,19 @@ def extract_property_details(session, property_link):
 
     # parse property_map_data mainly for property address ----
     property_address_text = _get_text(soup.select_one(ADDRESS_SELECTOR))
-    property_map_data = _get_text(soup.select_one(MAP_DATA_SELECTOR))
-
-    match = re.search(r"var propertyMapData = (\{.*\});", property_map_data)
-    if not match:
+    # straight from the page's text, script#property-open-street-map-js-extra
+    data = find_js_object(html, "propertyMapData")
+    if data is None:
         raise ValueError("JSON data not found in `property_map_data`.")
 
-    json_data = match.group(1)
-    data = json.loads(json_data)
-
     title = data.get("title")
-    property_type = BeautifulSoup(data.get("propertyType", ""), "html.parser").text
+    property_type = parse_html(data.get("propertyType", ""), backend).text
     price = data.get("price")
     latitude = data.get("lat")
     longitude = data.get("lng")
 
     # parse JSON_LD_DATA for date_info ----
-    json_ld_data = _get_text(soup.select_one(JSON_LD_SELECTOR))
-    json_ld_data = json.loads(json_ld_data)["@graph"][0]
+    json_ld_data = find_json_ld(html, "yoast-schema-graph")[0]["@graph"][0]
     date_info = {
         "date_published": json_ld_data.get("datePublished"),
         "date_modified": json_ld_data.get("dateModified"),
@@ -155,41 +151,45 @@ def extract_property_details(session, property_link):
     return details
 
 
-def get_category_data(session, property_type):
+def zegebeya_site(property_type):
+    return Site(
+        f"zegebeya/{property_type}",
+        [f"https://www.zegebeya.com/property-type/{property_type}/"],
+        parse_property_links,
+        parse_property_details,
+        next_page=next_page,
+    )
+
+
+async def get_category_data(crawler, property_type, early_stop=None):
     print(f"Getting data for `{property_type}` properties.")
-    property_urls = get_property_links(session, property_type)
-    category_data = []
-    print(f"Getting data for {len(property_urls)} properties.")
-    counter = 1
-    for property_url in property_urls:
-        try:
-            category_data.append(extract_property_details(session, property_url))
-        except Exception as e:
-            print(f"Error while scraping {property_url}: {e}")
-        if counter % 25 == 0:
-            print(f"Extracted data for {counter}/{len(property_urls)} properties.")
-        counter += 1
-        time.sleep(0.1)
-    return category_data
-
-
-def main():
-    session = requests.Session()
+    return await crawl(zegebeya_site(property_type), crawler, early_stop=early_stop)
+
+
+async def main():
     url = "https://zegebeya.com/properties-search/"
-    types = get_property_types(session, url)
     timestamp = time.strftime("%Y-%m-%d")
-    for type in types.keys():
-        file_path = f"data/housing/raw/zegebeya/{type}_{timestamp}.json"
-        category_data = get_category_data(session, type)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w") as f:
-            json.dump(category_data, f, indent=2, ensure_ascii=False)
-        print(f"Saved data for `{type}` to {file_path}")
-        print("-" * 25)
+    # Only the new properties, but every page of every type once in a while
+    seen = SeenIndex()
+    full_sweep = seen.sweep_due("zegebeya")
+    cache = HTTPCache()
+    async with Crawler(cache=cache) as crawler:
+        types = await get_property_types(crawler, url)
+        for type in types.keys():
+            file_path = f"data/housing/raw/zegebeya/{type}_{timestamp}.json"
+            early_stop = EarlyStop(seen, "zegebeya", full_sweep=full_sweep)
+            category_data = await get_category_data(crawler, type, early_stop)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "w") as f:
+                json.dump(category_data, f, indent=2, ensure_ascii=False)
+            print(f"Saved data for `{type}` to {file_path}")
+            print("-" * 25)
+    seen.close()
+    cache.close()
 
 
 if __name__ == "__main__":
     st = time.time()
-    main()
+    asyncio.run(main())
     et = time.time()
     print(f"Total time: {et - st}")
@@ -1,4 +1,11 @@
+import argparse
+import contextlib
+import hashlib
+import io
 import json
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 import re
 import pandas as pd
@@ -6,8 +13,14 @@ import sys
 
 sys.path.append("./script/")
 from property_schema import PROPERTY_SCHEMA
-from helpers.helpers_io import write_to_csv, read_json
-
+from helpers.helpers_io import iter_json_array, read_json, write_json, write_to_csv
+from helpers.helpers_json import loads_tolerant
+from helpers.helpers_schema import (
+    ColumnBuffers,
+    CompiledSchema,
+    compact_frame,
+    na_fractions,
+)
 
 
 def escape_quotes(text):
@@ -33,7 +46,33 @@ def escape_quotes(text):
     return text
 
 
-def parse_json(text):
+def parse_json(text, repairs=None):
+    """
+    Parse the JSON block of a model output, repairing it in a single pass if needed (see
+    `helpers_json.repair_json`). The repairs applied are counted into `repairs`, if given.
+    """
+    if isinstance(text, list) and len(text) == 1:
+        text = text[0]
+    if not isinstance(text, str):
+        raise TypeError("Expecting a string.")
+    elif not text.startswith("```json"):
+        raise ValueError("Expecting a markdown code block with JSON.")
+
+    try:
+        value, applied = loads_tolerant(text)
+    except ValueError as e:
+        print(
+            f"Error: Invalid JSON (just give up) for input <<{text[0:10]}...{text[-10:]}>>"
+        )
+        raise e
+    if repairs is not None:
+        for name, count in applied.items():
+            repairs[name] = repairs.get(name, 0) + count
+    return value
+
+
+def parse_json_cascade(text):
+    """The previous `parse_json`: `json.loads` retried after each of a cascade of regex rewrites."""
     if isinstance(text, list) and len(text) == 1:
         text = text[0]
     if not isinstance(text, str):
@@ -84,14 +123,8 @@ def get_list_keys(record: dict):
     return list_keys
 
 
-def expand_dict_on_list_values(record):
-    """
-    Expand a dict with values of list of dicts into multiple records.
-    """
-    list_keys = get_list_keys(record)
-    if not list_keys:
-        return record
-
+def expansion_length(record, list_keys):
+    """The number of records to expand a dict with values of list of dicts into."""
     lengths = list({len(record[key]) for key in list_keys})
     if len(lengths) > 1:
         length = min(lengths)
@@ -100,6 +133,18 @@ def expand_dict_on_list_values(record):
         )
     else:
         length = lengths[0]
+    return length
+
+
+def expand_dict_on_list_values(record):
+    """
+    Expand a dict with values of list of dicts into multiple records.
+    """
+    list_keys = get_list_keys(record)
+    if not list_keys:
+        return record
+
+    length = expansion_length(record, list_keys)
 
     records = []
     for i in range(length):
@@ -111,12 +156,21 @@ def expand_dict_on_list_values(record):
     return records
 
 
-def tidy_attributes(json_path):
+def tidy_attributes(json_path, schema=None):
     """
     Tidy attributes json data extracted with gemini-pro.
     """
-    data = read_json(json_path)
-    d = []
+    if schema is None:
+        schema = CompiledSchema(load_schema())
+    return tidy_records(read_json(json_path), schema)
+
+
+def tidy_records(data, schema):
+    """
+    Tidy extracted records. Each record is cast to the types of `schema` (a `CompiledSchema`)
+    and flattened as it is read, into column buffers.
+    """
+    d = ColumnBuffers(schema)
     bad_keys = []
     for item in data:
         output = item.get("output")
@@ -146,41 +200,23 @@ def tidy_attributes(json_path):
                     # e.g. "price": [{'amount': 2000, 'currency': 'ETB'}, {'amount': 3000, 'currency': 'ETB'}]
                     list_keys = get_list_keys(output)
                     if list_keys:
-                        expanded = expand_dict_on_list_values(output)
-                        for i, expanded_i in enumerate(expanded):
-                            nid = (
-                                f"{item['id']}_expand_suffix_{str(i)}"
-                                if i > 0
-                                else item["id"]
-                            )
-                            d.append(
-                                {
-                                    "id": nid,
-                                    **expanded_i,
-                                    "input": item["input"],
-                                }
-                            )
+                        # Child rows of the record, the input text is kept on the first one only
+                        length = expansion_length(output, list_keys)
+                        d.append_expanded(
+                            item["id"], output, list_keys, length, item["input"]
+                        )
                     else:
-                        d.append({"id": item["id"], **output, "input": item["input"]})
+                        d.append(item["id"], output, item["input"])
             elif lo > 1:
-                for i in range(lo):
-                    nid = f"{item['id']}_multi_suffix_{str(i)}" if i > 0 else item["id"]
-                    d.append({"id": nid, **output[i], "input": item["input"]})
+                d.append_children(item["id"], output, item["input"], "multi")
         elif isinstance(output, dict):
-            d.append({"id": item["id"], **output, "input": item["input"]})
+            d.append(item["id"], output, item["input"])
 
-    data_tidy = pd.json_normalize(d)
-
-    def _join_list(x):
-        if isinstance(x, list):
-            return ";".join(str(element) for element in x)
-        else:
-            return x
-
-    for var in data_tidy.columns:
-        data_tidy[var] = data_tidy[var].apply(_join_list)
-
-    return data_tidy
+    if schema.errors:
+        print(
+            f"Warning: Values not matching the schema types set to NA: {schema.errors}"
+        )
+    return d.to_frame()
 
 
 def filter_cols_by_NA_frac(df, threshold=0.95, include_list=None, verbose=True):
@@ -212,8 +248,8 @@ def filter_cols_by_NA_frac(df, threshold=0.95, include_list=None, verbose=True):
 
     include_set = set(include_list)
 
-    # Calculate the fraction of NA values for all columns
-    na_frac = df.isna().mean()
+    # Calculate the fraction of NA values for all columns (from the sparse/categorical metadata)
+    na_frac = na_fractions(df)
 
     # Determine columns to drop based on threshold and include_list
     drop_cols = [
@@ -276,13 +312,18 @@ def load_schema(schema: str = PROPERTY_SCHEMA) -> dict:
 
 def clean_and_prep_data(data_path: str, schema: dict, include_list: list):
     # Tidy the data
-    data_extracted = tidy_attributes(data_path)
+    schema = CompiledSchema(schema)
+    data_extracted = tidy_attributes(data_path, schema)
+    return split_main_extra(data_extracted, schema, include_list)
+
 
+def split_main_extra(data_extracted, schema, include_list):
+    """The main variables (defined in the schema) and the extra ones of the tidy data."""
     # Drop 'all NA' columns upfront
     data_extracted = filter_cols_by_NA_frac(data_extracted, 0.99)
 
     # key vars + vars defined in the schema -> main_vars
-    cols_main = ["id", "input"] + list(pd.json_normalize(schema).columns)
+    cols_main = ["id", "input"] + schema.columns
     cols_main = list(dict.fromkeys(cols_main))  # Remove duplicates
 
     # Drop vars not in the df
@@ -309,18 +350,148 @@ def clean_and_prep_data(data_path: str, schema: dict, include_list: list):
     return data_extracted_main, data_extracted_extra
 
 
-def main():
+# Chunked, parallel tidying ----
+# The records of an extraction file are tidied in chunks by a pool of workers, and each chunk is
+# written as a partition (a pickle, which keeps the dtypes) as soon as it is done. A manifest keeps
+# a hash of each record, so that a rerun with `only_changed` re-tidies only the new or changed
+# records; the final `__tidy`/`__extra` CSVs are assembled from the latest partition of each id.
+SUFFIX_RE = re.compile(r"_(multi|expand)_suffix_\d+$")
+
+
+def record_hash(item):
+    """A hash of an extracted record (its input and output)."""
+    data = json.dumps(item, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def _tidy_chunk(chunk, schema):
+    # Runs in a worker; the cast errors are counted in the worker's copy of the schema
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        data_tidy = tidy_records(chunk, schema)
+    return data_tidy, schema.errors, out.getvalue()
+
+
+def load_manifest(parts_dir):
+    """{"parts": [partition files], "hashes": {id: record hash}, "part_of": {id: partition index}}"""
+    try:
+        return read_json(parts_dir / "manifest.json")
+    except FileNotFoundError:
+        return {"parts": [], "hashes": {}, "part_of": {}}
+
+
+def assemble_partitions(parts_dir, parts, part_of):
+    """The tidy data of each id from its partition, `part_of` = {id: partition index}."""
+    frames = []
+    for i, part in enumerate(parts):
+        frame = pd.read_pickle(parts_dir / part)
+        frames.append(frame.assign(_part=i))
+    if not frames:
+        return pd.DataFrame(columns=["id", "input"])
+    data_tidy = pd.concat(frames, ignore_index=True)
+    base_ids = data_tidy["id"].astype(str).str.replace(SUFFIX_RE, "", regex=True)
+    keep = data_tidy["_part"] == base_ids.map(part_of)
+    return data_tidy[keep].drop(columns="_part").reset_index(drop=True)
+
+
+def tidy_partitioned(
+    path,
+    out_dir,
+    schema,
+    include_list,
+    executor,
+    workers=4,
+    chunk_size=2000,
+    only_changed=False,
+):
+    """
+    Tidy an extraction file in chunks on `executor` (e.g. a `ProcessPoolExecutor`), writing
+    each chunk as a partition under `out_dir / "parts" / <file stem>`, then assemble the
+    `__tidy` and `__extra` CSVs; at most twice as many chunks as the `workers` of `executor`
+    are in flight. With `only_changed`, only the records whose hash changed since the last run
+    are tidied again.
+    """
+    parts_dir = out_dir / "parts" / path.stem
+    if not only_changed and parts_dir.exists():
+        shutil.rmtree(parts_dir)
+    manifest = load_manifest(parts_dir)
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    old_hashes, old_part_of = manifest["hashes"], manifest["part_of"]
+    hashes = {}
+    part_of = {}
+    errors = {}
+    max_pending = 2 * workers
+    pending = {}
+
+    def _collect(futures):
+        for future in futures:
+            part = pending.pop(future)
+            data_tidy, chunk_errors, out = future.result()
+            if out:
+                print(out, end="")
+            for field, n in chunk_errors.items():
+                errors[field] = errors.get(field, 0) + n
+            data_tidy.to_pickle(parts_dir / part)
+
+    # Partitions are named in sequence, kept ones may have any number
+    part_number = max((int(p[5:10]) for p in manifest["parts"]), default=-1) + 1
+    n_changed = 0
+    for chunk in iter_json_array(path, chunk_size):
+        changed = []
+        for item in chunk:
+            key = str(item["id"])
+            hashes[key] = record_hash(item)
+            if old_hashes.get(key) == hashes[key]:
+                part_of[key] = old_part_of[key]
+            else:
+                changed.append(item)
+                part_of[key] = len(manifest["parts"])
+        if not changed:
+            continue
+        n_changed += len(changed)
+        part = f"part-{part_number:05d}.pkl"
+        part_number += 1
+        manifest["parts"].append(part)
+        pending[executor.submit(_tidy_chunk, changed, schema)] = part
+        if len(pending) >= max_pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            _collect(done)
+    _collect(list(pending))
+    # Partitions whose records were all tidied again since, or are no longer in the file
+    used = sorted(set(part_of.values()))
+    for i, part in enumerate(manifest["parts"]):
+        if i not in used:
+            (parts_dir / part).unlink(missing_ok=True)
+    renumber = {old: new for new, old in enumerate(used)}
+    manifest["parts"] = [manifest["parts"][i] for i in used]
+    part_of = {key: renumber[i] for key, i in part_of.items()}
+    manifest["hashes"], manifest["part_of"] = hashes, part_of
+    write_json(manifest, parts_dir / "manifest.json", overwrite=True, verbose=False)
+    print(f"Tidied {n_changed}/{len(hashes)} records of {path.name}.")
+    if errors:
+        print(f"Warning: Values not matching the schema types set to NA: {errors}")
+
+    data_tidy = assemble_partitions(parts_dir, manifest["parts"], part_of)
+    data_tidy = compact_frame(data_tidy, schema.dtypes)
+    data_main, data_extra = split_main_extra(data_tidy, schema, include_list)
+    write_to_csv(data_main, out_dir / (path.stem + "__tidy.csv"))
+    write_to_csv(data_extra, out_dir / "extra" / (path.stem + "__extra.csv"))
+    return data_main, data_extra
+
+
+def main(workers=None, chunk_size=2000, only_changed=False):
     # Import data ----
     data_dir = Path("./data/housing/processed/structured/")
     data_paths = [
-      "listings_cleaned__extracted_property_attributes__gemini.json",
-    "loozap_cleaned__extracted_property_attributes__gemini.json",
-       "ethiopianproperties_cleaned__extracted_property_attributes__gemini.json",
-       "ethiopiapropertycentre_cleaned__extracted_property_attributes__gemini.json",
+        "listings_cleaned__extracted_property_attributes__gemini.json",
+        "loozap_cleaned__extracted_property_attributes__gemini.json",
+        "ethiopianproperties_cleaned__extracted_property_attributes__gemini.json",
+        "ethiopiapropertycentre_cleaned__extracted_property_attributes__gemini.json",
     ]
     data_paths = [data_dir / p for p in data_paths]
+    # The ads extracted by the rule-based fast path, see `extract_property_attributes_rules.py`
+    data_paths += sorted(data_dir.glob("*_rules.json"))
 
-    schema = load_schema(PROPERTY_SCHEMA)
+    schema = CompiledSchema(load_schema(PROPERTY_SCHEMA))
 
     # Keep them even with high number of NA values
     include_list = [
@@ -332,18 +503,32 @@ def main():
         "additional.pets_allowed",
     ]
 
-    for path in data_paths:
-        print(f"Processing {path.name} ...")
-        data_main, data_extra = clean_and_prep_data(path, schema, include_list)
-
-        # Important ones
-        write_to_csv(data_main, data_dir / "tidy" / (path.stem + "__tidy.csv"))
-
-        # Extra
-        write_to_csv(
-            data_extra, data_dir / "tidy" / "extra" / (path.stem + "__extra.csv")
-        )
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path in data_paths:
+            print(f"Processing {path.name} ...")
+            tidy_partitioned(
+                path,
+                data_dir / "tidy",
+                schema,
+                include_list,
+                executor,
+                workers=workers,
+                chunk_size=chunk_size,
+                only_changed=only_changed,
+            )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Tidy the attributes extracted with Gemini."
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument(
+        "--only-changed",
+        action="store_true",
+        help="Only re-tidy the records that changed since the last run.",
+    )
+    args = parser.parse_args()
+    main(args.workers, args.chunk_size, args.only_changed)
@@ -0,0 +1,24 @@
+from script.helpers.helpers_dedup import field_overrides, group_near_duplicates
+
+BOILERPLATE = (
+    "Apartment for sale in Bole, near Edna Mall. Modern finishing, parking, lift, "
+    "24 hour security and water tank. Title deed ready. Call our agent for a visit, "
+    "we have many more houses and apartments across Addis Ababa."
+)
+
+
+def test_near_duplicates_differing_in_rooms_and_size_are_not_merged():
+    a = f"2 bed, 95 sqm. {BOILERPLATE} 0911223344"
+    b = f"3 bed, 150 sqm. {BOILERPLATE} 0911223344"
+    assert field_overrides(a, b) is None
+    assert group_near_duplicates([a, b]) == {a: {a: {}}, b: {b: {}}}
+
+
+def test_near_duplicates_differing_in_phone_and_price_are_patched():
+    a = f"2 bed, 95 sqm. {BOILERPLATE} price 5.5 million 0911223344"
+    b = f"2 bed, 95 sqm. {BOILERPLATE} price 6 million 0922334455"
+    assert field_overrides(a, b) == {
+        "seller.contact.phone": "0922334455",
+        "price.amount": 6_000_000,
+    }
+    assert len(group_near_duplicates([a, b])) == 1